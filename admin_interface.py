@@ -1,8 +1,11 @@
 import threading
-import os
 from datetime import datetime
+from html import escape
+from urllib.parse import parse_qs, urlsplit
 import base64
+import json
 import socket
+from logger import LOG_LEVELS
 
 
 class AdminInterface:
@@ -11,6 +14,9 @@ class AdminInterface:
         self.host = config.get("host", "0.0.0.0")
         self.admin_port = config.get("admin_port", 8081)
         self.logger = logger
+        self.max_log_lines = config.get("admin_max_log_lines", 10000)
+        # Worker processes write their own entries, which this process's ring buffer never sees.
+        self.read_log_file = config.get("workers", 1) > 1
         # Hardcoded credentials:
         self.username = "admin"
         self.password = "adminpass"
@@ -67,22 +73,142 @@ class AdminInterface:
                 client_conn.close()
                 return
 
-            # Generate admin page HTML content
+            request_line = lines[0].split()
+            method, path, query = request_line[0] if request_line else "GET", "/", {}
+            if len(request_line) > 1:
+                target = urlsplit(request_line[1])
+                path, query = target.path, parse_qs(target.query)
 
-            html = self.generate_admin_page()
+            # Machine-readable metrics for scrapers and dashboards
+            if path == "/metrics.json":
+                body = json.dumps(self.metrics_document(), indent=2, default=str)
+                self.send_body(client_conn, body, "application/json")
+                return
+            if path == "/metrics":
+                body = self.logger.metrics.prometheus()
+                self.send_body(client_conn, body, "text/plain; version=0.0.4")
+                return
+            if path.startswith("/profile/"):
+                self.handle_profile(client_conn, method, path, query)
+                return
 
-            # Build response headers
-            response_headers = "HTTP/1.1 200 OK\r\n"
-            response_headers += "Content-Type: text/html\r\n"
-            response_headers += f"Content-Length: {len(html.encode('utf-8'))}r\n"
-            response_headers += "Connection: close\r\n\r\n"
-            response = response_headers + html
-            client_conn.sendall(response.encode("utf-8"))
+            # Generate admin page HTML content, honouring ?lines=N&level=LEVEL
+            try:
+                log_lines = int(query.get("lines", ["10"])[0])
+            except ValueError:
+                log_lines = 10
+            level = query.get("level", [None])[0]
+            if level is not None:
+                level = level.upper()
+                if level not in LOG_LEVELS:
+                    level = None
+
+            html = self.generate_admin_page(log_lines, level)
+            self.send_body(client_conn, html, "text/html")
         except Exception as e:
             print(f"Error handling admin request from {client_addr}: {e}")
         finally:
             client_conn.close()
 
+    def send_body(self, client_conn, body, content_type, status="200 OK", headers=None):
+        """Send a response and let the connection close.
+
+        Args:
+            client_conn (socket.socket): The admin client socket.
+            body (str): The response body.
+            content_type (str): The Content-Type header value.
+            status (str, optional): Status code and reason. Defaults to "200 OK".
+            headers (dict, optional): Extra response headers. Defaults to None.
+        """
+        body = body.encode("utf-8")
+        response_headers = f"HTTP/1.1 {status}\r\n"
+        response_headers += f"Content-Type: {content_type}\r\n"
+        for name, value in (headers or {}).items():
+            response_headers += f"{name}: {value}\r\n"
+        response_headers += f"Content-Length: {len(body)}\r\n"
+        response_headers += "Connection: close\r\n\r\n"
+        client_conn.sendall(response_headers.encode("utf-8") + body)
+
+    def handle_profile(self, client_conn, method, path, query):
+        """Serve the profiler endpoints.
+
+        POST /profile/start?seconds=N&mode=sample|cprofile opens a profiling
+        window, POST /profile/stop closes it early, /profile/status reports
+        its state and /profile/report downloads the last report
+        (?format=folded gives the collapsed stacks of a sampling profile, for
+        flame graph tools). Start and stop change state, so they refuse GET.
+
+        Args:
+            client_conn (socket.socket): The admin client socket.
+            method (str): The request method.
+            path (str): The request path.
+            query (dict): The parsed query string.
+        """
+        profiler = self.logger.profiler
+        if self.read_log_file:
+            # Requests are served by the worker processes, which this process can't profile.
+            self.send_body(
+                client_conn,
+                "Profiling is only available when a single process serves requests.\n",
+                "text/plain",
+                "409 Conflict",
+            )
+            return
+        if path in ("/profile/start", "/profile/stop") and method != "POST":
+            self.send_body(
+                client_conn,
+                "Use POST to start or stop profiling.\n",
+                "text/plain",
+                "405 Method Not Allowed",
+                {"Allow": "POST"},
+            )
+            return
+        if path == "/profile/start":
+            try:
+                seconds = float(query.get("seconds", ["10"])[0])
+                profiler.start(seconds, query.get("mode", ["sample"])[0])
+            except ValueError as e:
+                self.send_body(client_conn, f"{e}\n", "text/plain", "400 Bad Request")
+                return
+            except RuntimeError as e:
+                self.send_body(client_conn, f"{e}\n", "text/plain", "409 Conflict")
+                return
+        elif path == "/profile/stop":
+            profiler.stop()
+        elif path == "/profile/report":
+            if query.get("format", [None])[0] == "folded":
+                report, extension = profiler.folded, "folded"
+            else:
+                report, extension = profiler.report, "txt"
+            if report is None:
+                self.send_body(
+                    client_conn, "No profile report yet.\n", "text/plain", "404 Not Found"
+                )
+                return
+            self.send_body(
+                client_conn,
+                report,
+                "text/plain",
+                headers={
+                    "Content-Disposition": f"attachment; filename=profile.{extension}"
+                },
+            )
+            return
+        elif path != "/profile/status":
+            self.send_body(client_conn, "Not found.\n", "text/plain", "404 Not Found")
+            return
+        self.send_body(client_conn, json.dumps(profiler.status()), "application/json")
+
+    def metrics_document(self):
+        """Build the /metrics.json document.
+
+        Returns:
+            dict: The metrics snapshot plus every registered stats section.
+        """
+        document = self.logger.metrics.snapshot()
+        document["stats"] = self.logger.collect_stats()
+        return document
+
     def is_authenticated(self, headers):
         """Check if the request contains valid HTTP Basic Authentication credentials.
 
@@ -104,28 +230,31 @@ class AdminInterface:
                 pass
         return False
 
-    def generate_admin_page(self):
-        """Generate the HTML content for the admin interface page. Display total reqeust, active connections, uptime, and the lat 10 log entries.
+    def generate_admin_page(self, log_lines=10, level=None):
+        """Generate the HTML content for the admin interface page. Display total reqeust, active connections, uptime, and the most recent log entries.
+
+        Recent entries come from the logger's in-memory ring buffer; only
+        windows larger than the buffer fall back to reading the end of the log file.
+
+        Args:
+            log_lines (int, optional): Number of log entries to show. Defaults to 10.
+            level (str, optional): Only show entries of this level (REQUEST/ERROR/STATS). Defaults to None.
 
         Returns:
-            _type_: _description_
+            str: The HTML page.
         """
         total_reqeusts = self.logger.total_requests
-        active_connections = self.logger.active_connections
+        metrics = self.logger.metrics.snapshot()
         uptime = int((datetime.now() - self.logger.start_time).total_seconds())
 
-        # Read the last 10 lines from the log file
-        log_line = []
+        log_lines = max(1, min(log_lines, self.max_log_lines))
         try:
-            if os.path.exists(self.logger.log_file):
-                with open(self.logger.log_file, "r") as f:
-                    all_lines = f.readlines()
-                    log_lines = all_lines[-10:]
+            if log_lines <= self.logger.recent.maxlen and not self.read_log_file:
+                entries = self.logger.recent_entries(log_lines, level)
             else:
-                log_lines = ["Log file not found."]
-
+                entries = self.logger.tail(log_lines, level)
         except Exception:
-            log_lines = ["Error reading log file."]
+            entries = ["Error reading log entries."]
 
         # Build HTML content with embedded CSS and meta refresh
         html = "<html><head><title>Admin Interface</title>"
@@ -142,17 +271,74 @@ class AdminInterface:
         html += "<h1>Admin Interface </h1>"
         html += f"<p><strong>Total Requests:</strong> {total_reqeusts}</p>"
         html += f"<p><strong>Server Uptime:</strong> {uptime} seconds</p>"
+        html += "<p>Metrics: <a href='/metrics.json'>JSON</a> | <a href='/metrics'>Prometheus</a></p>"
+        html += "<h2>Request Latency</h2>"
+        if metrics["requests"]:
+            html += (
+                "<table><tr><th>Method</th><th>Status</th><th>Count</th>"
+                "<th>Mean (ms)</th><th>p50 (ms)</th><th>p95 (ms)</th><th>p99 (ms)</th></tr>"
+            )
+            for row in metrics["requests"]:
+                html += (
+                    f"<tr><td>{escape(row['method'])}</td><td>{row['status']}</td><td>{row['count']}</td>"
+                    f"<td>{row['mean_ms']}</td><td>{row['p50_ms']}</td>"
+                    f"<td>{row['p95_ms']}</td><td>{row['p99_ms']}</td></tr>"
+                )
+            html += "</table>"
+        else:
+            html += "<p>No requests yet.</p>"
+        if metrics["phases"]:
+            html += (
+                "<h2>Request Phases</h2>"
+                "<table><tr><th>Phase</th><th>Mean (ms)</th><th>Share of Time</th></tr>"
+            )
+            for row in metrics["phases"]:
+                html += (
+                    f"<tr><td>{row['phase']}</td><td>{row['mean_ms']}</td>"
+                    f"<td>{row['share']:.1%}</td></tr>"
+                )
+            html += "</table>"
+        if not self.read_log_file:
+            html += "<h2>Profiler</h2><table>"
+            for name, value in self.logger.profiler.status().items():
+                html += f"<tr><td>{escape(name)}</td><td>{escape(str(value))}</td></tr>"
+            html += (
+                "</table><p>"
+                "<form method='post' action='/profile/start?seconds=10' style='display:inline'>"
+                "<button>Start 10 s sampling</button></form> "
+                "<form method='post' action='/profile/start?seconds=10&amp;mode=cprofile'"
+                " style='display:inline'><button>Start 10 s cProfile</button></form> "
+                "<form method='post' action='/profile/stop' style='display:inline'>"
+                "<button>Stop</button></form>"
+                " | Download: <a href='/profile/report'>report</a>"
+                " | <a href='/profile/report?format=folded'>folded stacks</a></p>"
+            )
         html += "<h2>Active Connections</h2>"
-        if active_connections:
-            html += "<table><tr><th>Client IP</th><th>Connection Time</th><tr>"
-            for ip, conn_time in active_connections.items():
-                html += f"<tr><td>{ip}</td><td>{conn_time}</td></tr>"
+        if metrics["connections"]:
+            html += (
+                "<table><tr><th>Client IP</th><th>Port</th><th>Connected At</th>"
+                "<th>Requests</th><th>Last Request</th></tr>"
+            )
+            for conn in metrics["connections"]:
+                html += (
+                    f"<tr><td>{conn['client_ip']}</td><td>{conn['client_port']}</td>"
+                    f"<td>{conn['connected_at']}</td><td>{conn['requests']}</td>"
+                    f"<td>{escape(conn['last_request'])}</td></tr>"
+                )
             html += "</table>"
         else:
             html += "<p>No active connections.</p>"
-        html += "<h2>Last 10 Log Entries</h2><pre>"
-        for line in log_lines:
-            html += line
+        for section, stats in self.logger.collect_stats().items():
+            html += f"<h2>{escape(section)}</h2><table>"
+            for name, value in stats.items():
+                html += f"<tr><td>{escape(str(name))}</td><td>{escape(str(value))}</td></tr>"
+            html += "</table>"
+        title = f"Last {log_lines} {level + ' ' if level else ''}Log Entries"
+        html += f"<h2>{title}</h2><p>Filter: <a href='/?lines={log_lines}'>ALL</a>"
+        for name in LOG_LEVELS[1:]:
+            html += f" | <a href='/?lines={log_lines}&level={name}'>{name}</a>"
+        html += "</p><pre>"
+        html += "".join(escape(entry) for entry in entries)
         html += "</pre>"
         html += "</body></html>"
         return html
@@ -0,0 +1,479 @@
+import asyncio
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http_parser import RequestParseError
+from metrics import REQUEST_PHASES
+from request_handler import HTTPRequestHandler
+
+# Seconds a rejected connection waits for its request before it is closed.
+REJECT_READ_TIMEOUT = 0.5
+
+
+class FileSegment:
+    """A file range the event loop sends with loop.sendfile()."""
+
+    def __init__(self, file, source, offset, count):
+        self.file = file  # A duplicate of the handler's file, owned by the segment
+        self.source = source  # The handler's file object, to extend the segment
+        self.offset = offset
+        self.count = count
+
+
+class ResponseBuffer:
+    """Socket stand-in handed to HTTPRequestHandler by the asyncio engine.
+
+    The handler runs in an executor thread and "sends" into this buffer; the
+    event loop then writes the collected bytes to the real transport. File
+    bodies are not read here: sendfile() keeps a duplicate of the file
+    descriptor so the loop can stream it after the handler has returned.
+    Contiguous sendfile() calls on the same file extend one segment, so a
+    response holds one duplicate per file range, and the loop applies the
+    minimum transfer rate as it sends (enforces_transfer_rate). Access log
+    lines are held until the loop knows whether the body was sent whole.
+
+    Request bodies (uploads) are read from the stream with recv_into(),
+    which blocks the handler's thread on the loop; anything sent before it,
+    such as a 100 Continue, is written to the client first. Streamed
+    responses call flush() after each chunk for the same reason, so their
+    first bytes do not wait for the whole body and the client's reading
+    pace bounds how far the handler runs ahead.
+    """
+
+    enforces_transfer_rate = True
+
+    def __init__(self, reader=None, writer=None, loop=None):
+        self.chunks = []
+        self.log_entries = []  # (client_ip, request_line, status_code)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv_into(self, buffer):
+        data = self.run(self.receive(len(buffer)))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def flush(self):
+        if self.loop is not None and self.chunks:
+            try:
+                self.run(self.write_pending())
+            except socket.timeout:
+                HTTPRequestHandler.connection_guard.record("write_timeout")
+                raise
+
+    def run(self, coroutine):
+        """Run a coroutine on the event loop and wait for it, for at most the socket timeout."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise socket.timeout("timed out")
+
+    async def write_pending(self):
+        chunks, self.chunks = self.chunks, []
+        self.writer.writelines(chunks)
+        await self.writer.drain()
+
+    async def receive(self, size):
+        if self.chunks:
+            await self.write_pending()
+        return await self.reader.read(size)
+
+    def sendall(self, data):
+        self.chunks.append(bytes(data))
+
+    def sendmsg(self, buffers):
+        data = b"".join(buffers)
+        self.chunks.append(data)
+        return len(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        last = self.chunks[-1] if self.chunks else None
+        if (
+            isinstance(last, FileSegment)
+            and last.source is file
+            and last.offset + last.count == offset
+        ):
+            last.count += count
+            return count
+        duplicate = os.fdopen(os.dup(file.fileno()), "rb")
+        self.chunks.append(FileSegment(duplicate, file, offset, count))
+        return count
+
+    def log_request(self, client_ip, request_line, status_code):
+        self.log_entries.append((client_ip, request_line, status_code))
+
+    def write_log(self, logger, complete):
+        """Log the held access log lines; an incomplete body is logged as aborted."""
+        for client_ip, request_line, status_code in self.log_entries:
+            logger.log_request(client_ip, request_line, status_code, aborted=not complete)
+        self.log_entries = []
+
+    def close_files(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, FileSegment):
+                chunk.file.close()
+
+    def close(self):
+        pass
+
+
+class AsyncServer:
+
+    def __init__(self, config, logger, server_socket=None):
+        """Initialize the asyncio server engine.
+
+        Args:
+            config (dict): Configuration parameters.
+            logger (Logger): The logger instance.
+            server_socket (socket.socket, optional): An already listening socket. Defaults to None.
+        """
+        self.config = config
+        self.server_socket = server_socket
+        self.logger = logger
+        self.host = config["host"]
+        self.port = config["port"]
+        self.keep_alive_timeout = config.get("keep_alive_timeout", 5)
+        self.header_timeout = config.get("header_timeout", 10)
+        self.write_timeout = config.get("write_timeout", 30)
+        self.file_chunk_size = config.get("file_chunk_size", 65536)
+        self.max_keep_alive_requests = config.get("max_keep_alive_requests", 100)
+        # Request handling (and therefore file I/O) runs here, never on the loop.
+        self.executor = ThreadPoolExecutor(
+            max_workers=config["max_threads"], thread_name_prefix="async-handler"
+        )
+        self.lock = threading.Lock()
+        self.open_connections = 0
+        self.total_connections = 0
+
+    def run(self):
+        """Run the event loop until the process is stopped."""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        if self.server_socket is not None:
+            server = await asyncio.start_server(
+                self.handle_connection, sock=self.server_socket
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection,
+                self.host,
+                self.port,
+                backlog=self.config.get("listen_backlog", 128),
+            )
+        print(f"HTTP Server (asyncio) is listening on {self.host}:{self.port}")
+        self.logger.log(f"Server started on {self.host}:{self.port} (asyncio engine)")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests from one connection: heads are read on the loop, responses built off it."""
+        client_addr = writer.get_extra_info("peername")
+        guard = HTTPRequestHandler.connection_guard
+        if not guard.admit(client_addr[0]):
+            await self.reject(reader, writer, guard.rejection)
+            return
+        requests_served = 0
+        connection_id, connection_info = self.logger.metrics.connection_opened(
+            client_addr
+        )
+        with self.lock:
+            self.open_connections += 1
+            self.total_connections += 1
+        try:
+            loop = asyncio.get_running_loop()
+            parser = HTTPRequestHandler.create_parser(self.config)
+            while True:
+                keep_alive = requests_served + 1 < self.max_keep_alive_requests
+                phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+                try:
+                    request, request_started = await self.read_request(
+                        reader, parser, phases
+                    )
+                except RequestParseError as e:
+                    requests_served += 1
+                    response, _ = await loop.run_in_executor(
+                        self.executor,
+                        self.build_response,
+                        e,
+                        client_addr,
+                        False,
+                        connection_info,
+                    )
+                    await self.write_response(writer, response)
+                    break
+                if request is None:
+                    break
+                requests_served += 1
+                shedder = HTTPRequestHandler.load_shedder
+                if shedder is not None:
+                    shedder.queued()
+                response, keep_alive = await loop.run_in_executor(
+                    self.executor,
+                    self.build_response,
+                    request,
+                    client_addr,
+                    keep_alive,
+                    connection_info,
+                    phases,
+                    request_started,
+                    parser,
+                    (reader, writer, loop),
+                    time.monotonic(),
+                )
+                if not await self.write_response(writer, response):
+                    break
+                if not keep_alive:
+                    break
+        except Exception as e:
+            self.logger.log_error(f"Error handling connection from {client_addr[0]}: {e}")
+        finally:
+            HTTPRequestHandler.connection_stats.record(requests_served)
+            self.logger.metrics.connection_closed(connection_id)
+            guard.release(client_addr[0])
+            with self.lock:
+                self.open_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def write_response(self, writer, response):
+        """Write a ResponseBuffer to the client, streaming file segments with sendfile.
+
+        File segments are sent in pieces of file_chunk_size bytes (or about
+        one second's worth at the minimum transfer rate, if larger). A client
+        that lets a write stall for write_timeout seconds, or whose file
+        transfer falls below the minimum transfer rate, is abandoned.
+
+        Args:
+            writer (asyncio.StreamWriter): The client stream.
+            response (ResponseBuffer): The handler's output.
+
+        Returns:
+            bool: True if the whole response was written.
+        """
+        loop = asyncio.get_running_loop()
+        guard = HTTPRequestHandler.connection_guard
+        piece = max(self.file_chunk_size, guard.min_transfer_rate)
+        started = time.monotonic()
+        file_bytes = 0  # File bytes sent so far, judged against the minimum rate
+        complete = False
+        try:
+            pending = []  # Consecutive byte chunks, written to the transport in one call
+            for chunk in response.chunks:
+                if not isinstance(chunk, FileSegment):
+                    pending.append(chunk)
+                    continue
+                if pending:
+                    writer.writelines(pending)
+                    pending = []
+                await self.drain(writer)
+                offset, remaining = chunk.offset, chunk.count
+                while remaining:
+                    if file_bytes and guard.too_slow(file_bytes, started):
+                        guard.record("slow_transfer")
+                        return False
+                    # Falls back to bounded reads in an executor if sendfile is unavailable.
+                    written = await asyncio.wait_for(
+                        loop.sendfile(
+                            writer.transport, chunk.file, offset, min(piece, remaining)
+                        ),
+                        self.write_timeout,
+                    )
+                    if not written:
+                        return False
+                    offset += written
+                    remaining -= written
+                    file_bytes += written
+            if pending:
+                writer.writelines(pending)
+            await self.drain(writer)
+            complete = True
+            return True
+        except asyncio.TimeoutError:
+            guard.record("write_timeout")
+            return False
+        finally:
+            response.close_files()
+            response.write_log(self.logger, complete)
+
+    async def reject(self, reader, writer, response):
+        """Send a canned response to a connection that is not served, then close it.
+
+        As in worker_pool.send_and_close(), the request is read before
+        closing: closing with it unread would reset the connection before
+        the client reads the response. The response goes out first, so only
+        the close waits, for at most REJECT_READ_TIMEOUT seconds.
+
+        Args:
+            reader (asyncio.StreamReader): The client stream.
+            writer (asyncio.StreamWriter): The client stream.
+            response (bytes): The complete HTTP response.
+        """
+        writer.write(response)
+        try:
+            await asyncio.wait_for(reader.read(65536), REJECT_READ_TIMEOUT)
+        except (asyncio.TimeoutError, OSError):
+            pass
+        writer.close()
+
+    async def drain(self, writer):
+        """Wait until the transport's write buffer drains, for at most write_timeout seconds.
+
+        Raises:
+            asyncio.TimeoutError: If the client stops reading.
+        """
+        if writer.transport.get_write_buffer_size():
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        else:
+            await writer.drain()  # Only surfaces a lost connection
+
+    async def read_request(self, reader, parser, phases):
+        """Read from the stream until the parser yields the next request head.
+
+        Args:
+            reader (asyncio.StreamReader): The client stream.
+            parser (RequestParser): The connection's request parser.
+            phases (dict): The request's phase timings; "recv" and "parse" are
+                added to. Waiting for the first bytes is idle time and not counted.
+
+        Returns:
+            tuple: (HTTPRequest, perf_counter() reading when its first bytes
+            arrived); the request is None if the client closed the connection
+            or stayed idle past the keep-alive timeout.
+
+        Raises:
+            RequestParseError: If the request head is malformed, too large, or
+                not complete within header_timeout seconds of its first bytes.
+        """
+        guard = HTTPRequestHandler.connection_guard
+        request_started = time.perf_counter() if parser.buffer else None
+        while True:
+            started = time.perf_counter()
+            request = parser.next_request()
+            phases["parse"] += time.perf_counter() - started
+            if request is not None:
+                return request, request_started
+            if request_started is None:
+                timeout = self.keep_alive_timeout
+            else:
+                timeout = request_started + self.header_timeout - started
+                if timeout <= 0:
+                    guard.record("header_timeout")
+                    raise RequestParseError(408, "Request head not received in time")
+            try:
+                data = await asyncio.wait_for(reader.read(65536), timeout)
+            except asyncio.TimeoutError:
+                if request_started is None:
+                    guard.record("idle_timeout")
+                    return None, None
+                guard.record("header_timeout")
+                raise RequestParseError(408, "Request head not received in time")
+            if request_started is None:
+                request_started = time.perf_counter()
+            else:
+                phases["recv"] += time.perf_counter() - started
+            if not data:
+                return None, request_started
+            parser.feed(data)
+
+    def build_response(
+        self,
+        request,
+        client_addr,
+        keep_alive,
+        connection_info=None,
+        phases=None,
+        request_started=None,
+        parser=None,
+        stream=None,
+        queued_at=None,
+    ):
+        """Run the shared request handler against a ResponseBuffer.
+
+        While the load shedder finds the server overloaded, a request that
+        waited too long for an executor thread is answered with 503 instead.
+
+        Args:
+            request (HTTPRequest or RequestParseError): The parsed request, or
+                the error to answer if its head could not be parsed.
+            client_addr (tuple): The client's address.
+            keep_alive (bool): Whether the connection may stay open after this request.
+            connection_info (ConnectionInfo, optional): The connection's live table entry.
+            phases (dict, optional): The request's recv and parse timings. Defaults to None.
+            request_started (float, optional): perf_counter() reading when the
+                request's first bytes arrived. Defaults to None.
+            parser (RequestParser, optional): The connection's parser, holding
+                any request body bytes already received. Defaults to None.
+            stream (tuple, optional): The connection's (reader, writer, loop),
+                to read a request body from. Defaults to None.
+            queued_at (float, optional): time.monotonic() reading when the request
+                was handed to the executor. Defaults to None.
+
+        Returns:
+            tuple: (ResponseBuffer, keep_alive) with the bytes the handler produced
+            and whether the connection stays open.
+        """
+        response = ResponseBuffer(*stream) if stream is not None else ResponseBuffer()
+        response.settimeout(self.write_timeout)
+        handler = HTTPRequestHandler(response, client_addr, self.config, self.logger)
+        handler.parser = parser
+        handler.keep_alive = keep_alive
+        handler.connection_info = connection_info
+        handler.phases = phases
+        handler.request_started = request_started
+        if isinstance(request, RequestParseError):
+            handler.reject_request(request)
+            return response, False
+        shedder = HTTPRequestHandler.load_shedder
+        if (
+            shedder is not None
+            and queued_at is not None
+            and shedder.observe(time.monotonic() - queued_at)
+        ):
+            handler.request_version = request.version
+            handler.send_overloaded(request.request_line)
+            return response, False
+        return response, handler.process_request(request)
+
+    def stats(self):
+        """Return a snapshot of the engine statistics.
+
+        Returns:
+            dict: Open and total connection counts.
+        """
+        with self.lock:
+            return {
+                "Open Connections": self.open_connections,
+                "Total Connections": self.total_connections,
+            }
+
+
+def start_async_server(config, logger, server_socket=None):
+    """Serve HTTP on an asyncio event loop instead of the threaded accept loop.
+
+    Args:
+        config (dict): Configuration file loaded when the server start.
+        logger (Logger): log instance.
+        server_socket (socket.socket, optional): An already listening socket. Defaults to None.
+    """
+    server = AsyncServer(config, logger, server_socket)
+    logger.register_stats_provider("Asyncio Engine", server.stats)
+    try:
+        server.run()
+    except Exception as e:
+        logger.log_error(f"Server socket error: {e}")
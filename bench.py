@@ -0,0 +1,427 @@
+"""Load-testing and regression benchmark: runs server.py against a generated document root.
+
+Run with:
+    python bench.py [--concurrency N] [--duration S] [--no-keep-alive]
+                    [--output results.json] [--baseline baseline.json]
+                    [--save-baseline baseline.json] [--threshold 0.10]
+
+Each scenario requests one target (small, medium and large files, and a
+directory listing) from as many client threads as --concurrency for
+--duration seconds, and reports requests per second, p50/p99/max latency,
+error rate and the server's CPU time and peak RSS. With --baseline the run
+fails (exit status 1) if any scenario is slower than the baseline by more
+than --threshold.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+# Scenario name -> URL path in the generated document root.
+SCENARIOS = {
+    "small": "/small.html",
+    "medium": "/medium.bin",
+    "large": "/large.bin",
+    "listing": "/listing/",
+}
+
+
+def generate_document_root(path):
+    """Write the benchmark files: small, medium and large files and a directory to list.
+
+    Args:
+        path (str): Directory to create them in.
+    """
+    os.makedirs(os.path.join(path, "listing"), exist_ok=True)
+    with open(os.path.join(path, "small.html"), "w") as f:
+        f.write("<html><body>" + "Hello, benchmark! " * 20 + "</body></html>")
+    with open(os.path.join(path, "medium.bin"), "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    with open(os.path.join(path, "large.bin"), "wb") as f:
+        for _ in range(8):
+            f.write(os.urandom(1024 * 1024))
+    for i in range(2000):
+        with open(os.path.join(path, "listing", f"file-{i:04d}.txt"), "w") as f:
+            f.write(str(i))
+
+
+def free_port():
+    """Return a TCP port that is free on the loopback interface."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, document_root, port, server_config):
+    """Start server.py with a generated config.json and wait until it accepts connections.
+
+    Args:
+        workdir (str): Working directory of the server (holds config.json and the log).
+        document_root (str): The generated document root.
+        port (int): Port to serve on; the admin interface gets a free port too.
+        server_config (dict): Extra configuration fields.
+
+    Returns:
+        subprocess.Popen: The server process.
+
+    Raises:
+        RuntimeError: If the server does not come up within 15 seconds.
+    """
+    config = {
+        "host": "127.0.0.1",
+        "port": port,
+        "admin_port": free_port(),
+        "document_root": document_root,
+        "max_threads": 32,
+        "log_file": os.path.join(workdir, "server.log"),
+    }
+    config.update(server_config)
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server.py did not start accepting connections")
+
+
+def process_tree(pid):
+    """List a process and its descendants (prefork workers), using /proc.
+
+    Returns:
+        list: pids; just [pid] where /proc is unavailable.
+    """
+    children = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        fields = f.read().rsplit(")", 1)[1].split()
+                except OSError:
+                    continue
+                children.setdefault(int(fields[1]), []).append(int(entry))
+    except OSError:
+        return [pid]
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children.get(current, ()))
+    return pids
+
+
+def process_usage(pid):
+    """Read the CPU time and resident memory of a server and its workers from /proc.
+
+    Args:
+        pid (int): The server's pid.
+
+    Returns:
+        tuple: (CPU seconds, RSS bytes), or None where /proc is unavailable.
+    """
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    cpu, rss = 0.0, 0
+    try:
+        for current in process_tree(pid):
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime and stime are fields 14 and 15 of stat, rss is field 24.
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            rss += int(fields[21]) * page_size
+    except (OSError, IndexError, ValueError):
+        return None
+    return cpu, rss
+
+
+class ClientThread(threading.Thread):
+    """One load-generating client: requests a path in a loop until the deadline."""
+
+    def __init__(self, port, path, keep_alive, deadline):
+        super().__init__(daemon=True)
+        self.port = port
+        self.keep_alive = keep_alive
+        self.deadline = deadline
+        connection = "keep-alive" if keep_alive else "close"
+        self.request = (
+            f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: {connection}\r\n\r\n"
+        ).encode("latin-1")
+        self.buffer = bytearray(256 * 1024)
+        self.latencies = []
+        self.errors = 0  # Error responses and failed requests
+        self.failures = 0  # Requests that got no response
+        self.bytes_received = 0
+
+    def run(self):
+        sock = None
+        while time.monotonic() < self.deadline:
+            started = time.perf_counter()
+            try:
+                if sock is None:
+                    sock = socket.create_connection(("127.0.0.1", self.port), timeout=30)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(self.request)
+                status, reusable = self.read_response(sock)
+            except OSError:
+                self.errors += 1
+                self.failures += 1
+                if sock is not None:
+                    sock.close()
+                sock = None
+                continue
+            self.latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                self.errors += 1
+            if not (self.keep_alive and reusable):
+                sock.close()
+                sock = None
+        if sock is not None:
+            sock.close()
+
+    def read_response(self, sock):
+        """Read one response, discarding its body into a reused buffer.
+
+        Returns:
+            tuple: (status code, whether the connection stays open).
+
+        Raises:
+            OSError: If the connection fails or closes mid-response.
+        """
+        head = b""
+        while b"\r\n\r\n" not in head:
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionError("Connection closed before the response head")
+            head += data
+        head, _, body = head.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        length, reusable = 0, True
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                reusable = False
+        remaining = length - len(body)
+        view = memoryview(self.buffer)
+        while remaining > 0:
+            received = sock.recv_into(view[: min(remaining, len(self.buffer))])
+            if not received:
+                raise ConnectionError("Connection closed mid-body")
+            remaining -= received
+        self.bytes_received += length
+        return status, reusable
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_scenario(port, server_pid, path, concurrency, duration, keep_alive):
+    """Drive one target with concurrent clients and collect the results.
+
+    Returns:
+        dict: Throughput, latency, error and server resource figures.
+    """
+    usage_before = process_usage(server_pid)
+    peak_rss = [usage_before[1] if usage_before else 0]
+    deadline = time.monotonic() + duration
+    clients = [ClientThread(port, path, keep_alive, deadline) for _ in range(concurrency)]
+
+    def sample_rss():
+        while time.monotonic() < deadline:
+            usage = process_usage(server_pid)
+            if usage:
+                peak_rss[0] = max(peak_rss[0], usage[1])
+            time.sleep(0.2)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    started = time.perf_counter()
+    sampler.start()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    sampler.join()
+    usage_after = process_usage(server_pid)
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    requests = len(latencies)
+    errors = sum(client.errors for client in clients)
+    attempts = requests + sum(client.failures for client in clients)
+    result = {
+        "requests": requests,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / max(1, attempts), 4),
+        "mb_per_second": round(
+            sum(client.bytes_received for client in clients) / elapsed / 1e6, 2
+        ),
+    }
+    if usage_before and usage_after:
+        cpu = usage_after[0] - usage_before[0]
+        result["server_cpu_seconds"] = round(cpu, 2)
+        result["server_cpu_percent"] = round(cpu / elapsed * 100, 1)
+        result["server_peak_rss_mb"] = round(peak_rss[0] / 1e6, 1)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Find scenarios that regressed against a baseline.
+
+    A scenario regresses if its requests per second dropped, or its p99
+    latency or error rate rose, by more than the threshold fraction.
+
+    Args:
+        results (dict): Scenario name -> result of this run.
+        baseline (dict): Scenario name -> result of the baseline run.
+        threshold (float): Allowed relative change, e.g. 0.10 for 10%.
+
+    Returns:
+        list: Human-readable descriptions of the regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: {result['rps']} req/s vs baseline {base['rps']}")
+        if result["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p99 {result['p99_ms']} ms vs baseline {base['p99_ms']} ms"
+            )
+        if result["error_rate"] > base["error_rate"] + threshold / 100:
+            regressions.append(
+                f"{name}: error rate {result['error_rate']} vs baseline {base['error_rate']}"
+            )
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--concurrency", type=int, default=16)
+    arg_parser.add_argument("--duration", type=float, default=5.0)
+    arg_parser.add_argument(
+        "--keep-alive", action=argparse.BooleanOptionalAction, default=True
+    )
+    arg_parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    arg_parser.add_argument(
+        "--server-config",
+        action="append",
+        default=[],
+        metavar="KEY=JSON",
+        help='Extra server setting, e.g. --server-config engine=\'"asyncio"\'',
+    )
+    arg_parser.add_argument("--output", help="Write the results to this JSON file")
+    arg_parser.add_argument("--baseline", help="Compare against this results file")
+    arg_parser.add_argument("--save-baseline", help="Also save the results as a baseline")
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed regression against the baseline, as a fraction (default 0.10)",
+    )
+    args = arg_parser.parse_args()
+
+    server_config = {}
+    for item in args.server_config:
+        key, _, value = item.partition("=")
+        server_config[key] = json.loads(value)
+
+    workdir = tempfile.mkdtemp(prefix="http-bench-")
+    document_root = os.path.join(workdir, "www")
+    generate_document_root(document_root)
+    port = free_port()
+    process = start_server(workdir, document_root, port, server_config)
+    results = {}
+    try:
+        print(
+            f"{'scenario':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+            f"{'max ms':>10}{'errors':>8}{'cpu %':>8}{'rss MB':>8}"
+        )
+        for name in args.scenarios:
+            result = run_scenario(
+                port,
+                process.pid,
+                SCENARIOS[name],
+                args.concurrency,
+                args.duration,
+                args.keep_alive,
+            )
+            results[name] = result
+            print(
+                f"{name:<10}{result['rps']:>10}{result['p50_ms']:>10}"
+                f"{result['p99_ms']:>10}{result['max_ms']:>10}{result['errors']:>8}"
+                f"{result.get('server_cpu_percent', '-'):>8}"
+                f"{result.get('server_peak_rss_mb', '-'):>8}"
+            )
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        "settings": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "keep_alive": args.keep_alive,
+            "server_config": server_config,
+        },
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(document, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Micro-benchmark: RequestParser against the original str-based parse_request.
+
+Run with:
+    python bench_parser.py [--iterations N]
+"""
+
+import argparse
+import timeit
+from http_parser import RequestParser
+
+
+def legacy_parse_request(request_data):
+    """The original HTTPRequestHandler.parse_request, kept here as the baseline."""
+    lines = request_data.split("\r\n")
+    request_line = lines[0]
+    headers = {}
+    for line in lines[1:]:
+        if line == "":
+            break  # End of headers
+        parts = line.split(":", 1)
+        if len(parts) == 2:
+            headers[parts[0].strip()] = parts[1].strip()
+    return request_line, headers
+
+
+def build_request(header_count, cookie_size):
+    """Build a raw GET request head.
+
+    Args:
+        header_count (int): Number of filler headers.
+        cookie_size (int): Length of the Cookie header value.
+
+    Returns:
+        bytes: The request head including the terminating blank line.
+    """
+    lines = ["GET /assets/app.js?v=42 HTTP/1.1", "Host: localhost:8080"]
+    lines += [f"X-Header-{i}: value-{i}" for i in range(header_count)]
+    if cookie_size:
+        lines.append("Cookie: session=" + "a" * cookie_size)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+def bench_legacy(data, segments, iterations):
+    def run():
+        # The original handler decoded a single recv() worth of data.
+        legacy_parse_request(b"".join(segments).decode("utf-8"))
+
+    return timeit.timeit(run, number=iterations)
+
+
+def bench_parser(data, segments, iterations):
+    # One parser per connection; each run consumes a whole request, so it is reused.
+    parser = RequestParser(max_header_size=1 << 20, max_header_count=1000)
+
+    def run():
+        for segment in segments:
+            parser.feed(segment)
+            if parser.next_request() is not None:
+                break
+
+    return timeit.timeit(run, number=iterations)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--iterations", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    cases = [
+        ("small request", build_request(5, 0), 1),
+        ("30 headers", build_request(30, 0), 1),
+        ("8 KB cookie", build_request(10, 8192), 1),
+        ("8 KB cookie, 64 segments", build_request(10, 8192), 64),
+    ]
+    print(f"{'case':<28}{'legacy (us)':>14}{'parser (us)':>14}")
+    for name, data, segment_count in cases:
+        size = -(-len(data) // segment_count)
+        segments = [data[i : i + size] for i in range(0, len(data), size)]
+        legacy = bench_legacy(data, segments, args.iterations)
+        parser = bench_parser(data, segments, args.iterations)
+        print(
+            f"{name:<28}"
+            f"{legacy / args.iterations * 1e6:>14.2f}"
+            f"{parser / args.iterations * 1e6:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""Pack a document root into a single bundle file, and serve files from it.
+
+Usage:
+    python bundle.py DOCUMENT_ROOT OUTPUT [--no-compress] [--level N]
+
+A bundle is a small header, a JSON index and the file bodies back to back:
+
+    b"NOOBPAK1" | index length (u64, little endian) | index | data
+
+The index maps each URL path to its offset and length in the data section,
+MIME type, modification time, ETag and any precompressed variants. The
+server memory-maps the bundle, so serving a file opens nothing: the body is
+a slice of the mapping handed straight to sendmsg().
+"""
+
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from compression import DEFAULT_COMPRESSIBLE_TYPES, is_compressible
+from file_cache import file_validators, guess_mime_type
+from metrics import ShardedCounter
+
+BUNDLE_MAGIC = b"NOOBPAK1"
+BUNDLE_HEADER = struct.Struct("<8sQ")
+
+
+class BundleEntry:
+    """A file in a bundle, shaped like a file cache entry so it is served the same way."""
+
+    __slots__ = (
+        "body",
+        "mime_type",
+        "length",
+        "header_block",
+        "mtime",
+        "size",
+        "etag",
+        "last_modified",
+        "variants",
+    )
+
+    def __init__(self, body, mime_type, mtime, etag, last_modified, variants):
+        self.body = body
+        self.mime_type = mime_type
+        self.length = self.size = len(body)
+        self.mtime = mtime
+        self.etag = etag
+        self.last_modified = last_modified
+        self.variants = variants  # content coding -> encoded body
+        self.header_block = (
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Length: {self.length}\r\n"
+            f"ETag: {etag}\r\n"
+            f"Last-Modified: {last_modified}\r\n"
+            "Accept-Ranges: bytes\r\n"
+        ).encode("latin-1")
+
+
+def build_bundle(
+    document_root,
+    output_path,
+    compress=True,
+    level=9,
+    min_compress_size=1024,
+    compress_mime_types=DEFAULT_COMPRESSIBLE_TYPES,
+):
+    """Pack every regular file under a document root into a bundle file.
+
+    Compressible files get a gzip variant, taken from a fresh .gz sibling
+    when there is one, and kept only if it is smaller than the file. The
+    bundle is written next to output_path and renamed over it, so a
+    running server never maps a half-written bundle.
+
+    Args:
+        document_root (str): The directory to pack.
+        output_path (str): Where to write the bundle.
+        compress (bool, optional): Store gzip variants. Defaults to True.
+        level (int, optional): gzip compression level. Defaults to 9.
+        min_compress_size (int, optional): Smallest file given a variant. Defaults to 1024.
+        compress_mime_types (iterable, optional): MIME types to compress.
+
+    Returns:
+        dict: The number of files, aliases and variants, and the bundle size.
+    """
+    document_root = os.path.abspath(document_root)
+    output_abs = os.path.abspath(output_path)
+    temp_path = output_abs + ".tmp"
+    files = {}
+    aliases = {}
+    variants = 0
+    offset = 0
+    with open(temp_path + ".data", "wb") as data:
+        for directory, subdirectories, names in os.walk(document_root):
+            subdirectories.sort()
+            relative = os.path.relpath(directory, document_root)
+            url_directory = "/" if relative == "." else "/" + relative.replace(os.sep, "/") + "/"
+            for name in sorted(names):
+                path = os.path.join(directory, name)
+                if path in (output_abs, temp_path, temp_path + ".data"):
+                    continue
+                try:
+                    with open(path, "rb") as f:
+                        st = os.fstat(f.fileno())
+                        if not stat_is_regular(st):
+                            continue
+                        body = f.read()
+                except OSError:
+                    continue  # Unreadable or removed while packing
+                mime_type = guess_mime_type(path)
+                etag, _ = file_validators(len(body), st.st_mtime_ns)
+                record = {
+                    "offset": offset,
+                    "length": len(body),
+                    "mime_type": mime_type,
+                    "mtime_ns": st.st_mtime_ns,
+                    "etag": etag,
+                    "variants": {},
+                }
+                data.write(body)
+                offset += len(body)
+                if (
+                    compress
+                    and len(body) >= min_compress_size
+                    and is_compressible(mime_type, compress_mime_types)
+                ):
+                    encoded = precompressed_sibling(path, st.st_mtime_ns)
+                    if encoded is None:
+                        encoded = gzip.compress(body, compresslevel=level, mtime=0)
+                    if len(encoded) < len(body):
+                        record["variants"]["gzip"] = [offset, len(encoded)]
+                        data.write(encoded)
+                        offset += len(encoded)
+                        variants += 1
+                files[url_directory + name] = record
+            # A directory URL serves its index.html, with or without the slash.
+            index_path = url_directory + "index.html"
+            if index_path in files:
+                aliases[url_directory] = index_path
+                if url_directory != "/":
+                    aliases[url_directory.rstrip("/")] = index_path
+
+    index = json.dumps(
+        {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "document_root": document_root,
+            "files": files,
+            "aliases": aliases,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    try:
+        with open(temp_path, "wb") as out, open(temp_path + ".data", "rb") as data:
+            out.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, len(index)))
+            out.write(index)
+            while True:
+                chunk = data.read(1024 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_path, output_abs)
+    finally:
+        os.remove(temp_path + ".data")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {
+        "Files": len(files),
+        "Aliases": len(aliases),
+        "Compressed Variants": variants,
+        "Bundle Size (bytes)": os.path.getsize(output_abs),
+    }
+
+
+def stat_is_regular(st):
+    """Check that a stat result describes a regular file."""
+    return (st.st_mode & 0o170000) == 0o100000
+
+
+def precompressed_sibling(path, mtime_ns):
+    """Read a file's .gz sibling if it is at least as new as the file.
+
+    Returns:
+        bytes: The gzip body, or None if there is no usable sibling.
+    """
+    try:
+        with open(path + ".gz", "rb") as f:
+            if os.fstat(f.fileno()).st_mtime_ns < mtime_ns:
+                return None
+            return f.read()
+    except OSError:
+        return None
+
+
+class AssetBundle:
+
+    def __init__(self, path, weak_etags=False):
+        """Memory-map a bundle file and build its in-memory index.
+
+        Bodies are memoryview slices of the mapping; the mapping itself is
+        released once the bundle and every response still sending from it
+        are gone, so a bundle can be replaced while requests are in flight.
+
+        Args:
+            path (str): The bundle file.
+            weak_etags (bool, optional): If True, entries carry weak ETags. Defaults to False.
+
+        Raises:
+            OSError: If the file cannot be read.
+            ValueError: If the file is not a bundle.
+        """
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < BUNDLE_HEADER.size:
+                raise ValueError(f"'{path}' is not a bundle file")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = BUNDLE_HEADER.unpack_from(self.map, 0)
+        if magic != BUNDLE_MAGIC or BUNDLE_HEADER.size + index_length > st.st_size:
+            raise ValueError(f"'{path}' is not a bundle file")
+        index = json.loads(self.map[BUNDLE_HEADER.size : BUNDLE_HEADER.size + index_length])
+        data = memoryview(self.map)[BUNDLE_HEADER.size + index_length :]
+        self.identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.size = st.st_size
+        self.created = index.get("created", "")
+        self.entries = {}  # URL path -> BundleEntry
+        for url_path, record in index["files"].items():
+            offset, length = record["offset"], record["length"]
+            etag = record["etag"]
+            _, last_modified = file_validators(length, record["mtime_ns"])
+            self.entries[url_path] = BundleEntry(
+                data[offset : offset + length],
+                record["mime_type"],
+                record["mtime_ns"],
+                "W/" + etag if weak_etags else etag,
+                last_modified,
+                {
+                    encoding: data[start : start + count]
+                    for encoding, (start, count) in record["variants"].items()
+                },
+            )
+        self.files = len(self.entries)
+        for alias, target in index["aliases"].items():
+            self.entries[alias] = self.entries[target]
+
+
+class BundleManager:
+
+    def __init__(self, path, poll_interval=1.0, weak_etags=False):
+        """Serve files from a bundle, swapping in a rebuilt bundle without a restart.
+
+        A background thread polls the bundle file; when it is replaced (as
+        build_bundle() does, by renaming a new file over it) the new bundle
+        is mapped and indexed off the request path, then published with a
+        single reference assignment. Requests already holding the old
+        bundle finish from it. A bundle that fails to load is reported and
+        the current one kept.
+
+        Args:
+            path (str): The bundle file.
+            poll_interval (float, optional): Seconds between checks for a new bundle. Defaults to 1.0.
+            weak_etags (bool, optional): If True, entries carry weak ETags. Defaults to False.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.weak_etags = weak_etags
+        self.current = None  # AssetBundle being served
+        self.lock = threading.Lock()
+        self.hits = ShardedCounter()
+        self.misses = ShardedCounter()
+        self.loads = 0
+        self.failures = 0
+        self.last_error = ""
+        self.loaded_at = None
+        self.reload()
+        threading.Thread(target=self.poll_loop, name="bundle-poller", daemon=True).start()
+
+    def lookup(self, url_path):
+        """Return the bundle entry for a URL path.
+
+        Args:
+            url_path (str): The requested URL path, without the query string.
+
+        Returns:
+            BundleEntry: The entry, or None if the path is not in the bundle.
+        """
+        bundle = self.current
+        if bundle is None:
+            return None
+        entry = bundle.entries.get(url_path)
+        if entry is None:
+            self.misses.increment()
+        else:
+            self.hits.increment()
+        return entry
+
+    def reload(self):
+        """Load the bundle file if it changed since it was last loaded.
+
+        Returns:
+            bool: True if a new bundle was swapped in.
+        """
+        try:
+            st = os.stat(self.path)
+            current = self.current
+            if current is not None and current.identity == (
+                st.st_ino,
+                st.st_mtime_ns,
+                st.st_size,
+            ):
+                return False
+            bundle = AssetBundle(self.path, self.weak_etags)
+        except Exception as e:
+            with self.lock:
+                error = f"{type(e).__name__}: {e}"
+                if error != self.last_error:
+                    self.failures += 1
+                    self.last_error = error
+            return False
+        self.current = bundle
+        with self.lock:
+            self.loads += 1
+            self.last_error = ""
+            self.loaded_at = datetime.now()
+        return True
+
+    def poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.reload()
+
+    def stats(self):
+        """Return a snapshot of the bundle statistics.
+
+        Returns:
+            dict: The bundle being served, lookup counters and reload history.
+        """
+        bundle = self.current
+        with self.lock:
+            return {
+                "Bundle": self.path,
+                "Files": bundle.files if bundle else 0,
+                "Bundle Size (bytes)": bundle.size if bundle else 0,
+                "Built At": bundle.created if bundle else "",
+                "Loaded At": (
+                    self.loaded_at.isoformat(timespec="seconds") if self.loaded_at else "never"
+                ),
+                "Hits": self.hits.value,
+                "Misses": self.misses.value,
+                "Loads": self.loads,
+                "Load Failures": self.failures,
+                "Last Error": self.last_error or "none",
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack a document root into a bundle file.")
+    parser.add_argument("document_root", help="Directory to pack")
+    parser.add_argument("output", help="Bundle file to write (replaced atomically)")
+    parser.add_argument(
+        "--no-compress", action="store_true", help="Do not store gzip variants"
+    )
+    parser.add_argument("--level", type=int, default=9, help="gzip level (default 9)")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.document_root):
+        print(f"'{args.document_root}' is not a directory", file=sys.stderr)
+        return 1
+    started = time.monotonic()
+    summary = build_bundle(
+        args.document_root, args.output, compress=not args.no_compress, level=args.level
+    )
+    for name, value in summary.items():
+        print(f"{name}: {value}")
+    print(f"Built in {time.monotonic() - started:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
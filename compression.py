@@ -0,0 +1,294 @@
+import gzip
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+# Content codings the server can produce, in order of preference.
+SUPPORTED_ENCODINGS = ("gzip", "deflate")
+
+DEFAULT_COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def is_compressible(mime_type, allowed_types):
+    """Check a MIME type against an allow-list.
+
+    Args:
+        mime_type (str): The MIME type of the file.
+        allowed_types (iterable): Exact types, or prefixes ending in "/" (e.g. "text/").
+
+    Returns:
+        bool: True if the type may be compressed.
+    """
+    for allowed in allowed_types:
+        if allowed.endswith("/"):
+            if mime_type.startswith(allowed):
+                return True
+        elif mime_type == allowed:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the preferred supported content coding from an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): The Accept-Encoding header value.
+
+    Returns:
+        str: "gzip" or "deflate", or None if identity should be sent.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def variant_etag(etag, encoding):
+    """Derive the ETag of an encoded variant, so it differs from the identity one.
+
+    Args:
+        etag (str): The file's ETag, e.g. '"1f-abc"' or 'W/"1f-abc"'.
+        encoding (str): The content coding.
+
+    Returns:
+        str: e.g. '"1f-abc-gzip"'.
+    """
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class CompressedVariant:
+    """An encoded body, tied to the version of the source file it came from."""
+
+    __slots__ = ("body", "source_mtime", "source_size", "precompressed")
+
+    def __init__(self, body, source_mtime, source_size, precompressed):
+        self.body = body
+        self.source_mtime = source_mtime
+        self.source_size = source_size
+        self.precompressed = precompressed
+
+
+class InFlight:
+    """A variant being loaded or compressed, which other requests for it wait on."""
+
+    __slots__ = ("done", "body")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None  # Set by the loading thread unless it fails
+
+
+class CompressionCache:
+
+    def __init__(self, max_bytes, max_source_size, level=6):
+        """Initialize a size-bounded LRU cache of compressed file variants.
+
+        Concurrent misses on the same file version are compressed once: the
+        first thread does the work and the others wait for its result.
+
+        Args:
+            max_bytes (int): Total bytes of compressed bodies the cache may hold.
+            max_source_size (int): Largest file that is compressed on the fly.
+            level (int, optional): zlib compression level. Defaults to 6.
+        """
+        self.max_bytes = max_bytes
+        self.max_source_size = max_source_size
+        self.level = level
+        self.entries = OrderedDict()  # (path, encoding) -> CompressedVariant
+        self.in_flight = {}  # (path, encoding, mtime_ns, size) -> InFlight
+        self.lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_misses = 0
+        self.evictions = 0
+        self.precompressed_loads = 0
+        self.compressions = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def get(self, file_path, encoding, size, mtime_ns, body=None):
+        """Return the encoded body of a file, compressing it at most once per version.
+
+        A fresh precompressed sibling (app.js.gz for gzip) is preferred over
+        compressing on the fly. A thread that misses while another is already
+        producing the same version waits for that result instead.
+
+        Args:
+            file_path (str): Resolved path of the source file.
+            encoding (str): "gzip" or "deflate".
+            size (int): Current size of the source file.
+            mtime_ns (int): Current modification time of the source file.
+            body (bytes, optional): The source body if already in memory. Defaults to None.
+
+        Returns:
+            bytes: The encoded body.
+
+        Raises:
+            OSError: If the source file cannot be read.
+        """
+        key = (file_path, encoding)
+        version = (file_path, encoding, mtime_ns, size)
+        while True:
+            with self.lock:
+                cached = self.lookup(key, size, mtime_ns)
+                if cached is not None:
+                    self.hits += 1
+                    return cached
+                flight = self.in_flight.get(version)
+                if flight is None:
+                    flight = self.in_flight[version] = InFlight()
+                    self.misses += 1
+                    break
+                self.shared_misses += 1
+            flight.done.wait()
+            if flight.body is not None:
+                return flight.body
+            # The loading thread failed; try again, most likely failing the same way.
+
+        try:
+            variant = self.load_precompressed(file_path, encoding, size, mtime_ns)
+            if variant is None:
+                variant = self.compress(file_path, encoding, size, mtime_ns, body)
+            if len(variant.body) <= self.max_bytes:
+                with self.lock:
+                    if key in self.entries:
+                        self.remove(key)
+                    self.entries[key] = variant
+                    self.current_bytes += len(variant.body)
+                    while self.current_bytes > self.max_bytes:
+                        _, evicted = self.entries.popitem(last=False)
+                        self.current_bytes -= len(evicted.body)
+                        self.evictions += 1
+            flight.body = variant.body
+            return variant.body
+        finally:
+            with self.lock:
+                del self.in_flight[version]
+            flight.done.set()
+
+    def peek(self, file_path, encoding, size, mtime_ns):
+        """Return the cached encoded body of a file version without producing it.
+
+        Returns:
+            bytes: The encoded body, or None if it is not cached.
+        """
+        with self.lock:
+            cached = self.lookup((file_path, encoding), size, mtime_ns)
+            if cached is not None:
+                self.hits += 1
+            return cached
+
+    def lookup(self, key, size, mtime_ns):
+        """Return a cached body if it matches the file version, dropping a stale one.
+
+        The caller must hold the lock.
+        """
+        variant = self.entries.get(key)
+        if variant is None:
+            return None
+        if variant.source_mtime == mtime_ns and variant.source_size == size:
+            self.entries.move_to_end(key)
+            return variant.body
+        self.remove(key)
+        return None
+
+    def load_precompressed(self, file_path, encoding, size, mtime_ns):
+        """Load a precompressed sibling file if it exists and is not older than the source.
+
+        Returns:
+            CompressedVariant: The variant, or None if there is no usable sibling.
+        """
+        if encoding != "gzip":
+            return None
+        sibling = file_path + ".gz"
+        try:
+            st = os.stat(sibling)
+        except OSError:
+            return None
+        if st.st_mtime_ns < mtime_ns or st.st_size > self.max_source_size:
+            return None
+        with open(sibling, "rb") as f:
+            body = f.read()
+        with self.lock:
+            self.precompressed_loads += 1
+        return CompressedVariant(body, mtime_ns, size, True)
+
+    def compress(self, file_path, encoding, size, mtime_ns, body=None):
+        """Compress a file body on the fly.
+
+        Returns:
+            CompressedVariant: The compressed variant.
+        """
+        if body is None:
+            with open(file_path, "rb") as f:
+                body = f.read(size)
+        started = time.thread_time()
+        if encoding == "gzip":
+            encoded = gzip.compress(body, compresslevel=self.level, mtime=0)
+        else:
+            # HTTP "deflate" is the zlib format.
+            encoded = zlib.compress(body, self.level)
+        elapsed = time.thread_time() - started
+        with self.lock:
+            self.compressions += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(encoded)
+            self.cpu_time += elapsed
+        return CompressedVariant(encoded, mtime_ns, size, False)
+
+    def remove(self, key):
+        """Drop an entry. The caller must hold the lock."""
+        variant = self.entries.pop(key)
+        self.current_bytes -= len(variant.body)
+
+    def stats(self):
+        """Return a snapshot of the compression statistics.
+
+        Returns:
+            dict: Cache counters, compression ratio and CPU time spent.
+        """
+        with self.lock:
+            ratio = self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+            return {
+                "Cached Variants": len(self.entries),
+                "Size (bytes)": self.current_bytes,
+                "Budget (bytes)": self.max_bytes,
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Misses Sharing a Compression": self.shared_misses,
+                "Evictions": self.evictions,
+                "Precompressed Files Loaded": self.precompressed_loads,
+                "On-the-fly Compressions": self.compressions,
+                "Bytes Compressed": self.bytes_in,
+                "Compressed Output (bytes)": self.bytes_out,
+                "Compression Ratio": round(ratio, 3),
+                "Compression CPU Time (ms)": round(self.cpu_time * 1000, 3),
+            }
@@ -0,0 +1,116 @@
+import threading
+import time
+from worker_pool import build_unavailable_response, send_and_close
+
+# Events counted by ConnectionGuard.record(), with their admin labels.
+GUARD_EVENTS = {
+    "header_timeout": "Header Read Timeouts (408)",
+    "idle_timeout": "Idle Keep-Alive Timeouts",
+    "write_timeout": "Write Stall Timeouts",
+    "slow_transfer": "Slow Transfers Aborted",
+    "per_ip_limit": "Connections Rejected (Per-IP Limit)",
+}
+
+
+class ConnectionGuard:
+
+    def __init__(self, max_connections_per_ip=0, min_transfer_rate=0, retry_after=1):
+        """Initialize the per-client connection limits and slow-client counters.
+
+        Args:
+            max_connections_per_ip (int, optional): Most open connections one client
+                IP may hold; 0 means no limit. Defaults to 0.
+            min_transfer_rate (int, optional): Bytes per second below which a large
+                response is abandoned; 0 turns the floor off. Defaults to 0.
+            retry_after (int, optional): Retry-After value sent to rejected
+                connections. Defaults to 1.
+        """
+        self.max_connections_per_ip = max_connections_per_ip
+        self.min_transfer_rate = min_transfer_rate
+        self.rejection = build_unavailable_response(retry_after)
+        self.lock = threading.Lock()
+        self.open_by_ip = {}  # client IP -> open connections
+        self.max_seen = 0
+        self.counts = dict.fromkeys(GUARD_EVENTS, 0)
+
+    def admit(self, client_ip):
+        """Count a new connection from a client, unless it already holds its limit.
+
+        Every admitted connection must be released once it closes.
+
+        Args:
+            client_ip (str): The client's IP address.
+
+        Returns:
+            bool: True if the connection may be served.
+        """
+        with self.lock:
+            open_connections = self.open_by_ip.get(client_ip, 0)
+            if self.max_connections_per_ip and open_connections >= self.max_connections_per_ip:
+                self.counts["per_ip_limit"] += 1
+                return False
+            self.open_by_ip[client_ip] = open_connections + 1
+            if open_connections + 1 > self.max_seen:
+                self.max_seen = open_connections + 1
+            return True
+
+    def release(self, client_ip):
+        """Forget a closed connection admitted by admit().
+
+        Args:
+            client_ip (str): The client's IP address.
+        """
+        with self.lock:
+            open_connections = self.open_by_ip.get(client_ip, 0) - 1
+            if open_connections > 0:
+                self.open_by_ip[client_ip] = open_connections
+            else:
+                self.open_by_ip.pop(client_ip, None)
+
+    def reject(self, client_conn):
+        """Send the canned 503 response without blocking the accept loop, then close."""
+        send_and_close(client_conn, self.rejection)
+
+    def record(self, event):
+        """Count a timed-out or abandoned connection.
+
+        Args:
+            event (str): One of GUARD_EVENTS.
+        """
+        with self.lock:
+            self.counts[event] += 1
+
+    def too_slow(self, sent, started):
+        """Check a large response against the minimum transfer rate.
+
+        The first second is never judged, so TCP slow start does not count
+        against the client.
+
+        Args:
+            sent (int): Bytes of the response sent so far.
+            started (float): time.monotonic() when sending started.
+
+        Returns:
+            bool: True if the response should be abandoned.
+        """
+        if not self.min_transfer_rate:
+            return False
+        elapsed = time.monotonic() - started
+        return elapsed >= 1.0 and sent < self.min_transfer_rate * elapsed
+
+    def stats(self):
+        """Return a snapshot of the connection limit statistics.
+
+        Returns:
+            dict: Limits, open connections by client and the timeout/rejection counters.
+        """
+        with self.lock:
+            stats = {
+                "Max Connections per IP": self.max_connections_per_ip or "unlimited",
+                "Min Transfer Rate (bytes/s)": self.min_transfer_rate or "off",
+                "Connected Clients": len(self.open_by_ip),
+                "Max Connections from One IP": self.max_seen,
+            }
+            for event, label in GUARD_EVENTS.items():
+                stats[label] = self.counts[event]
+            return stats
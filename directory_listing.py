@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from html import escape
+from utils import encode_path
+
+# Entries rendered per chunk of a streamed listing page.
+STREAM_BATCH = 200
+
+# ?sort= values; a leading "-" reverses the order.
+SORT_KEYS = {
+    "name": lambda entry: entry.name,
+    "size": lambda entry: (entry.size, entry.name),
+    "mtime": lambda entry: (entry.mtime, entry.name),
+}
+
+
+class ListingEntry:
+    """One directory entry, with the metadata shown in listings."""
+
+    __slots__ = ("name", "is_dir", "size", "mtime")
+
+    def __init__(self, name, is_dir, size, mtime):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+
+
+def scan_directory(directory_path):
+    """List a directory with os.scandir().
+
+    The entry type comes from the directory read itself; each entry is
+    stat'ed at most once, through the DirEntry's cached stat().
+
+    Args:
+        directory_path (str): The directory to list.
+
+    Returns:
+        list: ListingEntry objects, in directory order.
+    """
+    entries = []
+    with os.scandir(directory_path) as it:
+        for dir_entry in it:
+            try:
+                is_dir = dir_entry.is_dir()
+                st = dir_entry.stat()
+            except OSError:
+                continue  # Removed while we were listing
+            entries.append(
+                ListingEntry(dir_entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime)
+            )
+    return entries
+
+
+class DirectoryListing:
+    """The scanned entries of one directory version, plus the pages rendered from them."""
+
+    def __init__(self, mtime_ns, entries):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.sorted = {}  # sort key -> entries in that order
+        self.pages = OrderedDict()  # (sort, page, format) -> (content type, body)
+
+
+class DirectoryListingCache:
+
+    def __init__(self, max_directories=64, page_size=1000, max_pages=32):
+        """Initialize an LRU cache of directory listings keyed on directory mtime.
+
+        Args:
+            max_directories (int, optional): Most directories kept. Defaults to 64.
+            page_size (int, optional): Entries per listing page. Defaults to 1000.
+            max_pages (int, optional): Rendered pages kept per directory. Defaults to 32.
+        """
+        self.max_directories = max_directories
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.listings = OrderedDict()  # directory path -> DirectoryListing
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+        self.entries_scanned = 0
+
+    def get(self, directory_path):
+        """Return the listing of a directory, rescanning it only if its mtime changed.
+
+        Adding, removing or renaming an entry changes the directory's mtime;
+        edits to a file's contents do not, so sizes and dates shown for files
+        can lag until the directory itself changes.
+
+        Args:
+            directory_path (str): The directory to list.
+
+        Returns:
+            DirectoryListing: The listing.
+
+        Raises:
+            OSError: If the directory cannot be read.
+        """
+        mtime_ns = os.stat(directory_path).st_mtime_ns
+        with self.lock:
+            listing = self.listings.get(directory_path)
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                self.listings.move_to_end(directory_path)
+                self.hits += 1
+                return listing
+            self.misses += 1
+        listing = DirectoryListing(mtime_ns, scan_directory(directory_path))
+        with self.lock:
+            self.scans += 1
+            self.entries_scanned += len(listing.entries)
+            if self.max_directories > 0:
+                self.listings[directory_path] = listing
+                self.listings.move_to_end(directory_path)
+                while len(self.listings) > self.max_directories:
+                    self.listings.popitem(last=False)
+        return listing
+
+    def render(self, directory_path, url_path, sort="name", page=1, output_format="html"):
+        """Render one page of a directory listing.
+
+        Args:
+            directory_path (str): The directory to list.
+            url_path (str): The URL path of the directory, used for links.
+            sort (str, optional): "name", "size" or "mtime", "-" prefixed for
+                descending order; unknown values sort by name. Defaults to "name".
+            page (int, optional): 1-based page number, clamped to the valid range. Defaults to 1.
+            output_format (str, optional): "html" or "json". Defaults to "html".
+
+        A page rendered before is returned as bytes. Otherwise the body is
+        a generator that renders the page in batches of entries, so it can
+        be sent while later entries are still being formatted; the page is
+        cached once the generator has been run to the end.
+
+        Returns:
+            tuple: (content type, body bytes or generator of byte chunks).
+
+        Raises:
+            OSError: If the directory cannot be read.
+        """
+        if sort.lstrip("-") not in SORT_KEYS:
+            sort = "name"
+        if output_format != "json":
+            output_format = "html"
+        listing = self.get(directory_path)
+        total = len(listing.entries)
+        pages = max(1, -(-total // self.page_size))
+        page = min(max(1, page), pages)
+        key = (sort, page, output_format)
+        with self.lock:
+            rendered = listing.pages.get(key)
+            if rendered is not None:
+                listing.pages.move_to_end(key)
+                return rendered
+            ordered = listing.sorted.get(sort)
+        if ordered is None:
+            ordered = sorted(
+                listing.entries,
+                key=SORT_KEYS[sort.lstrip("-")],
+                reverse=sort.startswith("-"),
+            )
+        with self.lock:
+            listing.sorted[sort] = ordered
+        start = (page - 1) * self.page_size
+        entries = ordered[start : start + self.page_size]
+        base = url_path.rstrip("/") + "/"
+        if output_format == "json":
+            content_type = "application/json"
+            chunks = self.render_json(url_path, base, entries, sort, page, pages, total)
+        else:
+            content_type = "text/html"
+            chunks = self.render_html(base, entries, sort, page, pages, total)
+        return content_type, self.cache_page(listing, key, content_type, chunks)
+
+    def cache_page(self, listing, key, content_type, chunks):
+        """Pass rendered chunks through, caching the whole page once the last one is taken."""
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        with self.lock:
+            listing.pages[key] = (content_type, b"".join(parts))
+            while len(listing.pages) > self.max_pages:
+                listing.pages.popitem(last=False)
+
+    def render_html(self, base, entries, sort, page, pages, total):
+        """Render a page of entries as HTML, one chunk per STREAM_BATCH entries."""
+        title = escape(base)
+        parts = [
+            f"<html><head><title>Directory Listing</title></head><body>"
+            f"<h1>Directory listing for {title}</h1>"
+            f"<p>{total} entries, page {page} of {pages}. Sort by: "
+        ]
+        for name in SORT_KEYS:
+            reverse = "-" + name if sort == name else name
+            parts.append(f"<a href='?sort={reverse}'>{name}</a> ")
+        parts.append("</p><ul>")
+        for index, entry in enumerate(entries, 1):
+            display_name = f"{entry.name}/" if entry.is_dir else entry.name
+            href = encode_path(base + display_name)
+            modified_item = datetime.fromtimestamp(entry.mtime).strftime(
+                "%d-%m-%Y %H:%M:%S"
+            )
+            parts.append(
+                f"<li><a href='{escape(href)}'>{escape(display_name)}</a>"
+                f" - Last Modified: {modified_item}</li>"
+            )
+            if index % STREAM_BATCH == 0:
+                yield "".join(parts).encode("utf-8", errors="surrogateescape")
+                parts = []
+        parts.append("</ul><p>")
+        if page > 1:
+            parts.append(f"<a href='?sort={sort}&page={page - 1}'>Previous</a> ")
+        if page < pages:
+            parts.append(f"<a href='?sort={sort}&page={page + 1}'>Next</a>")
+        parts.append("</p></body></html>")
+        yield "".join(parts).encode("utf-8", errors="surrogateescape")
+
+    def render_json(self, url_path, base, entries, sort, page, pages, total):
+        """Render a page of entries as a JSON document for tooling, one chunk per STREAM_BATCH entries.
+
+        Each entry's "url" is the percent-encoded path of the entry, directory
+        included, like the HTML links, so it can be requested as is.
+        """
+        document = json.dumps(
+            {
+                "path": url_path,
+                "sort": sort,
+                "page": page,
+                "pages": pages,
+                "page_size": self.page_size,
+                "total": total,
+                "entries": [],
+            }
+        )
+        # Everything up to the empty entries list, which is filled in batches.
+        yield document[:-2].encode("utf-8")
+        for start in range(0, len(entries), STREAM_BATCH):
+            rows = ", ".join(
+                json.dumps(
+                    {
+                        "name": entry.name,
+                        "type": "directory" if entry.is_dir else "file",
+                        "url": encode_path(
+                            base + (f"{entry.name}/" if entry.is_dir else entry.name)
+                        ),
+                        "size": entry.size,
+                        "mtime": entry.mtime,
+                    }
+                )
+                for entry in entries[start : start + STREAM_BATCH]
+            )
+            yield (rows if not start else ", " + rows).encode("utf-8")
+        yield b"]}"
+
+    def stats(self):
+        """Return a snapshot of the listing cache statistics.
+
+        Returns:
+            dict: Cached directories, hit/miss counters and scan totals.
+        """
+        with self.lock:
+            return {
+                "Cached Directories": len(self.listings),
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Directory Scans": self.scans,
+                "Entries Scanned": self.entries_scanned,
+                "Page Size": self.page_size,
+            }
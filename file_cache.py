@@ -0,0 +1,213 @@
+import functools
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from utils import http_date_format
+
+
+@functools.lru_cache(maxsize=4096)
+def file_validators(size, mtime_ns, weak=False):
+    """Build the ETag and Last-Modified values for a file version.
+
+    The ETag is derived from size and modification time, so no file content
+    is hashed; results are memoized per (size, mtime) as well.
+
+    Args:
+        size (int): File size in bytes.
+        mtime_ns (int): Modification time in nanoseconds.
+        weak (bool, optional): If True, return a weak ("W/") ETag. Defaults to False.
+
+    Returns:
+        tuple: (etag, last_modified) header values.
+    """
+    etag = f'"{size:x}-{mtime_ns:x}"'
+    if weak:
+        etag = "W/" + etag
+    last_modified = http_date_format(
+        datetime.fromtimestamp(mtime_ns // 1_000_000_000, timezone.utc)
+    )
+    return etag, last_modified
+
+
+class CacheEntry:
+    """A cached static file: its body plus everything needed to answer with it."""
+
+    __slots__ = (
+        "body",
+        "mime_type",
+        "length",
+        "header_block",
+        "mtime",
+        "size",
+        "etag",
+        "last_modified",
+    )
+
+    def __init__(self, body, mime_type, mtime, size, weak_etag=False):
+        self.body = body
+        self.mime_type = mime_type
+        self.length = len(body)
+        self.mtime = mtime
+        self.size = size
+        self.etag, self.last_modified = file_validators(size, mtime, weak_etag)
+        # Headers that only change when the file does, encoded once.
+        self.header_block = (
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Length: {self.length}\r\n"
+            f"ETag: {self.etag}\r\n"
+            f"Last-Modified: {self.last_modified}\r\n"
+            "Accept-Ranges: bytes\r\n"
+        ).encode("latin-1")
+
+
+COMPRESSED_FILE_TYPES = {
+    "gzip": "application/gzip",
+    "bzip2": "application/x-bzip2",
+    "xz": "application/x-xz",
+}
+
+
+def guess_mime_type(file_path):
+    """Guess a file's MIME type from its name.
+
+    Lookups are memoized per file name suffix (".js", ".tar.gz"), so the
+    mimetypes module is only consulted once per suffix.
+
+    Args:
+        file_path (str): The file path.
+
+    Returns:
+        str: The MIME type, "application/octet-stream" if unknown.
+    """
+    name = os.path.basename(file_path)
+    dot = name.find(".")
+    return mime_type_for_suffix(name[dot:] if dot > 0 else "")
+
+
+@functools.lru_cache(maxsize=1024)
+def mime_type_for_suffix(suffix):
+    """Guess the MIME type of files ending in a suffix.
+
+    Args:
+        suffix (str): Everything from the first dot of the file name, or "".
+
+    Returns:
+        str: The MIME type, "application/octet-stream" if unknown.
+    """
+    mime_type, encoding = mimetypes.guess_type("file" + suffix)
+    if encoding is not None:
+        # app.js.gz is a gzip file, not JavaScript; it must not be labelled as text.
+        return COMPRESSED_FILE_TYPES.get(encoding, "application/octet-stream")
+    return mime_type or "application/octet-stream"
+
+
+class FileCache:
+
+    def __init__(self, max_bytes, max_file_size, weak_etags=False):
+        """Initialize a size-bounded LRU cache of static files.
+
+        Args:
+            max_bytes (int): Total bytes of file bodies the cache may hold.
+            max_file_size (int): Largest file that is cached.
+            weak_etags (bool, optional): If True, entries carry weak ETags. Defaults to False.
+        """
+        self.max_bytes = max_bytes
+        self.weak_etags = weak_etags
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.entries = OrderedDict()  # resolved path -> CacheEntry, oldest first
+        self.lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, file_path):
+        """Return a fresh cache entry for a file, loading it on a miss.
+
+        The file is stat'ed on every call so edits are picked up: an entry
+        whose mtime or size no longer matches is dropped and reloaded.
+
+        Args:
+            file_path (str): Resolved path of the file.
+
+        Returns:
+            CacheEntry: The entry, or None if the file is too large to cache.
+
+        Raises:
+            OSError: If the file cannot be stat'ed or read.
+        """
+        st = os.stat(file_path)
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry is not None:
+                if entry.mtime == st.st_mtime_ns and entry.size == st.st_size:
+                    self.entries.move_to_end(file_path)
+                    self.hits += 1
+                    return entry
+                self.remove(file_path)
+                self.invalidations += 1
+            self.misses += 1
+        if st.st_size > self.max_file_size:
+            return None
+        return self.load(file_path)
+
+    def load(self, file_path):
+        """Read a file and insert it into the cache.
+
+        Args:
+            file_path (str): Resolved path of the file.
+
+        Returns:
+            CacheEntry: The new entry, or None if the file grew past the size cap.
+        """
+        with open(file_path, "rb") as f:
+            # Use the metadata of the file actually read, not of the earlier stat().
+            st = os.fstat(f.fileno())
+            if st.st_size > self.max_file_size:
+                return None
+            body = f.read(st.st_size)
+        entry = CacheEntry(
+            body,
+            guess_mime_type(file_path),
+            st.st_mtime_ns,
+            st.st_size,
+            self.weak_etags,
+        )
+        with self.lock:
+            if file_path in self.entries:
+                self.remove(file_path)
+            self.entries[file_path] = entry
+            self.current_bytes += entry.length
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.length
+                self.evictions += 1
+        return entry
+
+    def remove(self, file_path):
+        """Drop an entry. The caller must hold the lock."""
+        entry = self.entries.pop(file_path)
+        self.current_bytes -= entry.length
+
+    def stats(self):
+        """Return a snapshot of the cache statistics.
+
+        Returns:
+            dict: Hit/miss/eviction counters and current size.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "Entries": len(self.entries),
+                "Size (bytes)": self.current_bytes,
+                "Budget (bytes)": self.max_bytes,
+                "Max File Size (bytes)": self.max_file_size,
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Hit Ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "Evictions": self.evictions,
+                "Invalidations": self.invalidations,
+            }
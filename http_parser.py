@@ -0,0 +1,154 @@
+class RequestParseError(Exception):
+    """Raised when a request head is malformed or exceeds the configured limits."""
+
+    def __init__(self, status_code, message):
+        """Initialize the error.
+
+        Args:
+            status_code (int): HTTP status to answer with (400 or 431).
+            message (str): A description of the problem.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class HTTPRequest:
+    """A parsed request head."""
+
+    __slots__ = ("method", "path", "version", "headers", "request_line")
+
+    def __init__(self, method, path, version, headers, request_line):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.request_line = request_line
+
+
+class RequestParser:
+    """Incremental parser for HTTP/1.x request heads.
+
+    Bytes are fed in as they arrive from the network, in chunks of any size.
+    The search for the blank line ending the head resumes where the previous
+    search stopped, so a head split over many TCP segments is scanned once.
+    Bytes after the head stay buffered for the next (pipelined) request.
+    Empty lines before a request line are skipped (RFC 9112 section 2.2),
+    as some clients send a stray CRLF after a request body.
+    """
+
+    def __init__(self, max_header_size=8192, max_header_count=100):
+        """Initialize the parser.
+
+        Args:
+            max_header_size (int, optional): Largest accepted request head in bytes. Defaults to 8192.
+            max_header_count (int, optional): Largest accepted number of header lines. Defaults to 100.
+        """
+        self.max_header_size = max_header_size
+        self.max_header_count = max_header_count
+        self.buffer = bytearray()
+        self.scan_from = 0
+
+    def feed(self, data):
+        """Append received bytes to the parse buffer.
+
+        Args:
+            data (bytes or memoryview): Bytes read from the connection.
+        """
+        self.buffer += data
+
+    def next_request(self):
+        """Parse the next complete request head from the buffer.
+
+        Returns:
+            HTTPRequest: The parsed request, or None if more bytes are needed.
+
+        Raises:
+            RequestParseError: If the head is malformed (400) or too large (431).
+        """
+        buffer = self.buffer
+        if buffer and buffer[0] in b"\r\n":
+            del buffer[: len(buffer) - len(buffer.lstrip(b"\r\n"))]
+            self.scan_from = 0
+        end = buffer.find(b"\r\n\r\n", self.scan_from)
+        if end == -1:
+            if len(buffer) > self.max_header_size:
+                raise RequestParseError(431, "Request header section too large")
+            # The terminator may straddle the next chunk, so back up three bytes.
+            self.scan_from = max(0, len(buffer) - 3)
+            return None
+        if end + 4 > self.max_header_size:
+            raise RequestParseError(431, "Request header section too large")
+
+        head = buffer[:end]
+        del buffer[: end + 4]
+        self.scan_from = 0
+        return self.parse_head(head)
+
+    def parse_head(self, head):
+        """Parse a request head without its terminating blank line.
+
+        The head is decoded in a single pass and split with C-level string
+        methods, rather than decoding and copying it line by line.
+
+        Args:
+            head (bytes or bytearray): The request line and header lines.
+
+        Returns:
+            HTTPRequest: The parsed request.
+
+        Raises:
+            RequestParseError: If the head is malformed (including obsolete
+                line folding, which RFC 9112 lets servers reject) or has too
+                many headers.
+        """
+        lines = head.decode("latin-1").split("\r\n")
+        request_line = lines[0]
+        if not request_line.isascii():
+            try:
+                request_line = request_line.encode("latin-1").decode("utf-8")
+            except UnicodeDecodeError:
+                raise RequestParseError(400, "Request line is not valid UTF-8")
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise RequestParseError(400, "Invalid HTTP request line")
+        method, path, version = parts
+
+        if len(lines) - 1 > self.max_header_count:
+            raise RequestParseError(431, "Too many request headers")
+        headers = {}
+        for index in range(1, len(lines)):
+            name, separator, value = lines[index].partition(":")
+            if not separator or not name:
+                raise RequestParseError(400, "Malformed header line")
+            if name[0] in " \t":
+                # A continuation line (obsolete line folding), not a new header.
+                raise RequestParseError(400, "Obsolete line folding in headers")
+            key = HEADER_NAMES.get(name)
+            if key is None:
+                key = normalize_header_name(name)
+            value = value.strip()
+            if key in headers:
+                headers[key] = f"{headers[key]}, {value}"
+            else:
+                headers[key] = value
+        return HTTPRequest(method, path, version, headers, request_line)
+
+
+# Raw header name -> Title-Case name. Bounded so hostile clients can't grow it.
+HEADER_NAMES = {}
+MAX_HEADER_NAMES = 1024
+
+
+def normalize_header_name(name):
+    """Return the Title-Case form of a raw header name, caching common ones.
+
+    Args:
+        name (str): The header name as sent by the client.
+
+    Returns:
+        str: The normalized name, e.g. "If-None-Match".
+    """
+    key = name.strip().title()
+    if len(HEADER_NAMES) < MAX_HEADER_NAMES:
+        HEADER_NAMES[name] = key
+    return key
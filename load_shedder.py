@@ -0,0 +1,146 @@
+import threading
+import time
+
+
+class LoadShedder:
+
+    def __init__(self, target_delay=0.1, interval=1.0, clock=time.monotonic):
+        """Initialize CoDel-style overload detection on the queue in front of the request handlers.
+
+        Every connection (threaded engine) or request (asyncio engine) that
+        waited for a handler thread reports its queueing delay. A burst that
+        drains quickly leaves some waits short; a standing queue does not. So
+        the server counts as overloaded when even the shortest wait seen over
+        a whole interval was above target_delay, and recovers as soon as an
+        interval's shortest wait is back under it.
+
+        While overloaded, work that waited longer than target_delay is shed
+        with a cheap 503 (the queue is first in, first out, so the oldest
+        goes first), and expensive requests are refused before they start,
+        so the cheap ones keep their latency.
+
+        On the threaded engine a handler thread serves one connection for as
+        long as it is kept alive, idle time included, so keep-alive clients
+        holding every thread make new connections wait and count as
+        queueing delay. Size max_threads for the expected keep-alive
+        connections (or lower keep_alive_timeout) before enabling shedding.
+
+        Args:
+            target_delay (float, optional): Queueing delay, in seconds, that a
+                standing queue may not exceed. Defaults to 0.1.
+            interval (float, optional): Seconds over which the shortest delay
+                is judged. Defaults to 1.0.
+            clock (callable, optional): Returns the current time in seconds.
+                Defaults to time.monotonic.
+        """
+        self.target_delay = target_delay
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.waiting = 0  # Queued and not yet picked up
+        self.interval_end = clock() + interval
+        self.interval_min = None  # Shortest delay seen in the current interval
+        self.overloaded = False
+        self.overload_started = 0.0
+        self.overloaded_seconds = 0.0
+        self.episodes = 0
+        self.last_delay = 0.0
+        self.max_delay = 0.0
+        self.shed_queued = 0
+        self.shed_expensive = 0
+
+    def queued(self):
+        """Count a connection or request entering the queue.
+
+        Called before it is queued, so observe() never sees it first.
+        """
+        with self.lock:
+            self.waiting += 1
+
+    def unqueued(self):
+        """Undo queued() for work the queue turned away."""
+        with self.lock:
+            self.waiting -= 1
+
+    def observe(self, delay):
+        """Record the queueing delay of work a handler thread just picked up.
+
+        Args:
+            delay (float): Seconds it waited in the queue.
+
+        Returns:
+            bool: True if it should be shed instead of served.
+        """
+        now = self.clock()
+        with self.lock:
+            self.waiting -= 1
+            self.last_delay = delay
+            if delay > self.max_delay:
+                self.max_delay = delay
+            if self.interval_min is None or delay < self.interval_min:
+                self.interval_min = delay
+            if now >= self.interval_end:
+                self.set_overloaded(self.interval_min > self.target_delay, now)
+                self.interval_min = None
+                self.interval_end = now + self.interval
+            if self.overloaded and delay > self.target_delay:
+                self.shed_queued += 1
+                return True
+            return False
+
+    def set_overloaded(self, overloaded, now):
+        """Enter or leave the overloaded state. Called with the lock held."""
+        if overloaded and not self.overloaded:
+            self.episodes += 1
+            self.overload_started = now
+        elif self.overloaded and not overloaded:
+            self.overloaded_seconds += now - self.overload_started
+        self.overloaded = overloaded
+
+    def is_overloaded(self):
+        """Check whether expensive requests should be refused.
+
+        The state is re-judged as work is picked up; if nothing was picked up
+        for a whole interval, the server is only overloaded if work is still
+        waiting.
+
+        Returns:
+            bool: True while the server is overloaded.
+        """
+        if not self.overloaded:
+            return False
+        now = self.clock()
+        if now < self.interval_end + self.interval:
+            return True
+        with self.lock:
+            if self.waiting <= 0 and now >= self.interval_end + self.interval:
+                self.set_overloaded(False, now)
+            return self.overloaded
+
+    def shed_request(self):
+        """Count an expensive request refused while overloaded."""
+        with self.lock:
+            self.shed_expensive += 1
+
+    def stats(self):
+        """Return a snapshot of the load shedding statistics.
+
+        Returns:
+            dict: Current state and queueing delay, overload history and shed counts.
+        """
+        now = self.clock()
+        with self.lock:
+            overloaded_seconds = self.overloaded_seconds
+            if self.overloaded:
+                overloaded_seconds += now - self.overload_started
+            return {
+                "State": "overloaded" if self.overloaded else "normal",
+                "Target Queue Delay (ms)": round(self.target_delay * 1000, 3),
+                "Last Queue Delay (ms)": round(self.last_delay * 1000, 3),
+                "Max Queue Delay (ms)": round(self.max_delay * 1000, 3),
+                "Waiting for a Handler": self.waiting,
+                "Overload Episodes": self.episodes,
+                "Time Overloaded (s)": round(overloaded_seconds, 1),
+                "Shed After Queueing (503)": self.shed_queued,
+                "Expensive Requests Shed (503)": self.shed_expensive,
+            }
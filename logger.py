@@ -1,49 +1,413 @@
+import atexit
+import os
+import queue
 import threading
 import time
+from collections import deque
 from datetime import datetime
+from metrics import Metrics, ShardedCounter, merge_stats
+from profiler import Profiler
+
+OVERFLOW_POLICIES = ("block", "drop", "sample")
+LOG_LEVELS = ("INFO", "REQUEST", "ERROR", "STATS")
+
+
+def entry_level(log_entry):
+    """Work out the level of a formatted log entry, e.g. one read back from the log file.
+
+    Args:
+        log_entry (str): A line such as "[01-01-2025 10:00:00] ERROR: ...".
+
+    Returns:
+        str: One of LOG_LEVELS.
+    """
+    message = log_entry.partition("] ")[2]
+    if message.startswith("REQUEST "):
+        return "REQUEST"
+    if message.startswith("ERROR:"):
+        return "ERROR"
+    if message.startswith("STATS:"):
+        return "STATS"
+    return "INFO"
 
 
 class Logger:
 
-    def __init__(self, log_file):
+    def __init__(
+        self,
+        log_file,
+        queue_size=10000,
+        flush_interval=1.0,
+        flush_bytes=65536,
+        overflow_policy="drop",
+        sample_rate=10,
+        recent_entries=1000,
+        profiler=None,
+    ):
         """Initialize the logger.
 
+        Log calls only format the entry and put it on a queue; a background
+        writer thread keeps the log file open, writes entries in batches and
+        flushes when flush_bytes have accumulated or flush_interval has passed.
+
         Parameters:
             log_file (str): The path to the log file.
+            queue_size (int, optional): Entries that may wait for the writer. Defaults to 10000.
+            flush_interval (float, optional): Longest time in seconds before written entries are flushed. Defaults to 1.0.
+            flush_bytes (int, optional): Unflushed bytes that trigger a flush. Defaults to 65536.
+            overflow_policy (str, optional): What log calls do when the queue is full:
+                "block" waits for space, "drop" discards the entry, "sample" keeps one
+                in sample_rate entries once the queue is half full and drops the rest. Defaults to
+                "drop"; "block" ties request latency to disk latency whenever the writer falls behind.
+            sample_rate (int, optional): Keep 1 in this many entries under the "sample" policy. Defaults to 10.
+            recent_entries (int, optional): Size of the in-memory ring buffer of recent entries. Defaults to 1000.
+            profiler (Profiler, optional): The on-demand profiler driven from the admin
+                interface. Defaults to None, which creates one with default settings.
         """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy '{overflow_policy}'")
         self.log_file = log_file
         self.lock = threading.Lock()
-        self.total_requests = 0
-        self.active_connections = (
-            {}
-        )  # dict to track active connections, e.g., {client_ip: connection_time}
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.overflow_policy = overflow_policy
+        self.sample_rate = max(1, sample_rate)
+        self.entries = queue.Queue(maxsize=queue_size)
+        self.sample_threshold = queue_size // 2
+        self.sample_counter = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self.sampled_out = 0
+        self.written = 0
+        self.batches = 0
+        self.flushes = 0
+        self.closed = False
+        self.recent = deque(maxlen=recent_entries)  # (level, entry), oldest first
+        self.request_counter = ShardedCounter()
+        self.metrics = Metrics()
+        self.profiler = profiler if profiler is not None else Profiler()
+        # Live connection table: connection id -> ConnectionInfo
+        self.active_connections = self.metrics.connections
         self.start_time = datetime.now()
+        self.stats_providers = {}  # section name -> callable returning a dict of stats
+        self.worker_reports = {}  # worker pid -> latest report of a prefork worker
+        self.retired_requests = 0  # Requests logged by workers that have exited
+        self.register_stats_provider("Log Writer", self.writer_stats)
+
+        self.writer_thread = threading.Thread(
+            target=self.writer_loop, name="log-writer", daemon=True
+        )
+        self.writer_thread.start()
+        atexit.register(self.close)
+
+    @property
+    def total_requests(self):
+        """int: Requests logged so far, summed over all threads and worker processes."""
+        with self.lock:
+            remote = self.retired_requests + sum(
+                report["requests_logged"] for report in self.worker_reports.values()
+            )
+        return self.request_counter.value + remote
+
+    def register_stats_provider(self, name, provider):
+        """Register a callable whose stats are shown on the admin interface.
+
+        Args:
+            name (str): Section title for the stats.
+            provider (callable): Returns a dict of stat name to value when called.
+        """
+        self.stats_providers[name] = provider
+
+    def collect_stats(self):
+        """Collect the stats of every registered provider.
+
+        Returns:
+            dict: Mapping of section name to that provider's stats dict.
+        """
+        stats = {}
+        for name, provider in list(self.stats_providers.items()):
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                stats[name] = {"Error": str(e)}
+        with self.lock:
+            reports = list(self.worker_reports.values())
+        if reports:
+            # Prefork mode: sections reported by several workers are combined.
+            sections = {}
+            for name, section in stats.items():
+                sections.setdefault(name, []).append(section)
+            for report in reports:
+                for name, section in report["stats"].items():
+                    sections.setdefault(name, []).append(section)
+            stats = {name: merge_stats(parts) for name, parts in sections.items()}
+        return stats
+
+    def worker_report(self):
+        """Build the report a prefork worker sends to the supervisor.
+
+        Returns:
+            dict: Requests logged, exported metrics and every stats section.
+        """
+        return {
+            "requests_logged": self.request_counter.value,
+            "metrics": self.metrics.export(),
+            "stats": self.collect_stats(),
+        }
+
+    def absorb_worker_report(self, worker, report):
+        """Store the latest report of a prefork worker.
+
+        Args:
+            worker (int): The worker's pid.
+            report (dict): The worker's worker_report().
+        """
+        with self.lock:
+            self.worker_reports[worker] = report
+        self.metrics.absorb(worker, report["metrics"])
+
+    def retire_worker(self, worker):
+        """Keep an exited worker's request counts in the totals and drop the rest of its report.
+
+        Args:
+            worker (int): The worker's pid.
+        """
+        with self.lock:
+            report = self.worker_reports.pop(worker, None)
+            if report is not None:
+                self.retired_requests += report["requests_logged"]
+        self.metrics.retire(worker)
+
+    def log(self, message, level="INFO"):
+        """Queue a log message for the background writer.
 
-    def log(self, message):
-        """Write a log message to the log file in a thread-safe manner
+        Never touches the disk, so request latency does not depend on disk
+        latency; what happens when the queue is full depends on the overflow policy.
+        The entry is also kept in the ring buffer of recent entries.
 
         Args:
             message (str): The message to log.
+            level (str, optional): One of LOG_LEVELS. Defaults to "INFO".
         """
         timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
         log_entry = f"[{timestamp}] {message}\n"
+        self.recent.append((level, log_entry))
+        if self.overflow_policy == "block":
+            self.entries.put(log_entry)
+            return
+        if self.overflow_policy == "sample" and (
+            self.entries.qsize() >= self.sample_threshold
+        ):
+            with self.lock:
+                self.sample_counter += 1
+                keep = self.sample_counter % self.sample_rate == 0
+                if not keep:
+                    self.sampled_out += 1
+            if not keep:
+                return
+        try:
+            self.entries.put_nowait(log_entry)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def writer_loop(self):
+        """Write queued entries to the log file in batches until close() is called.
+
+        If the log file cannot be opened or written, the batch in hand is
+        counted as dropped and the file is reopened for the next one, so the
+        queue keeps draining and "block" callers are never left waiting on a
+        writer that has died.
+        """
+        log_file = None
+        pending_bytes = 0
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    batch = [self.entries.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    batch = []
+                # Drain whatever else is already waiting into the same write.
+                while True:
+                    try:
+                        batch.append(self.entries.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = None in batch
+                if stopping:
+                    batch = [entry for entry in batch if entry is not None]
+                if batch:
+                    data = "".join(batch)
+                    try:
+                        if log_file is None:
+                            log_file = open(self.log_file, "a", errors="backslashreplace")
+                        log_file.write(data)
+                    except OSError:
+                        log_file = self.discard_log_file(log_file)
+                        with self.lock:
+                            self.dropped += len(batch)
+                    else:
+                        pending_bytes += len(data)
+                        with self.lock:
+                            self.written += len(batch)
+                            self.batches += 1
+                now = time.monotonic()
+                if pending_bytes and (
+                    stopping
+                    or pending_bytes >= self.flush_bytes
+                    or now - last_flush >= self.flush_interval
+                ):
+                    try:
+                        log_file.flush()
+                    except OSError:
+                        log_file = self.discard_log_file(log_file)
+                    else:
+                        with self.lock:
+                            self.flushes += 1
+                    pending_bytes = 0
+                    last_flush = now
+                if stopping:
+                    return
+        finally:
+            self.discard_log_file(log_file, failed=False)
+
+    def discard_log_file(self, log_file, failed=True):
+        """Close the log file after a write error (or at exit), ignoring further errors.
+
+        Returns:
+            None, to be assigned to the writer's file so it is reopened.
+        """
+        if failed:
+            with self.lock:
+                self.write_errors += 1
+        if log_file is not None:
+            try:
+                log_file.close()
+            except OSError:
+                pass
+        return None
+
+    def close(self, timeout=5.0):
+        """Drain queued entries to disk and stop the writer thread.
+
+        Args:
+            timeout (float, optional): Longest time in seconds to wait for the drain. Defaults to 5.0.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.entries.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.writer_thread.join(timeout)
+
+    def recent_entries(self, count=10, level=None):
+        """Return the most recent log entries from the in-memory ring buffer.
+
+        Cost depends only on the ring buffer size, never on the size of the log file.
+
+        Args:
+            count (int, optional): Number of entries to return. Defaults to 10.
+            level (str, optional): Only return entries of this level. Defaults to None.
+
+        Returns:
+            list: Up to count formatted entries, oldest first.
+        """
+        if level is None:
+            entries = list(self.recent)[-count:]
+            return [entry for _, entry in entries]
+        matches = []
+        for recent_level, entry in reversed(list(self.recent)):
+            if recent_level == level:
+                matches.append(entry)
+                if len(matches) == count:
+                    break
+        matches.reverse()
+        return matches
+
+    def tail(self, count=10, level=None, block_size=65536, max_bytes=16 * 1024 * 1024):
+        """Return the last log entries by reading the log file backwards from its end.
+
+        Used for windows larger than the ring buffer. Reads blocks from the end
+        of the file until enough entries are found, so the cost depends on the
+        window, not on the size of the file.
+
+        Args:
+            count (int, optional): Number of entries to return. Defaults to 10.
+            level (str, optional): Only return entries of this level. Defaults to None.
+            block_size (int, optional): Bytes read per step. Defaults to 65536.
+            max_bytes (int, optional): Give up after reading this many bytes. Defaults to 16 MB.
+
+        Returns:
+            list: Up to count formatted entries, oldest first.
+        """
+        if not os.path.exists(self.log_file):
+            return []
+        matches = []
+        with open(self.log_file, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            remainder = b""
+            read = 0
+            while position > 0 and len(matches) < count and read < max_bytes:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + remainder
+                read += step
+                lines = data.split(b"\n")
+                # The first piece may be the tail of an earlier line; keep it for the next step.
+                remainder = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    if not line:
+                        continue
+                    entry = line.decode("utf-8", errors="replace") + "\n"
+                    if level is None or entry_level(entry) == level:
+                        matches.append(entry)
+                        if len(matches) == count:
+                            break
+        matches.reverse()
+        return matches
+
+    def writer_stats(self):
+        """Return a snapshot of the log writer statistics.
+
+        Returns:
+            dict: Queue depth, write errors and written, dropped and sampled-out counts.
+        """
         with self.lock:
-            with open(self.log_file, "a") as f:
-                f.write(log_entry)
+            return {
+                "Overflow Policy": self.overflow_policy,
+                "Queued Entries": self.entries.qsize(),
+                "Entries Written": self.written,
+                "Write Batches": self.batches,
+                "Flushes": self.flushes,
+                "Entries Dropped": self.dropped,
+                "Entries Sampled Out": self.sampled_out,
+                "Write Errors": self.write_errors,
+            }
 
-    def log_request(self, client_ip, request_line, response_code):
+    def log_request(self, client_ip, request_line, response_code, aborted=False):
         """Log an HTTP request.
 
         Args:
             client_ip (str): The IP address of the client.
             request_line (str): The HTTP request line.
             response_code (int): The HTTP request code.
+            aborted (bool, optional): True if the response body was cut short. Defaults to False.
         """
-        self.total_requests += 1
-        message = (
-            f"REQUEST from {client_ip}: '{request_line}' responded with {response_code}"
-        )
-        self.log(message)
+        self.request_counter.increment()
+        if aborted:
+            message = (
+                f"REQUEST from {client_ip}: '{request_line}' aborted "
+                f"after {response_code} headers, body incomplete"
+            )
+        else:
+            message = (
+                f"REQUEST from {client_ip}: '{request_line}' responded with {response_code}"
+            )
+        self.log(message, "REQUEST")
 
     def log_error(self, error_message):
         """Log an error message.
@@ -51,16 +415,17 @@ class Logger:
         Args:
             error_message (str): A detailed error description.
         """
-        self.log(f"ERROR: {error_message}")
+        self.log(f"ERROR: {error_message}", "ERROR")
 
     def log_stats(self):
         """Log periodic server statistics: total requests server, active connections, and uptime."""
         uptime = (datetime.now() - self.start_time).total_seconds()
         stats_message = (
             f"STATS: Total Request: {self.total_requests}, "
-            f"Active Connections: {len(self.active_connections)},"
+            f"Active Connections: {len(self.metrics.connection_table())}, "
             f"Uptime: {uptime: .0f} seconds."
         )
+        self.log(stats_message, "STATS")
 
     def start_periodic_stats(self, interval=60):
 
@@ -70,7 +435,7 @@ class Logger:
                 self.log_stats()
 
         stats_thread = threading.Thread(target=stats_loop, daemon=True)
-        stats_thread = threading.Thread(target=stats_loop, daemon=True)
+        stats_thread.start()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,446 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Parts of a request timed separately by the request handler: receiving and
+# parsing the head, resolving the path, filesystem work, the rest of the
+# handler, and writing the response.
+REQUEST_PHASES = ("recv", "parse", "resolve", "disk", "handle", "send")
+
+# Request methods get their own label; anything else is counted as "OTHER" so
+# clients can't create unbounded label sets.
+KNOWN_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "TRACE", "CONNECT")
+)
+
+
+def add_histograms(total, histograms):
+    """Add histograms into a running total, in place.
+
+    Args:
+        total (dict): (method, status) -> histogram, updated in place.
+        histograms (dict): (method, status) -> histogram to add.
+    """
+    for key, histogram in histograms.items():
+        current = total.get(key)
+        if current is None:
+            total[key] = list(histogram)
+        else:
+            for i, value in enumerate(histogram):
+                current[i] += value
+
+
+def merge_stats(sections):
+    """Combine the same stats section reported by several worker processes.
+
+    Counters are summed, "Max" figures take the maximum, averages, ratios and
+    "Last" figures are averaged over the workers, and text values are kept
+    when every worker reports the same one.
+
+    Args:
+        sections (list): The stats dicts to combine.
+
+    Returns:
+        dict: The whole-server stats.
+    """
+    merged = {}
+    for name in sections[0]:
+        values = [section[name] for section in sections if name in section]
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            merged[name] = values[0] if len(set(map(str, values))) == 1 else ", ".join(map(str, values))
+        elif name.startswith("Max"):
+            merged[name] = max(values)
+        elif "Average" in name or "Ratio" in name or name.startswith("Last"):
+            merged[name] = round(sum(values) / len(values), 3)
+        else:
+            merged[name] = sum(values)
+    return merged
+
+
+class ShardedCounter:
+    """A counter that threads increment without sharing a lock.
+
+    Each thread adds to its own shard; reading the value sums the shards, so
+    its cost depends on the number of threads, not on how often it was incremented.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()  # Only taken when a thread creates its shard
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = [0]
+            with self.lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def increment(self, amount=1):
+        self.shard()[0] += amount
+
+    @property
+    def value(self):
+        with self.lock:
+            shards = list(self.shards)
+        return sum(shard[0] for shard in shards)
+
+
+class HistogramShard:
+    """One thread's share of the request histograms."""
+
+    def __init__(self):
+        self.histograms = {}  # (method, status) -> [bucket counts..., sum, count]
+        # Seconds spent in each request phase, and the requests they add up over.
+        self.phase_seconds = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.phase_requests = 0
+        self.bytes_sent = 0
+
+
+class ConnectionInfo:
+    """An entry of the live connection table."""
+
+    __slots__ = ("client_ip", "client_port", "connected_at", "requests", "last_request")
+
+    def __init__(self, client_addr):
+        self.client_ip = client_addr[0]
+        self.client_port = client_addr[1] if len(client_addr) > 1 else None
+        self.connected_at = datetime.now()
+        self.requests = 0
+        self.last_request = ""
+
+
+class Metrics:
+
+    def __init__(self):
+        """Initialize the metrics registry: request histograms, bytes sent and live connections."""
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()  # Only taken to add a shard or snapshot
+        self.connection_ids = itertools.count(1)
+        self.connections = {}  # connection id -> ConnectionInfo
+        self.start_time = time.time()
+        # Prefork mode: latest export of each live worker, plus the
+        # histograms and bytes of workers that have exited.
+        self.remote = {}  # worker pid -> exported metrics
+        self.retired_histograms = {}
+        self.retired_phase_seconds = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.retired_phase_requests = 0
+        self.retired_bytes = 0
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = HistogramShard()
+            with self.shards_lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def observe_request(self, method, status_code, duration, bytes_sent):
+        """Record one finished request in the calling thread's shard.
+
+        Args:
+            method (str): The request method.
+            status_code (int): The response status.
+            duration (float): Time spent handling the request, in seconds.
+            bytes_sent (int): Bytes written to the client for the response.
+        """
+        if method not in KNOWN_METHODS:
+            method = "OTHER"
+        shard = self.shard()
+        key = (method, status_code)
+        histogram = shard.histograms.get(key)
+        if histogram is None:
+            histogram = [0] * (len(LATENCY_BUCKETS) + 3)
+            shard.histograms[key] = histogram
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+        shard.bytes_sent += bytes_sent
+
+    def observe_phases(self, phases):
+        """Record the time one request spent in each phase.
+
+        Only running totals are kept, so this stays cheap enough to run on
+        every request; the slow request log has per-request breakdowns.
+
+        Args:
+            phases (dict): Phase name (see REQUEST_PHASES) -> seconds.
+        """
+        shard = self.shard()
+        totals = shard.phase_seconds
+        for phase, seconds in phases.items():
+            totals[phase] += seconds
+        shard.phase_requests += 1
+
+    def connection_opened(self, client_addr):
+        """Add a connection to the live connection table.
+
+        Args:
+            client_addr (tuple): The client's address.
+
+        Returns:
+            tuple: (connection id, ConnectionInfo) to update and close later.
+        """
+        connection_id = next(self.connection_ids)
+        info = ConnectionInfo(client_addr)
+        self.connections[connection_id] = info
+        return connection_id, info
+
+    def connection_closed(self, connection_id):
+        """Remove a connection from the live connection table.
+
+        Args:
+            connection_id (int): The id returned by connection_opened().
+        """
+        self.connections.pop(connection_id, None)
+
+    def merged_histograms(self):
+        """Sum the per-thread histograms, and those reported by worker processes.
+
+        Returns:
+            tuple: (histograms by (method, status), total bytes sent).
+        """
+        with self.shards_lock:
+            shards = list(self.shards)
+            remote = list(self.remote.values())
+            merged = {}
+            add_histograms(merged, self.retired_histograms)
+            bytes_sent = self.retired_bytes
+        for shard in shards:
+            bytes_sent += shard.bytes_sent
+            add_histograms(merged, dict(shard.histograms))
+        for exported in remote:
+            bytes_sent += exported["bytes_sent"]
+            add_histograms(merged, exported["histograms"])
+        return merged, bytes_sent
+
+    def merged_phases(self):
+        """Sum the per-thread request phase totals, and those reported by worker processes.
+
+        Returns:
+            tuple: (seconds by phase, requests timed).
+        """
+        with self.shards_lock:
+            shards = list(self.shards)
+            remote = list(self.remote.values())
+            seconds = dict(self.retired_phase_seconds)
+            requests = self.retired_phase_requests
+        for shard in shards:
+            requests += shard.phase_requests
+            for phase, value in dict(shard.phase_seconds).items():
+                seconds[phase] += value
+        for exported in remote:
+            requests += exported["phase_requests"]
+            for phase, value in exported["phase_seconds"].items():
+                seconds[phase] += value
+        return seconds, requests
+
+    def connection_table(self):
+        """List the open connections of this process and of the worker processes.
+
+        Returns:
+            list: One dict per connection.
+        """
+        pid = os.getpid()
+        connections = [
+            {
+                "id": connection_id,
+                "pid": pid,
+                "client_ip": info.client_ip,
+                "client_port": info.client_port,
+                "connected_at": info.connected_at.isoformat(timespec="seconds"),
+                "requests": info.requests,
+                "last_request": info.last_request,
+            }
+            for connection_id, info in list(self.connections.items())
+        ]
+        with self.shards_lock:
+            remote = list(self.remote.values())
+        for exported in remote:
+            connections.extend(exported["connections"])
+        return connections
+
+    def export(self):
+        """Return this process's metrics for aggregation by the prefork supervisor.
+
+        Returns:
+            dict: Merged histograms, bytes sent and the connection table.
+        """
+        histograms, bytes_sent = self.merged_histograms()
+        phase_seconds, phase_requests = self.merged_phases()
+        return {
+            "histograms": histograms,
+            "phase_seconds": phase_seconds,
+            "phase_requests": phase_requests,
+            "bytes_sent": bytes_sent,
+            "connections": self.connection_table(),
+        }
+
+    def absorb(self, worker, exported):
+        """Replace a worker process's contribution with its latest export.
+
+        Args:
+            worker (int): The worker's pid.
+            exported (dict): The worker's export().
+        """
+        with self.shards_lock:
+            self.remote[worker] = exported
+
+    def retire(self, worker):
+        """Keep an exited worker's counters in the totals and drop its connections.
+
+        Args:
+            worker (int): The worker's pid.
+        """
+        with self.shards_lock:
+            exported = self.remote.pop(worker, None)
+            if exported is not None:
+                add_histograms(self.retired_histograms, exported["histograms"])
+                for phase, seconds in exported["phase_seconds"].items():
+                    self.retired_phase_seconds[phase] += seconds
+                self.retired_phase_requests += exported["phase_requests"]
+                self.retired_bytes += exported["bytes_sent"]
+
+    @staticmethod
+    def percentile(histogram, fraction):
+        """Estimate a latency percentile from bucket counts.
+
+        Interpolates linearly inside the bucket holding the percentile; values
+        in the +Inf bucket are reported as the largest finite bound.
+
+        Args:
+            histogram (list): Bucket counts followed by sum and count.
+            fraction (float): e.g. 0.99 for p99.
+
+        Returns:
+            float: The estimated latency in seconds.
+        """
+        count = histogram[-1]
+        if not count:
+            return 0.0
+        rank = fraction * count
+        cumulative = 0
+        lower = 0.0
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            in_bucket = histogram[i]
+            if cumulative + in_bucket >= rank and in_bucket:
+                return lower + (bound - lower) * (rank - cumulative) / in_bucket
+            cumulative += in_bucket
+            lower = bound
+        return LATENCY_BUCKETS[-1]
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict.
+
+        Returns:
+            dict: Totals, per (method, status) latency percentiles, the
+            average time per request phase and the connection table.
+        """
+        merged, bytes_sent = self.merged_histograms()
+        requests = []
+        total_requests = 0
+        for (method, status_code), histogram in sorted(merged.items()):
+            count = histogram[-1]
+            total_requests += count
+            requests.append(
+                {
+                    "method": method,
+                    "status": status_code,
+                    "count": count,
+                    "mean_ms": round(histogram[-2] / count * 1000, 3) if count else 0.0,
+                    "p50_ms": round(self.percentile(histogram, 0.50) * 1000, 3),
+                    "p95_ms": round(self.percentile(histogram, 0.95) * 1000, 3),
+                    "p99_ms": round(self.percentile(histogram, 0.99) * 1000, 3),
+                }
+            )
+        phase_seconds, phase_requests = self.merged_phases()
+        timed = sum(phase_seconds.values())
+        phases = [
+            {
+                "phase": phase,
+                "seconds_total": round(seconds, 6),
+                "mean_ms": round(seconds / phase_requests * 1000, 4) if phase_requests else 0.0,
+                "share": round(seconds / timed, 3) if timed else 0.0,
+            }
+            for phase, seconds in phase_seconds.items()
+        ]
+        connections = self.connection_table()
+        return {
+            "uptime_seconds": round(time.time() - self.start_time, 3),
+            "requests_total": total_requests,
+            "bytes_sent_total": bytes_sent,
+            "connections_in_flight": len(connections),
+            "requests": requests,
+            "phases": phases,
+            "connections": connections,
+        }
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        merged, bytes_sent = self.merged_histograms()
+        lines = [
+            "# HELP http_request_duration_seconds Time spent handling requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, status_code), histogram in sorted(merged.items()):
+            labels = f'method="{method}",status="{status_code}"'
+            cumulative = 0
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                cumulative += histogram[i]
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-1]}'
+            )
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram[-2]}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {histogram[-1]}")
+        phase_seconds, phase_requests = self.merged_phases()
+        lines += [
+            "# HELP http_request_phase_seconds Time spent in each phase of a request.",
+            "# TYPE http_request_phase_seconds summary",
+        ]
+        for phase, seconds in phase_seconds.items():
+            lines.append(f'http_request_phase_seconds_sum{{phase="{phase}"}} {seconds}')
+            lines.append(f'http_request_phase_seconds_count{{phase="{phase}"}} {phase_requests}')
+        lines += [
+            "# HELP http_response_bytes_total Bytes written to clients.",
+            "# TYPE http_response_bytes_total counter",
+            f"http_response_bytes_total {bytes_sent}",
+            "# HELP http_connections_in_flight Open client connections.",
+            "# TYPE http_connections_in_flight gauge",
+            f"http_connections_in_flight {len(self.connection_table())}",
+            "# HELP process_uptime_seconds Seconds since the server started.",
+            "# TYPE process_uptime_seconds gauge",
+            f"process_uptime_seconds {round(time.time() - self.start_time, 3)}",
+        ]
+        return "\n".join(lines) + "\n"
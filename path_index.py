@@ -0,0 +1,249 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from utils import safe_path
+
+# Kinds of resolved URL paths.
+FILE = "file"
+DIRECTORY = "directory"
+MISSING = "missing"
+
+
+class Resolution:
+    """What a URL path maps to under the document root."""
+
+    __slots__ = ("path", "kind", "stat", "index_path", "expires", "watched_dirs")
+
+    def __init__(self, path, kind, st, index_path=None, expires=None, watched_dirs=()):
+        self.path = path
+        self.kind = kind
+        self.stat = st
+        self.index_path = index_path  # index.html to serve for a directory, if any
+        self.expires = expires  # monotonic deadline of a negative entry
+        self.watched_dirs = watched_dirs  # (directory, mtime_ns) pairs it depends on
+
+
+class PathIndex:
+
+    def __init__(self, document_root, max_entries=10000, negative_ttl=2.0, poll_interval=1.0):
+        """Initialize a bounded cache of URL path resolutions.
+
+        A hit answers "what does this URL path map to" without normalizing the
+        path or touching the filesystem. Entries depend on the directories
+        whose listing decides them (the parent directory, and for directories
+        the directory itself); a background thread polls those directories'
+        mtimes and drops dependent entries when a file is added, removed or
+        renamed. Negative entries also expire after negative_ttl seconds.
+
+        Args:
+            document_root (str): The base directory where static files are served from.
+            max_entries (int, optional): Most cached resolutions; 0 disables the cache. Defaults to 10000.
+            negative_ttl (float, optional): Seconds a "not found" entry is trusted. Defaults to 2.0.
+            poll_interval (float, optional): Seconds between directory mtime polls. Defaults to 1.0.
+        """
+        self.document_root = os.path.abspath(document_root)
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.poll_interval = poll_interval
+        self.entries = OrderedDict()  # URL path -> Resolution, oldest first
+        self.watched = {}  # directory -> mtime_ns when its dependents were resolved
+        self.dependents = {}  # directory -> set of URL paths
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if max_entries > 0:
+            threading.Thread(
+                target=self.poll_loop, name="path-index-poller", daemon=True
+            ).start()
+
+    def resolve(self, url_path):
+        """Map a URL path to a file, a directory or nothing.
+
+        Args:
+            url_path (str): The requested URL path (e.g., "/index.html").
+
+        Returns:
+            Resolution: The resolution; kind is FILE, DIRECTORY or MISSING.
+
+        Raises:
+            ValueError: If the path resolves outside the document root.
+        """
+        if self.max_entries <= 0:
+            return self.lookup(url_path)
+        with self.lock:
+            resolution = self.entries.get(url_path)
+            if resolution is not None:
+                if resolution.expires is None or resolution.expires > time.monotonic():
+                    self.entries.move_to_end(url_path)
+                    if resolution.kind == MISSING:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return resolution
+                self.remove(url_path)
+            self.misses += 1
+        resolution = self.lookup(url_path)
+        with self.lock:
+            if url_path in self.entries:
+                self.remove(url_path)
+            self.entries[url_path] = resolution
+            for directory, mtime_ns in resolution.watched_dirs:
+                # An older recorded mtime is kept: the next poll then drops this entry too.
+                self.watched.setdefault(directory, mtime_ns)
+                self.dependents.setdefault(directory, set()).add(url_path)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = next(iter(self.entries.items()))
+                self.remove(evicted)
+                self.evictions += 1
+        return resolution
+
+    def lookup(self, url_path):
+        """Resolve a URL path against the filesystem, without the cache.
+
+        The directories an entry depends on are stat'ed before the entry
+        itself, so a change racing with the lookup is caught by the next poll.
+
+        Returns:
+            Resolution: The fresh resolution.
+        """
+        full_path = safe_path(self.document_root, url_path)
+        parent = os.path.dirname(full_path)
+        watched_dirs = []
+        self.watch(parent, watched_dirs)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return Resolution(
+                full_path,
+                MISSING,
+                None,
+                expires=time.monotonic() + self.negative_ttl,
+                watched_dirs=tuple(watched_dirs),
+            )
+        if stat.S_ISDIR(st.st_mode):
+            # The directory's own mtime changes when index.html appears or goes.
+            self.watch(full_path, watched_dirs)
+            index_path = os.path.join(full_path, "index.html")
+            if not os.path.isfile(index_path):
+                index_path = None
+            return Resolution(
+                full_path, DIRECTORY, st, index_path, watched_dirs=tuple(watched_dirs)
+            )
+        if stat.S_ISREG(st.st_mode):
+            return Resolution(full_path, FILE, st, watched_dirs=tuple(watched_dirs))
+        # Sockets, FIFOs and devices are never served.
+        return Resolution(
+            full_path,
+            MISSING,
+            None,
+            expires=time.monotonic() + self.negative_ttl,
+            watched_dirs=tuple(watched_dirs),
+        )
+
+    def url_path_for(self, path):
+        """Return the URL path of a resolved path under the document root.
+
+        Args:
+            path (str): A path returned in a Resolution.
+
+        Returns:
+            str: e.g. "/docs/" for <document root>/docs.
+        """
+        relative = os.path.relpath(path, self.document_root)
+        if relative == ".":
+            return "/"
+        return "/" + relative.replace(os.sep, "/") + "/"
+
+    def watch(self, directory, watched_dirs):
+        """Record a directory and its current mtime as a dependency, if it exists."""
+        if self.max_entries <= 0:
+            return
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        watched_dirs.append((directory, mtime_ns))
+
+    def remove(self, url_path):
+        """Drop an entry and its dependency links. The caller must hold the lock."""
+        resolution = self.entries.pop(url_path)
+        for directory, _ in resolution.watched_dirs:
+            dependents = self.dependents.get(directory)
+            if dependents is not None:
+                dependents.discard(url_path)
+                if not dependents:
+                    del self.dependents[directory]
+                    self.watched.pop(directory, None)
+
+    def invalidate(self, url_path):
+        """Drop a URL path's entry and the entries depending on its directory now.
+
+        Used after the server itself changes a file, so the change is seen
+        without waiting for the next poll or a negative entry's expiry.
+
+        Args:
+            url_path (str): The URL path that was written.
+        """
+        directory = os.path.dirname(safe_path(self.document_root, url_path))
+        with self.lock:
+            if url_path in self.entries:
+                self.remove(url_path)
+                self.invalidations += 1
+            self.drop_dependents(directory)
+
+    def drop_dependents(self, directory):
+        """Drop every entry depending on a directory. The caller must hold the lock."""
+        for url_path in list(self.dependents.get(directory, ())):
+            if url_path in self.entries:
+                self.remove(url_path)
+                self.invalidations += 1
+        self.dependents.pop(directory, None)
+        self.watched.pop(directory, None)
+
+    def poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.poll()
+
+    def poll(self):
+        """Drop the entries of every watched directory whose mtime has changed."""
+        with self.lock:
+            watched = list(self.watched.items())
+        for directory, mtime_ns in watched:
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current == mtime_ns:
+                continue
+            with self.lock:
+                self.drop_dependents(directory)
+
+    def stats(self):
+        """Return a snapshot of the path index statistics.
+
+        Returns:
+            dict: Entry counts and hit/miss/invalidation counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "Entries": len(self.entries),
+                "Capacity": self.max_entries,
+                "Watched Directories": len(self.watched),
+                "Hits": self.hits,
+                "Negative Hits": self.negative_hits,
+                "Misses": self.misses,
+                "Hit Ratio": (
+                    round((self.hits + self.negative_hits) / lookups, 3)
+                    if lookups
+                    else 0.0
+                ),
+                "Evictions": self.evictions,
+                "Invalidations": self.invalidations,
+            }
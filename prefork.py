@@ -0,0 +1,201 @@
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+
+def reuse_port_supported():
+    """Check whether the platform lets several sockets listen on one port.
+
+    Returns:
+        bool: True if SO_REUSEPORT is available.
+    """
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def start_stats_reporter(logger, reports, interval):
+    """Periodically send a worker's stats to the supervisor.
+
+    The worker exits once the supervisor is gone, so killing the supervisor
+    never leaves orphaned workers holding the port.
+
+    Args:
+        logger (Logger): The worker's logger.
+        reports (multiprocessing.Queue): The supervisor's report queue.
+        interval (float): Seconds between reports.
+    """
+    pid = multiprocessing.current_process().pid
+    supervisor = multiprocessing.parent_process()
+
+    def report_loop():
+        while True:
+            time.sleep(interval)
+            if supervisor is not None and not supervisor.is_alive():
+                logger.close()
+                os._exit(0)
+            try:
+                reports.put((pid, logger.worker_report()))
+            except Exception as e:
+                logger.log_error(f"Failed to report worker stats: {e}")
+
+    thread = threading.Thread(target=report_loop, name="stats-reporter", daemon=True)
+    thread.start()
+
+
+class Supervisor:
+
+    def __init__(self, config, logger, worker_target):
+        """Initialize the prefork supervisor.
+
+        Worker processes are started with the "spawn" method, so each one is
+        a fresh interpreter rather than a fork of this multi-threaded process.
+        With SO_REUSEPORT every worker binds its own listening socket and the
+        kernel spreads connections across them; otherwise the workers share
+        a listening socket created here.
+
+        Args:
+            config (dict): Configuration parameters.
+            logger (Logger): The supervisor's logger; worker reports are merged into it.
+            worker_target (callable): Entry point of a worker process, called as
+                worker_target(config, index, listen_socket, reports).
+        """
+        self.config = config
+        self.logger = logger
+        self.worker_target = worker_target
+        self.num_workers = config["workers"]
+        self.reuse_port = config.get("reuse_port", True) and reuse_port_supported()
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.processes = [None] * self.num_workers
+        self.started_at = [0.0] * self.num_workers
+        self.lock = threading.Lock()
+        self.live_pids = set()
+        self.restarts = 0
+        self.listen_socket = None
+
+    def bind(self):
+        """Claim the server port before any worker starts, so a bad address fails fast.
+
+        With SO_REUSEPORT the socket is bound but never listens, so it only
+        reserves the port; the workers' own sockets receive the connections.
+        """
+        host, port = self.config["host"], self.config["port"]
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.listen_socket.bind((host, port))
+        if not self.reuse_port:
+            self.listen_socket.listen(self.config.get("listen_backlog", 128))
+
+    def spawn(self, index):
+        """Start (or restart) the worker in one slot.
+
+        Args:
+            index (int): The worker slot.
+        """
+        process = self.context.Process(
+            target=self.worker_target,
+            args=(
+                self.config,
+                index,
+                None if self.reuse_port else self.listen_socket,
+                self.reports,
+            ),
+            name=f"http-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        with self.lock:
+            self.live_pids.add(process.pid)
+        self.logger.log(f"Started worker {index} (pid {process.pid})")
+
+    def collect_reports(self):
+        """Merge worker reports into the supervisor's logger as they arrive."""
+        while True:
+            try:
+                pid, report = self.reports.get()
+            except Exception as e:
+                self.logger.log_error(f"Failed to read worker report: {e}")
+                continue
+            with self.lock:
+                # A late report from a worker that was already reaped is ignored.
+                if pid not in self.live_pids:
+                    continue
+                self.logger.absorb_worker_report(pid, report)
+
+    def reap(self, index):
+        """Record the exit of a worker and drop it from the live set.
+
+        Args:
+            index (int): The worker slot.
+        """
+        process = self.processes[index]
+        with self.lock:
+            self.live_pids.discard(process.pid)
+            self.logger.retire_worker(process.pid)
+        self.logger.log_error(
+            f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}"
+        )
+
+    def run(self):
+        """Start the workers and restart any that exit, until the supervisor is stopped."""
+        self.bind()
+        mode = "SO_REUSEPORT" if self.reuse_port else "shared socket"
+        print(
+            f"Supervisor starting {self.num_workers} workers on "
+            f"{self.config['host']}:{self.config['port']} ({mode})"
+        )
+        self.logger.register_stats_provider("Prefork Workers", self.stats)
+        # Turn SIGTERM into a normal exit so the workers are stopped below.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        threading.Thread(
+            target=self.collect_reports, name="report-collector", daemon=True
+        ).start()
+        for index in range(self.num_workers):
+            self.spawn(index)
+
+        try:
+            while True:
+                time.sleep(0.5)
+                for index, process in enumerate(self.processes):
+                    if process.is_alive():
+                        continue
+                    self.reap(index)
+                    # A worker that dies straight after starting is not restarted
+                    # in a tight loop.
+                    if time.monotonic() - self.started_at[index] < 1.0:
+                        time.sleep(1.0)
+                    self.restarts += 1
+                    self.spawn(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in self.processes:
+                if process is not None and process.is_alive():
+                    process.terminate()
+            for process in self.processes:
+                if process is not None:
+                    process.join(timeout=5)
+            self.listen_socket.close()
+
+    def stats(self):
+        """Return a snapshot of the supervisor statistics.
+
+        Returns:
+            dict: Worker count, live workers, restarts and listening mode.
+        """
+        with self.lock:
+            live = len(self.live_pids)
+        return {
+            "Worker Processes": self.num_workers,
+            "Live Workers": live,
+            "Restarts": self.restarts,
+            "Listening Mode": "SO_REUSEPORT" if self.reuse_port else "shared socket",
+            "Reporting Workers": len(self.logger.worker_reports),
+        }
@@ -0,0 +1,280 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# From Python 3.12 cProfile is built on sys.monitoring, which allows only one
+# enabled profile per process, and that profile sees every thread.
+SHARED_PROFILE = sys.version_info >= (3, 12)
+
+
+class Profiler:
+
+    def __init__(self, sample_interval=0.005, max_seconds=300):
+        """Initialize an on-demand profiler for the request-serving threads.
+
+        Nothing is measured until start() opens a profiling window, so outside
+        a window the only cost is the request handler's check of `tracing`.
+
+        In "sample" mode a background thread records the stack of every other
+        thread each sample_interval seconds, at a cost that does not depend on
+        the request rate. In "cprofile" mode every request is run under a
+        per-thread cProfile.Profile (on Python 3.12 and later, one profile
+        enabled for the whole window covers every thread), which gives exact
+        call counts and times but slows requests down while the window is open.
+
+        Args:
+            sample_interval (float, optional): Seconds between stack samples. Defaults to 0.005.
+            max_seconds (float, optional): Longest window allowed. Defaults to 300.
+        """
+        self.sample_interval = sample_interval
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        self.local = threading.local()
+        self.running = False
+        self.tracing = False  # True while requests should run under cProfile
+        self.generation = 0
+        self.mode = None
+        self.started_at = None
+        self.deadline = None
+        self.active_calls = 0
+        self.samples = 0
+        self.stacks = Counter()  # folded stack -> samples
+        self.profiles = []  # one cProfile.Profile per thread that served a request
+        self.shared_profile = None  # The one profile of a window, see SHARED_PROFILE
+        self.report = None
+        self.folded = None
+        self.finished_at = None
+
+    def start(self, seconds, mode="sample"):
+        """Open a profiling window; the report is built when it closes.
+
+        Args:
+            seconds (float): Length of the window.
+            mode (str, optional): "sample" or "cprofile". Defaults to "sample".
+
+        Raises:
+            ValueError: If the mode or length is invalid.
+            RuntimeError: If a window is already open, or cProfile is in use by another tool.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(PROFILE_MODES)}")
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds}")
+        with self.lock:
+            if self.running:
+                raise RuntimeError("A profiling window is already open.")
+            self.running = True
+            self.generation += 1
+            self.mode = mode
+            self.started_at = datetime.now()
+            self.deadline = time.monotonic() + seconds
+            self.samples = 0
+            self.stacks = Counter()
+            self.profiles = []
+            self.stop_event.clear()
+            self.shared_profile = None
+            if mode == "cprofile" and SHARED_PROFILE:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError as e:
+                    self.running = False
+                    raise RuntimeError(f"cProfile is unavailable: {e}")
+                self.shared_profile = profile
+                self.profiles = [profile]
+            else:
+                self.tracing = mode == "cprofile"
+        threading.Thread(target=self.run_window, name="profiler", daemon=True).start()
+
+    def stop(self):
+        """Close the open profiling window early, if there is one."""
+        self.stop_event.set()
+
+    def run_window(self):
+        """Sample (or wait) until the window ends, then build the report."""
+        if self.mode == "sample":
+            while time.monotonic() < self.deadline:
+                self.sample()
+                if self.stop_event.wait(self.sample_interval):
+                    break
+        else:
+            self.stop_event.wait(max(0.0, self.deadline - time.monotonic()))
+        self.finish()
+
+    def sample(self):
+        """Record the current stack of every thread except the profiler's own."""
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def call(self, func, *args):
+        """Run func(*args) under this thread's cProfile.Profile if a cprofile window is open.
+
+        With a shared profile (SHARED_PROFILE), `tracing` stays False and
+        func runs directly, since the shared profile already sees it.
+
+        Returns:
+            The return value of func.
+        """
+        with self.lock:
+            if not self.tracing:
+                tracing = False
+            else:
+                tracing = True
+                self.active_calls += 1
+                if getattr(self.local, "generation", None) != self.generation:
+                    self.local.generation = self.generation
+                    self.local.profile = cProfile.Profile()
+                    self.profiles.append(self.local.profile)
+                profile = self.local.profile
+        if not tracing:
+            return func(*args)
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                pass  # Another profiler is active; serve the request unprofiled.
+            return func(*args)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.active_calls -= 1
+                if not self.active_calls:
+                    self.idle.notify_all()
+
+    def finish(self):
+        """Stop tracing and turn what was collected into the downloadable report."""
+        with self.lock:
+            self.tracing = False
+            if self.shared_profile is not None:
+                self.shared_profile.disable()
+            # Profiles still enabled by in-flight requests can't be read yet.
+            self.idle.wait_for(lambda: not self.active_calls, timeout=10)
+            mode, profiles, stacks = self.mode, list(self.profiles), self.stacks
+            samples = self.samples
+        elapsed = (datetime.now() - self.started_at).total_seconds()
+        header = (
+            f"{mode} profile, started {self.started_at.isoformat(timespec='seconds')}, "
+            f"{elapsed:.1f} seconds, pid {os.getpid()}\n\n"
+        )
+        if mode == "sample":
+            report = header + self.sample_report(stacks, samples)
+            folded = "".join(
+                f"{stack} {count}\n" for stack, count in stacks.most_common()
+            )
+        else:
+            report = header + self.cprofile_report(
+                profiles, shared=self.shared_profile is not None
+            )
+            folded = None
+        with self.lock:
+            self.report = report
+            self.folded = folded
+            self.finished_at = datetime.now()
+            self.running = False
+
+    def sample_report(self, stacks, samples, limit=40):
+        """Summarize stack samples by the functions they were in.
+
+        "Self" counts samples where a function was running itself; "total"
+        counts samples where it was anywhere on the stack.
+
+        Returns:
+            str: The report text.
+        """
+        own = Counter()
+        total = Counter()
+        thread_samples = 0
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            thread_samples += count
+            own[frames[-1]] += count
+            for function in set(frames):
+                total[function] += count
+        if not thread_samples:
+            return "No samples were taken.\n"
+        lines = [
+            f"{samples} samples every {self.sample_interval * 1000:g} ms, "
+            f"{thread_samples} thread stacks\n",
+            "\nSelf samples (functions running when sampled):\n",
+            f"{'samples':>10} {'percent':>8}  function\n",
+        ]
+        for function, count in own.most_common(limit):
+            lines.append(f"{count:>10} {count / thread_samples:>8.1%}  {function}\n")
+        lines += [
+            "\nTotal samples (functions anywhere on the stack):\n",
+            f"{'samples':>10} {'percent':>8}  function\n",
+        ]
+        for function, count in total.most_common(limit):
+            lines.append(f"{count:>10} {count / thread_samples:>8.1%}  {function}\n")
+        return "".join(lines)
+
+    @staticmethod
+    def cprofile_report(profiles, limit=40, shared=False):
+        """Merge the per-thread profiles and print them by cumulative and own time.
+
+        Args:
+            profiles (list): The cProfile.Profile objects of the window.
+            limit (int, optional): Functions listed per ordering. Defaults to 40.
+            shared (bool, optional): True for one profile covering every thread. Defaults to False.
+
+        Returns:
+            str: The report text.
+        """
+        if not profiles:
+            return "No requests were served during the window.\n"
+        stream = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        if shared:
+            stream.write("All threads profiled with one shared profile\n")
+        else:
+            stream.write(f"Requests profiled on {len(profiles)} threads\n")
+        stats.sort_stats("cumulative").print_stats(limit)
+        stats.sort_stats("tottime").print_stats(limit)
+        return stream.getvalue()
+
+    def status(self):
+        """Return the state of the profiler.
+
+        Returns:
+            dict: Whether a window is open, its mode and remaining time, and
+            when the last report was built.
+        """
+        with self.lock:
+            return {
+                "Running": self.running,
+                "Mode": self.mode or "none",
+                "Seconds Left": (
+                    round(max(0.0, self.deadline - time.monotonic()), 1)
+                    if self.running
+                    else 0
+                ),
+                "Samples": self.samples,
+                "Last Report": (
+                    self.finished_at.isoformat(timespec="seconds")
+                    if self.finished_at
+                    else "never"
+                ),
+            }
@@ -0,0 +1,711 @@
+import itertools
+import socket
+import threading
+import time
+from http_parser import RequestParseError
+from upload import RequestBody
+from utils import encode_path
+
+BALANCE_POLICIES = ("round_robin", "least_connections")
+
+# Headers that describe one connection, not the message, and are never
+# forwarded in either direction (in Title-Case, as the request parser stores
+# them). Expect is answered by this server rather than passed on.
+HOP_BY_HOP_HEADERS = frozenset(
+    (
+        "Connection",
+        "Keep-Alive",
+        "Proxy-Connection",
+        "Te",
+        "Trailer",
+        "Transfer-Encoding",
+        "Upgrade",
+        "Expect",
+    )
+)
+
+# Upstream response headers replaced by this server's own.
+REPLACED_RESPONSE_HEADERS = frozenset(("date", "server", "content-length"))
+
+MAX_RESPONSE_HEAD = 65536
+# Seconds before a down upstream is sent one trial request (half-open), so it
+# recovers even when health checks are off.
+DOWN_RETRY_DELAY = 5.0
+RECEIVE_SIZE = 65536
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream cannot be reached or sends a broken response."""
+
+    def __init__(self, status_code, message):
+        """Initialize the error.
+
+        Args:
+            status_code (int): HTTP status to answer with (502, 503 or 504).
+            message (str): A description of the problem.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def validate_proxy_routes(routes):
+    """Check the "proxy_routes" configuration field.
+
+    Args:
+        routes (list): Route dicts with "prefix" and "upstreams", and optionally
+            "balance", "strip_prefix" and "health_path".
+
+    Raises:
+        ValueError: If a route is malformed.
+    """
+    if not isinstance(routes, list):
+        raise ValueError("The 'proxy_routes' field must be a list of routes.")
+    for route in routes:
+        if not isinstance(route, dict):
+            raise ValueError("Each proxy route must be an object.")
+        prefix = route.get("prefix")
+        if not isinstance(prefix, str) or not prefix.startswith("/"):
+            raise ValueError("Each proxy route needs a 'prefix' starting with '/'.")
+        upstreams = route.get("upstreams")
+        if not isinstance(upstreams, list) or not upstreams:
+            raise ValueError(f"Proxy route '{prefix}' needs a list of 'upstreams'.")
+        for address in upstreams:
+            host, _, port = str(address).rpartition(":")
+            if not isinstance(address, str) or not host or not port.isdigit():
+                raise ValueError(
+                    f"Upstream '{address}' of proxy route '{prefix}' must be \"host:port\"."
+                )
+        if route.get("balance", "round_robin") not in BALANCE_POLICIES:
+            raise ValueError(
+                f"The 'balance' of proxy route '{prefix}' must be one of: "
+                f"{', '.join(BALANCE_POLICIES)}."
+            )
+        if not isinstance(route.get("strip_prefix", False), bool):
+            raise ValueError(f"The 'strip_prefix' of proxy route '{prefix}' must be true or false.")
+        health_path = route.get("health_path")
+        if health_path is not None and (
+            not isinstance(health_path, str) or not health_path.startswith("/")
+        ):
+            raise ValueError(
+                f"The 'health_path' of proxy route '{prefix}' must start with '/'."
+            )
+
+
+class UpstreamConnection:
+    """A connection to an upstream, with the bytes received but not yet parsed.
+
+    It has the buffer/feed() interface of a RequestParser, so RequestBody
+    can decode response bodies from it.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.reused = False
+
+    def feed(self, data):
+        self.buffer += data
+
+    def receive(self):
+        return self.sock.recv(RECEIVE_SIZE)
+
+    def closed_by_peer(self):
+        """Check, without blocking, whether an idle connection was closed by the upstream.
+
+        Returns:
+            bool: True if the upstream closed it or sent unexpected bytes.
+        """
+        # With a timeout set, recv() would first wait for the socket to be readable.
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1, socket.MSG_PEEK)
+            return True
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self.sock.settimeout(timeout)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class Upstream:
+
+    def __init__(
+        self,
+        address,
+        pool_size=8,
+        connect_timeout=2.0,
+        timeout=30.0,
+        retry_delay=DOWN_RETRY_DELAY,
+    ):
+        """Initialize an upstream server and its pool of idle keep-alive connections.
+
+        Args:
+            address (str): "host:port" of the upstream.
+            pool_size (int, optional): Most idle connections kept open. Defaults to 8.
+            connect_timeout (float, optional): Seconds to wait for a new connection. Defaults to 2.0.
+            timeout (float, optional): Seconds a send or receive may stall. Defaults to 30.0.
+            retry_delay (float, optional): Seconds between trial requests while the
+                upstream is down. Defaults to DOWN_RETRY_DELAY.
+        """
+        host, _, port = address.rpartition(":")
+        self.address = address
+        self.host = host.strip("[]")
+        self.port = int(port)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.health_path = None  # Set by the first route with a health_path
+        self.lock = threading.Lock()
+        self.idle = []  # Most recently released last, and reused first
+        self.healthy = True
+        self.retry_delay = retry_delay
+        self.retry_at = 0.0  # When a down upstream may be sent its next trial request
+        self.active = 0  # Requests in flight
+        self.requests = 0
+        self.failures = 0
+        self.opened = 0
+        self.reused = 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+        self.latency_max = 0.0
+        self.health_changes = 0
+
+    def acquire(self):
+        """Take a pooled connection, or open a new one, for one request.
+
+        Every acquired connection must be given back with release().
+
+        Returns:
+            UpstreamConnection: The connection; reused is True if it came from the pool.
+
+        Raises:
+            OSError: If a new connection cannot be opened.
+        """
+        with self.lock:
+            self.active += 1
+            self.requests += 1
+        while True:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                break
+            if not conn.closed_by_peer():
+                conn.reused = True
+                with self.lock:
+                    self.reused += 1
+                return conn
+            conn.close()
+        try:
+            sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        except OSError:
+            with self.lock:
+                self.active -= 1
+                self.failures += 1
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        with self.lock:
+            self.opened += 1
+        if not self.healthy:
+            self.set_healthy(True)  # A trial request got through
+        return UpstreamConnection(sock)
+
+    def release(self, conn, reusable, failed=False):
+        """Return a connection after its request, keeping it if it can serve another.
+
+        Args:
+            conn (UpstreamConnection): The connection from acquire().
+            reusable (bool): True if the response was read to its end and the
+                upstream keeps the connection open.
+            failed (bool, optional): Count the request as an upstream failure. Defaults to False.
+        """
+        with self.lock:
+            self.active -= 1
+            if failed:
+                self.failures += 1
+            if reusable and not conn.buffer and len(self.idle) < self.pool_size:
+                conn.reused = False
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def observe_latency(self, seconds):
+        """Record the time from sending a request to receiving its response head."""
+        with self.lock:
+            self.latency_total += seconds
+            self.latency_count += 1
+            if seconds > self.latency_max:
+                self.latency_max = seconds
+
+    def set_healthy(self, healthy):
+        """Mark the upstream up or down.
+
+        A down upstream is only chosen for one trial request every
+        retry_delay seconds, see claim_retry().
+        """
+        with self.lock:
+            if healthy != self.healthy:
+                self.healthy = healthy
+                self.health_changes += 1
+            if not healthy:
+                self.retry_at = time.monotonic() + self.retry_delay
+                idle, self.idle = self.idle, []
+            else:
+                idle = []
+        for conn in idle:
+            conn.close()
+
+    def claim_retry(self):
+        """Claim the trial request of a down upstream, if one is due.
+
+        Returns:
+            bool: True if the caller should send its request to this upstream.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.healthy or now < self.retry_at:
+                return False
+            self.retry_at = now + self.retry_delay
+            return True
+
+    def check_health(self):
+        """Probe the upstream: GET its health_path, or just connect if it has none.
+
+        Returns:
+            bool: True if it answered (with a status below 500).
+        """
+        try:
+            with socket.create_connection(
+                (self.host, self.port), self.connect_timeout
+            ) as sock:
+                if self.health_path is None:
+                    return True
+                sock.settimeout(self.connect_timeout)
+                sock.sendall(
+                    f"GET {self.health_path} HTTP/1.1\r\nHost: {self.address}\r\n"
+                    "Connection: close\r\n\r\n".encode("latin-1")
+                )
+                status = sock.recv(64).split(b" ", 2)
+                return len(status) > 1 and status[1].isdigit() and int(status[1]) < 500
+        except OSError:
+            return False
+
+    def stats(self):
+        """Return this upstream's statistics, labelled with its address."""
+        address = self.address
+        with self.lock:
+            average = self.latency_total / self.latency_count if self.latency_count else 0.0
+            return {
+                f"Status ({address})": "up" if self.healthy else "down",
+                f"In Flight ({address})": self.active,
+                f"Idle Pooled ({address})": len(self.idle),
+                f"Requests ({address})": self.requests,
+                f"Failures ({address})": self.failures,
+                f"Connections Opened ({address})": self.opened,
+                f"Connections Reused ({address})": self.reused,
+                f"Average Latency (ms) ({address})": round(average * 1000, 2),
+                f"Max Latency (ms) ({address})": round(self.latency_max * 1000, 2),
+                f"Health Changes ({address})": self.health_changes,
+            }
+
+
+class ProxyRoute:
+
+    def __init__(self, prefix, upstreams, balance="round_robin", strip_prefix=False):
+        """Initialize a path-prefix route to a group of upstreams.
+
+        Args:
+            prefix (str): URL path prefix, e.g. "/api/". "/api" also matches
+                "/api" and "/api/..." but not "/apiary".
+            upstreams (list): The Upstream objects requests are balanced over.
+            balance (str, optional): "round_robin" or "least_connections". Defaults to "round_robin".
+            strip_prefix (bool, optional): Remove the prefix from the forwarded path. Defaults to False.
+        """
+        self.prefix = prefix
+        self.upstreams = upstreams
+        self.balance = balance
+        self.strip_prefix = strip_prefix
+        self.counter = itertools.count()
+
+    def matches(self, path):
+        if not path.startswith(self.prefix):
+            return False
+        return (
+            self.prefix.endswith("/")
+            or len(path) == len(self.prefix)
+            or path[len(self.prefix)] == "/"
+        )
+
+    def target(self, path, query, raw_path=None):
+        """Return the request target sent upstream for a request path and query.
+
+        The path is forwarded as the client encoded it, unless the client
+        also encoded characters of the prefix; it is then re-encoded from
+        the decoded path.
+
+        Args:
+            path (str): The decoded request path, which the route matched.
+            query (str): The query string, or "".
+            raw_path (str, optional): The request path as the client sent it.
+        """
+        if raw_path is not None and raw_path.startswith(self.prefix):
+            rest = raw_path[len(self.prefix) :]
+        else:
+            rest = encode_path(path[len(self.prefix) :])
+        if self.strip_prefix:
+            path = "/" + rest.lstrip("/")
+        else:
+            path = self.prefix + rest
+        return f"{path}?{query}" if query else path
+
+    def choose(self, exclude=()):
+        """Pick the upstream for the next request among the healthy ones.
+
+        A down upstream whose trial request is due is picked first, so it is
+        brought back as soon as it answers.
+
+        Args:
+            exclude (iterable, optional): Upstreams already tried for this request.
+
+        Returns:
+            Upstream: The chosen upstream, or None if none is available.
+        """
+        for upstream in self.upstreams:
+            if not upstream.healthy and upstream not in exclude and upstream.claim_retry():
+                return upstream
+        candidates = [
+            upstream
+            for upstream in self.upstreams
+            if upstream.healthy and upstream not in exclude
+        ]
+        if not candidates:
+            return None
+        start = next(self.counter) % len(candidates)
+        if self.balance == "least_connections":
+            # Rotating the start spreads ties evenly instead of favouring the first.
+            rotated = candidates[start:] + candidates[:start]
+            return min(rotated, key=lambda upstream: upstream.active)
+        return candidates[start]
+
+
+class ProxyResponse:
+    """An upstream response head, and its body as a generator of chunks."""
+
+    __slots__ = ("status_code", "header_block", "content_length", "chunks")
+
+    def __init__(self, status_code, header_block, content_length, chunks):
+        self.status_code = status_code
+        self.header_block = header_block  # Forwarded header lines, encoded
+        self.content_length = content_length  # str, or None if unknown
+        self.chunks = chunks  # None if the response has no body
+
+
+class ReverseProxy:
+
+    def __init__(
+        self,
+        routes,
+        pool_size=8,
+        connect_timeout=2.0,
+        timeout=30.0,
+        health_interval=5.0,
+        max_body_size=100 * 1024 * 1024,
+    ):
+        """Initialize the reverse proxy from the "proxy_routes" configuration.
+
+        Upstreams named by several routes share one connection pool. Failed
+        connections mark an upstream down at once; a background thread
+        probes every upstream each health_interval seconds and brings it
+        back once it answers. Whether or not health checks run, a down
+        upstream is also sent one trial request every DOWN_RETRY_DELAY
+        seconds, and is back up as soon as one connects.
+
+        Args:
+            routes (list): Route dicts, see validate_proxy_routes().
+            pool_size (int, optional): Idle connections kept per upstream. Defaults to 8.
+            connect_timeout (float, optional): Seconds to connect to an upstream. Defaults to 2.0.
+            timeout (float, optional): Seconds an upstream send or receive may stall. Defaults to 30.0.
+            health_interval (float, optional): Seconds between health checks; 0 disables them.
+                Defaults to 5.0.
+            max_body_size (int, optional): Largest request body forwarded. Defaults to 100 MB.
+        """
+        self.max_body_size = max_body_size
+        self.upstreams = {}  # address -> Upstream
+        self.routes = []
+        for route in routes:
+            upstreams = []
+            for address in route["upstreams"]:
+                upstream = self.upstreams.get(address)
+                if upstream is None:
+                    upstream = self.upstreams[address] = Upstream(
+                        address, pool_size, connect_timeout, timeout
+                    )
+                if upstream.health_path is None:
+                    upstream.health_path = route.get("health_path")
+                upstreams.append(upstream)
+            self.routes.append(
+                ProxyRoute(
+                    route["prefix"],
+                    upstreams,
+                    route.get("balance", "round_robin"),
+                    route.get("strip_prefix", False),
+                )
+            )
+        # The longest matching prefix wins.
+        self.routes.sort(key=lambda route: len(route.prefix), reverse=True)
+        self.health_interval = health_interval
+        if health_interval > 0:
+            threading.Thread(
+                target=self.health_loop, name="proxy-health", daemon=True
+            ).start()
+
+    def match(self, path):
+        """Return the route for a request path, or None if it is not proxied."""
+        for route in self.routes:
+            if route.matches(path):
+                return route
+        return None
+
+    def forward(self, route, method, target, headers, body, client_ip):
+        """Send a request upstream and return the response head, with its body still to be read.
+
+        A request without a body that fails on a pooled connection (closed
+        by the upstream while idle) is retried on a new one; an upstream
+        that cannot be connected to is marked down and the next one tried.
+
+        Args:
+            route (ProxyRoute): The matched route.
+            method (str): The request method.
+            target (str): The request target to send upstream.
+            headers (dict): The client's request headers.
+            body (RequestBody): The client's request body, or None.
+            client_ip (str): The client's address, for X-Forwarded-For.
+
+        Returns:
+            ProxyResponse: The response. Its chunks must be run to the end or
+            closed, which returns the upstream connection.
+
+        Raises:
+            UpstreamError: If no upstream gave a response (502, 503 or 504).
+            RequestParseError: If the client's request body is malformed or too slow.
+        """
+        head = self.build_request_head(method, target, headers, body, client_ip)
+        tried = []
+        while True:
+            upstream = route.choose(tried)
+            if upstream is None:
+                raise UpstreamError(503, f"No healthy upstream for '{route.prefix}'")
+            tried.append(upstream)
+            try:
+                conn = upstream.acquire()
+            except OSError:
+                upstream.set_healthy(False)
+                continue
+            started = time.perf_counter()
+            try:
+                conn.sock.sendall(head)
+                if body is not None:
+                    self.send_body(conn, body)
+                version, status_code, response_headers = self.read_response_head(conn)
+            except RequestParseError:
+                upstream.release(conn, False)
+                raise
+            except socket.timeout:
+                upstream.release(conn, False, failed=True)
+                raise UpstreamError(504, f"Upstream {upstream.address} timed out")
+            except (OSError, UpstreamError) as e:
+                if conn.reused and body is None:
+                    # Closed while idle in the pool: retry on a fresh connection.
+                    upstream.release(conn, False)
+                    tried.pop()
+                    continue
+                upstream.release(conn, False, failed=True)
+                if isinstance(e, UpstreamError):
+                    raise
+                raise UpstreamError(502, f"Upstream {upstream.address} failed: {e}")
+            upstream.observe_latency(time.perf_counter() - started)
+            return self.build_response(
+                upstream, conn, method, version, status_code, response_headers
+            )
+
+    @staticmethod
+    def build_request_head(method, target, headers, body, client_ip):
+        """Encode the request head sent upstream.
+
+        Hop-by-hop headers (and any the client's Connection header names)
+        are dropped, X-Forwarded-For is extended with the client's address,
+        and the connection is asked to be kept alive.
+
+        Returns:
+            bytes: The request head.
+        """
+        named = {
+            token.strip().title() for token in headers.get("Connection", "").split(",")
+        }
+        lines = []
+        for name, value in headers.items():
+            if name in HOP_BY_HOP_HEADERS or name in named or name == "X-Forwarded-For":
+                continue
+            lines.append(f"{name}: {value}\r\n")
+        forwarded_for = headers.get("X-Forwarded-For")
+        lines.append(
+            f"X-Forwarded-For: {forwarded_for + ', ' if forwarded_for else ''}{client_ip}\r\n"
+            "X-Forwarded-Proto: http\r\n"
+        )
+        if body is not None and body.length is None:
+            lines.append("Transfer-Encoding: chunked\r\n")
+        lines.append("Connection: keep-alive\r\n\r\n")
+        return f"{method} {target} HTTP/1.1\r\n".encode("utf-8") + "".join(lines).encode(
+            "latin-1", errors="replace"
+        )
+
+    @staticmethod
+    def send_body(conn, body):
+        """Stream the client's request body upstream, re-framing a chunked body."""
+        chunked = body.length is None
+        for piece in body:
+            if chunked:
+                conn.sock.sendall(b"%x\r\n%s\r\n" % (len(piece), piece))
+            else:
+                conn.sock.sendall(piece)
+        if chunked:
+            conn.sock.sendall(b"0\r\n\r\n")
+
+    @staticmethod
+    def read_response_head(conn):
+        """Read the next final (non-1xx) response head from an upstream.
+
+        Returns:
+            tuple: (HTTP version, status code, list of (name, value) headers).
+
+        Raises:
+            UpstreamError: If the head is malformed or too large.
+            ConnectionError: If the upstream closed the connection first.
+            socket.timeout: If the upstream stalls.
+        """
+        while True:
+            end = conn.buffer.find(b"\r\n\r\n")
+            if end == -1:
+                if len(conn.buffer) > MAX_RESPONSE_HEAD:
+                    raise UpstreamError(502, "Upstream response head too large")
+                data = conn.receive()
+                if not data:
+                    raise ConnectionError("Upstream closed the connection")
+                conn.feed(data)
+                continue
+            lines = conn.buffer[:end].decode("latin-1").split("\r\n")
+            del conn.buffer[: end + 4]
+            parts = lines[0].split(" ", 2)
+            if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+                raise UpstreamError(502, "Malformed upstream status line")
+            status_code = int(parts[1])
+            if status_code < 200:
+                continue  # An interim response, e.g. 100 Continue
+            headers = []
+            for line in lines[1:]:
+                name, separator, value = line.partition(":")
+                if not separator:
+                    raise UpstreamError(502, "Malformed upstream header line")
+                headers.append((name.strip(), value.strip()))
+            return parts[0], status_code, headers
+
+    def build_response(self, upstream, conn, method, version, status_code, headers):
+        """Work out how the upstream frames its response body, and filter its headers.
+
+        Returns:
+            ProxyResponse: The response, whose chunks release the connection when done.
+        """
+        lowered = {}
+        for name, value in headers:
+            lowered.setdefault(name.lower(), []).append(value)
+        connection_tokens = {
+            token.strip().lower()
+            for value in lowered.get("connection", ())
+            for token in value.split(",")
+        }
+        keep_alive = version == "HTTP/1.1" and "close" not in connection_tokens
+        hop_by_hop = {name.lower() for name in HOP_BY_HOP_HEADERS} | connection_tokens
+        header_block = "".join(
+            f"{name}: {value}\r\n"
+            for name, value in headers
+            if name.lower() not in hop_by_hop
+            and name.lower() not in REPLACED_RESPONSE_HEADERS
+        ).encode("latin-1", errors="replace")
+
+        content_length = lowered.get("content-length", [None])[-1]
+        transfer_encoding = ",".join(lowered.get("transfer-encoding", ())).lower()
+        if method == "HEAD" or status_code in (204, 304):
+            upstream.release(conn, keep_alive)
+            return ProxyResponse(status_code, header_block, content_length, None)
+        if "chunked" in transfer_encoding:
+            framing = {"Transfer-Encoding": "chunked"}
+            content_length = None
+        elif content_length is not None:
+            if not content_length.isdigit():
+                upstream.release(conn, False, failed=True)
+                raise UpstreamError(502, "Invalid upstream Content-Length")
+            framing = {"Content-Length": content_length}
+        else:
+            framing = None  # Delimited by the upstream closing the connection
+            keep_alive = False
+        return ProxyResponse(
+            status_code,
+            header_block,
+            content_length,
+            self.stream_body(upstream, conn, framing, keep_alive),
+        )
+
+    @staticmethod
+    def stream_body(upstream, conn, framing, keep_alive):
+        """Yield an upstream response body as it arrives, then return the connection.
+
+        The connection goes back to the pool only if the body was read to its
+        end; a client that goes away part way closes it.
+        """
+        complete = failed = False
+        try:
+            if framing is not None:
+                yield from RequestBody(conn, conn.receive, framing, float("inf"))
+            else:
+                if conn.buffer:
+                    yield bytes(conn.buffer)
+                    conn.buffer.clear()
+                while True:
+                    data = conn.receive()
+                    if not data:
+                        break
+                    yield data
+            complete = True
+        except socket.timeout:
+            failed = True
+            raise UpstreamError(504, f"Upstream {upstream.address} timed out mid-response")
+        except (OSError, RequestParseError) as e:
+            failed = True
+            raise UpstreamError(502, f"Upstream {upstream.address} response broken: {e}")
+        finally:
+            upstream.release(conn, complete and keep_alive, failed)
+
+    def health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            for upstream in list(self.upstreams.values()):
+                upstream.set_healthy(upstream.check_health())
+
+    def stats(self):
+        """Return a snapshot of the proxy statistics.
+
+        Returns:
+            dict: Each upstream's health, pool use, request counters and latency.
+        """
+        stats = {}
+        for upstream in self.upstreams.values():
+            stats.update(upstream.stats())
+        return stats
@@ -0,0 +1,269 @@
+import functools
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from metrics import ShardedCounter
+
+# The client table is split into this many independently locked shards.
+TABLE_SHARDS = 16
+
+# Seconds of slack for float rounding when a request lands exactly on its bucket's edge.
+ROUNDING_SLACK = 1e-9
+
+# Fields of a rate limit rule; 0 turns that limit off.
+RULE_FIELDS = ("requests", "burst", "bandwidth", "bandwidth_burst")
+
+
+def validate_rate_limit_rules(rules):
+    """Check the "rate_limit_rules" configuration field.
+
+    Args:
+        rules (list): Rule dicts with a "cidr" and any of RULE_FIELDS and "shared".
+
+    Raises:
+        ValueError: If a rule is malformed.
+    """
+    if not isinstance(rules, list):
+        raise ValueError("The 'rate_limit_rules' field must be a list of rules.")
+    for rule in rules:
+        if not isinstance(rule, dict):
+            raise ValueError("Each rate limit rule must be an object.")
+        try:
+            ipaddress.ip_network(rule.get("cidr"), strict=False)
+        except (TypeError, ValueError):
+            raise ValueError(f"Rate limit rule {rule} needs a valid 'cidr'.")
+        for field in RULE_FIELDS:
+            value = rule.get(field, 0)
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(
+                    f"The '{field}' of rate limit rule '{rule['cidr']}' must be a non-negative number."
+                )
+        if not isinstance(rule.get("shared", False), bool):
+            raise ValueError(
+                f"The 'shared' of rate limit rule '{rule['cidr']}' must be true or false."
+            )
+
+
+def retry_after(wait):
+    """Return the Retry-After header value for a wait, in whole seconds."""
+    return max(1, math.ceil(wait))
+
+
+class RateLimit:
+    """Request-rate and bandwidth limits, as the GCRA intervals they translate to.
+
+    The generic cell rate algorithm is a token bucket kept as a single
+    timestamp per limit: the "theoretical arrival time" at which the bucket
+    would be full again. A request is allowed while that time is no more
+    than a burst's worth of intervals ahead of now.
+    """
+
+    __slots__ = ("request_interval", "request_tolerance", "byte_interval", "byte_tolerance")
+
+    def __init__(self, requests=0, burst=0, bandwidth=0, bandwidth_burst=0):
+        """Initialize the limits.
+
+        Args:
+            requests (float, optional): Requests per second; 0 for no limit. Defaults to 0.
+            burst (float, optional): Requests allowed back to back; defaults to
+                one second's worth of requests.
+            bandwidth (float, optional): Response bytes per second; 0 for no limit. Defaults to 0.
+            bandwidth_burst (float, optional): Response bytes allowed back to back;
+                defaults to one second's worth of bandwidth.
+        """
+        self.request_interval = 1.0 / requests if requests else 0.0
+        self.request_tolerance = self.request_interval * max(burst or requests, 1)
+        self.byte_interval = 1.0 / bandwidth if bandwidth else 0.0
+        self.byte_tolerance = self.byte_interval * (bandwidth_burst or bandwidth)
+
+    @property
+    def unlimited(self):
+        return not self.request_interval and not self.byte_interval
+
+
+class RateLimiter:
+
+    def __init__(
+        self,
+        requests=0,
+        burst=0,
+        bandwidth=0,
+        bandwidth_burst=0,
+        rules=(),
+        table_size=100000,
+        clock=time.monotonic,
+    ):
+        """Initialize per-client request-rate and bandwidth limits.
+
+        Each client IP, or each CIDR block of a "shared" rule, has one entry
+        of two timestamps in a bounded table. An entry is idle once both of
+        its buckets have refilled, and is then indistinguishable from a new
+        client; idle entries are dropped as new clients arrive, and when the
+        table is full the least recently seen entry goes, so memory stays
+        bounded whatever the number of distinct clients. The table is split
+        into shards with their own locks, so threads rarely wait on each other.
+
+        Args:
+            requests (float, optional): Default requests per second per client;
+                0 for no limit. Defaults to 0.
+            burst (float, optional): Default requests allowed back to back. Defaults to
+                one second's worth.
+            bandwidth (float, optional): Default response bytes per second per client;
+                0 for no limit. Defaults to 0.
+            bandwidth_burst (float, optional): Default response bytes allowed back to
+                back. Defaults to one second's worth.
+            rules (iterable, optional): Per-CIDR rules, see validate_rate_limit_rules().
+                Their missing fields take the defaults; the most specific matching
+                rule applies.
+            table_size (int, optional): Most clients tracked at once. Defaults to 100000.
+            clock (callable, optional): Returns the current time in seconds.
+                Defaults to time.monotonic.
+        """
+        defaults = {
+            "requests": requests,
+            "burst": burst,
+            "bandwidth": bandwidth,
+            "bandwidth_burst": bandwidth_burst,
+        }
+        self.default_limit = RateLimit(**defaults)
+        self.rules = []  # (network, RateLimit, shared), most specific first
+        for rule in rules:
+            network = ipaddress.ip_network(rule["cidr"], strict=False)
+            limit = RateLimit(**{field: rule.get(field, defaults[field]) for field in RULE_FIELDS})
+            self.rules.append((network, limit, rule.get("shared", False)))
+        self.rules.sort(key=lambda rule: rule[0].prefixlen, reverse=True)
+        self.table_size = table_size
+        self.clock = clock
+        self.shard_size = max(1, table_size // TABLE_SHARDS)
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(TABLE_SHARDS)]
+        self.classify = functools.lru_cache(maxsize=65536)(self.classify_address)
+        self.throttled_requests = ShardedCounter()
+        self.throttled_bandwidth = ShardedCounter()
+        self.evicted_idle = 0
+        self.evicted_full = 0
+
+    def classify_address(self, client_ip):
+        """Find the limits that apply to a client and the table key they are counted under.
+
+        Returns:
+            tuple: (key, RateLimit), or (None, None) if the client is not limited.
+        """
+        try:
+            address = ipaddress.ip_address(client_ip)
+        except ValueError:
+            address = None
+        limit, key = self.default_limit, client_ip if address is None else address.packed
+        for network, rule_limit, shared in self.rules:
+            if address is not None and address.version == network.version and address in network:
+                limit = rule_limit
+                if shared:
+                    key = network.network_address.packed + bytes((network.prefixlen,))
+                break
+        if limit.unlimited:
+            return None, None
+        return key, limit
+
+    def check(self, client_ip):
+        """Count a request from a client against its limits.
+
+        Args:
+            client_ip (str): The client's IP address.
+
+        Returns:
+            float: 0.0 if the request may be served, otherwise the seconds
+            until it would be allowed.
+        """
+        key, limit = self.classify(client_ip)
+        if key is None:
+            return 0.0
+        now = self.clock()
+        lock, table = self.shards[hash(key) % TABLE_SHARDS]
+        with lock:
+            entry = table.get(key)
+            if entry is None:
+                entry = [now, now]  # Full buckets
+                self.add_entry(table, key, entry, now)
+            else:
+                table.move_to_end(key)
+            if limit.byte_interval:
+                wait = entry[1] - limit.byte_tolerance - now
+                if wait > ROUNDING_SLACK:
+                    self.throttled_bandwidth.increment()
+                    return wait
+            if limit.request_interval:
+                arrival = max(entry[0], now) + limit.request_interval
+                wait = arrival - limit.request_tolerance - now
+                if wait > ROUNDING_SLACK:
+                    self.throttled_requests.increment()
+                    return wait
+                entry[0] = arrival
+        return 0.0
+
+    def charge(self, client_ip, sent):
+        """Count the bytes of a response against the client's bandwidth.
+
+        Bandwidth is charged after the response is sent, so a client that
+        overdraws its bucket is throttled on its next request until it refills.
+
+        Args:
+            client_ip (str): The client's IP address.
+            sent (int): Bytes of the response.
+        """
+        if not sent:
+            return
+        key, limit = self.classify(client_ip)
+        if key is None or not limit.byte_interval:
+            return
+        now = self.clock()
+        lock, table = self.shards[hash(key) % TABLE_SHARDS]
+        with lock:
+            entry = table.get(key)
+            if entry is not None:
+                entry[1] = max(entry[1], now) + sent * limit.byte_interval
+
+    def add_entry(self, table, key, entry, now):
+        """Insert a client's entry, first dropping idle and, if need be, the oldest entries.
+
+        The oldest entry is checked on every insert, so idle entries go at
+        the rate new ones arrive and an insert does constant work on average.
+        Called with the shard's lock held.
+        """
+        while table:
+            oldest_key = next(iter(table))
+            oldest = table[oldest_key]
+            if oldest[0] <= now and oldest[1] <= now:
+                self.evicted_idle += 1
+            elif len(table) >= self.shard_size:
+                self.evicted_full += 1
+            else:
+                break
+            del table[oldest_key]
+        table[key] = entry
+
+    def stats(self):
+        """Return a snapshot of the rate limiting statistics.
+
+        Returns:
+            dict: Default limits, table occupancy, throttled requests and evictions.
+        """
+        limit = self.default_limit
+        tracked = 0
+        for lock, table in self.shards:
+            with lock:
+                tracked += len(table)
+        return {
+            "Max Requests per Second per Client": (
+                round(1 / limit.request_interval, 3) if limit.request_interval else "unlimited"
+            ),
+            "Max Bandwidth per Client (bytes/s)": (
+                round(1 / limit.byte_interval) if limit.byte_interval else "unlimited"
+            ),
+            "Tracked Clients": tracked,
+            "Table Capacity": self.shard_size * TABLE_SHARDS,
+            "Throttled (Request Rate)": self.throttled_requests.value,
+            "Throttled (Bandwidth)": self.throttled_bandwidth.value,
+            "Idle Entries Evicted": self.evicted_idle,
+            "Entries Evicted (Table Full)": self.evicted_full,
+        }
@@ -1,11 +1,112 @@
-import mimetypes
-from utils import http_date_format, safe_path
-from datetime import datetime
+import base64
+import secrets
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from bundle import BundleManager
+from compression import (
+    DEFAULT_COMPRESSIBLE_TYPES,
+    CompressionCache,
+    is_compressible,
+    negotiate_encoding,
+    variant_etag,
+)
+from connection_guard import ConnectionGuard
+from directory_listing import DirectoryListingCache
+from file_cache import FileCache, file_validators, guess_mime_type
+from load_shedder import LoadShedder
+from http_parser import RequestParseError, RequestParser
+from metrics import REQUEST_PHASES
+from path_index import DIRECTORY, FILE, PathIndex
+from proxy import ReverseProxy, UpstreamError
+from rate_limit import RateLimiter, retry_after
+from response import (
+    CONNECTION_CLOSE,
+    CONTINUE_RESPONSE,
+    CONNECTION_KEEP_ALIVE,
+    SERVER_HEADER,
+    canned_response,
+    date_header,
+    error_body,
+    keep_alive_header,
+    status_line,
+)
+from upload import UPLOAD_METHODS, AtomicUpload, RequestBody, UploadStats
+from urllib.parse import parse_qs
+from utils import decode_path, encode_path, parse_range_header
 import os
 
 
+class ConnectionStats:
+    """Thread-safe counters describing how much connections are reused."""
+
+    # Upper bounds of the requests-per-connection histogram buckets.
+    BUCKETS = (1, 2, 5, 10, 50, 100)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.max_requests = 0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, requests):
+        """Record a closed connection that served the given number of requests.
+
+        Args:
+            requests (int): Requests served on the connection.
+        """
+        index = len(self.BUCKETS)
+        for i, bound in enumerate(self.BUCKETS):
+            if requests <= bound:
+                index = i
+                break
+        with self.lock:
+            self.connections += 1
+            self.requests += requests
+            self.histogram[index] += 1
+            if requests > self.max_requests:
+                self.max_requests = requests
+
+    def stats(self):
+        """Return a snapshot of the connection reuse statistics.
+
+        Returns:
+            dict: Connection counts and the requests-per-connection histogram.
+        """
+        with self.lock:
+            average = self.requests / self.connections if self.connections else 0.0
+            stats = {
+                "Closed Connections": self.connections,
+                "Requests on Closed Connections": self.requests,
+                "Average Requests per Connection": round(average, 2),
+                "Max Requests on a Connection": self.max_requests,
+            }
+            lower = 1
+            for bound, count in zip(self.BUCKETS, self.histogram):
+                label = f"{lower}" if lower == bound else f"{lower}-{bound}"
+                stats[f"Connections with {label} Requests"] = count
+                lower = bound + 1
+            stats[f"Connections with {lower}+ Requests"] = self.histogram[-1]
+            return stats
+
+
 class HTTPRequestHandler:
 
+    # State shared by every handler; see setup_shared_state().
+    connection_stats = ConnectionStats()
+    file_cache = None
+    compression_cache = None
+    path_index = None
+    listing_cache = None
+    connection_guard = ConnectionGuard()
+    bundle = None
+    upload_stats = None
+    proxy = None
+    rate_limiter = None
+    load_shedder = None
+
     def __init__(self, client_conn, client_addr, config, logger):
         """Initialize the request handler.
 
@@ -20,266 +121,1518 @@ class HTTPRequestHandler:
         self.config = config
         self.logger = logger
         self.document_root = config["document_root"]
+        self.keep_alive_timeout = config.get("keep_alive_timeout", 5)
+        self.header_timeout = config.get("header_timeout", 10)
+        self.write_timeout = config.get("write_timeout", 30)
+        self.max_keep_alive_requests = config.get("max_keep_alive_requests", 100)
+        self.sendfile_threshold = config.get("sendfile_threshold", 65536)
+        self.file_chunk_size = config.get("file_chunk_size", 65536)
+        self.weak_etags = config.get("weak_etags", False)
+        self.cache_max_age = config.get("cache_max_age", {})
+        self.max_ranges = config.get("max_ranges", 16)
+        self.compress_min_size = config.get("compress_min_size", 1024)
+        self.compress_max_size = config.get("compress_max_size", 10 * 1024 * 1024)
+        self.compress_mime_types = config.get(
+            "compress_mime_types", DEFAULT_COMPRESSIBLE_TYPES
+        )
+        self.slow_request_threshold = config.get("slow_request_threshold", 0)
+        self.profiler = logger.profiler
+        self.max_upload_size = config.get("max_upload_size", 100 * 1024 * 1024)
+        self.upload_credentials = config.get("upload_credentials")
+        self.body_timeout = config.get("body_timeout", 30)
+        self.parser = None
+        self.receive_buffer = bytearray(4096)  # Request heads are received into this
+        self.body_buffer = None
+        self.keep_alive = False
+        self.request_version = "HTTP/1.1"
+        self.query = ""
+        self.connection_info = None
+        self.status_code = None
+        self.bytes_sent = 0
+        # Seconds spent in each REQUEST_PHASES phase of the current request,
+        # and when its first bytes arrived.
+        self.phases = None
+        self.request_started = None
+
+    @staticmethod
+    def create_parser(config):
+        """Create a request parser with the configured header limits.
+
+        Args:
+            config (dict): Configuration parameters.
+
+        Returns:
+            RequestParser: A parser for one connection.
+        """
+        return RequestParser(
+            max_header_size=config.get("max_header_size", 8192),
+            max_header_count=config.get("max_header_count", 100),
+        )
+
+    @classmethod
+    def setup_shared_state(cls, config, logger):
+        """Prepare the state shared by all handlers and register its stats.
+
+        Called once by the server engine before it starts accepting connections.
+
+        Args:
+            config (dict): Configuration parameters.
+            logger (Logger): The logger instance.
+        """
+        logger.register_stats_provider("Connection Reuse", cls.connection_stats.stats)
+        cls.connection_guard = ConnectionGuard(
+            config.get("max_connections_per_ip", 0),
+            config.get("min_transfer_rate", 0),
+            config.get("retry_after", 1),
+        )
+        logger.register_stats_provider("Connection Limits", cls.connection_guard.stats)
+        cls.path_index = PathIndex(
+            config["document_root"],
+            config.get("path_cache_size", 10000),
+            config.get("path_cache_negative_ttl", 2.0),
+            config.get("path_cache_poll_interval", 1.0),
+        )
+        logger.register_stats_provider("Path Index", cls.path_index.stats)
+        cls.listing_cache = DirectoryListingCache(
+            config.get("listing_cache_size", 64),
+            config.get("listing_page_size", 1000),
+        )
+        logger.register_stats_provider("Directory Listings", cls.listing_cache.stats)
+        cache_size = config.get("file_cache_size", 64 * 1024 * 1024)
+        if cache_size > 0:
+            cls.file_cache = FileCache(
+                cache_size,
+                config.get("file_cache_max_file_size", 1024 * 1024),
+                config.get("weak_etags", False),
+            )
+            logger.register_stats_provider("File Cache", cls.file_cache.stats)
+        if config.get("compression", True):
+            cls.compression_cache = CompressionCache(
+                config.get("compression_cache_size", 32 * 1024 * 1024),
+                config.get("compress_max_size", 10 * 1024 * 1024),
+                config.get("compress_level", 6),
+            )
+            logger.register_stats_provider("Compression", cls.compression_cache.stats)
+        if config.get("bundle_path"):
+            cls.bundle = BundleManager(
+                config["bundle_path"],
+                config.get("bundle_poll_interval", 1.0),
+                config.get("weak_etags", False),
+            )
+            if cls.bundle.current is None:
+                logger.log_error(
+                    f"Asset bundle '{config['bundle_path']}' not loaded "
+                    f"({cls.bundle.last_error}); serving from the document root"
+                )
+            logger.register_stats_provider("Asset Bundle", cls.bundle.stats)
+        if config.get("uploads", False):
+            cls.upload_stats = UploadStats(config.get("max_upload_size", 100 * 1024 * 1024))
+            logger.register_stats_provider("Uploads", cls.upload_stats.stats)
+        if config.get("proxy_routes"):
+            cls.proxy = ReverseProxy(
+                config["proxy_routes"],
+                pool_size=config.get("proxy_pool_size", 8),
+                connect_timeout=config.get("proxy_connect_timeout", 2.0),
+                timeout=config.get("proxy_timeout", 30.0),
+                health_interval=config.get("proxy_health_interval", 5.0),
+                max_body_size=config.get("proxy_max_body_size", 100 * 1024 * 1024),
+            )
+            logger.register_stats_provider("Reverse Proxy", cls.proxy.stats)
+        if (
+            config.get("rate_limit_requests")
+            or config.get("rate_limit_bandwidth")
+            or config.get("rate_limit_rules")
+        ):
+            cls.rate_limiter = RateLimiter(
+                requests=config.get("rate_limit_requests", 0),
+                burst=config.get("rate_limit_burst", 0),
+                bandwidth=config.get("rate_limit_bandwidth", 0),
+                bandwidth_burst=config.get("rate_limit_bandwidth_burst", 0),
+                rules=config.get("rate_limit_rules", []),
+                table_size=config.get("rate_limit_table_size", 100000),
+            )
+            logger.register_stats_provider("Rate Limiting", cls.rate_limiter.stats)
+        if config.get("load_shedding", False):
+            cls.load_shedder = LoadShedder(
+                config.get("shed_target_delay", 0.1), config.get("shed_interval", 1.0)
+            )
+            logger.register_stats_provider("Load Shedding", cls.load_shedder.stats)
 
     def handle(self):
-        """Main handler for the HTTP request."""
+        """Main handler for the connection: serve requests until the connection should close.
+
+        The connection was admitted by the connection guard, and is released
+        from it here once closed.
+        """
+        requests_served = 0
+        self.parser = self.create_parser(self.config)
+        connection_id, self.connection_info = self.logger.metrics.connection_opened(
+            self.client_addr
+        )
         try:
-            request_data = self.client_conn.recv(1024).decode("utf-8")
-            if not request_data:
-                self.client_conn.close()
-                return
+            # Every response is written in one call (or corked), so Nagle's
+            # algorithm only delays the last segment.
+            self.client_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                # The last request allowed on this connection is answered with "close".
+                self.keep_alive = requests_served + 1 < self.max_keep_alive_requests
+                try:
+                    request = self.read_request()
+                except RequestParseError as e:
+                    requests_served += 1
+                    self.client_conn.settimeout(self.write_timeout)
+                    self.reject_request(e)
+                    break
+                if request is None:
+                    break
+                requests_served += 1
+                # A client that stops reading is dropped after write_timeout.
+                self.client_conn.settimeout(self.write_timeout)
+                if not self.process_request(request):
+                    break
+        except Exception as e:
+            self.logger.log_error(
+                f"Error reading request from {self.client_addr[0]}: {e}"
+            )
+        finally:
+            self.connection_stats.record(requests_served)
+            self.logger.metrics.connection_closed(connection_id)
+            self.connection_guard.release(self.client_addr[0])
+            self.client_conn.close()
+
+    def read_request(self):
+        """Read from the connection until the parser yields the next request head.
 
-            # Parse the HTTP request line to be in the form "METHOD path HTTP/1.1"
-            request_line, headers = self.parse_request(request_data)
+        Bytes received past the end of the head stay in the parser, so
+        pipelined requests are answered one after another in order.
+
+        The wait for the first bytes of a request is bounded by the
+        keep-alive timeout and not counted in its "recv" phase; once they
+        arrive, the whole head must follow within header_timeout seconds,
+        however slowly it trickles in.
+
+        Returns:
+            HTTPRequest: The next request, or None if the client closed the
+            connection or stayed idle past the keep-alive timeout.
+
+        Raises:
+            RequestParseError: If the request head is malformed, too large or too slow.
+        """
+        phases = self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.request_started = time.perf_counter() if self.parser.buffer else None
+        while True:
+            started = time.perf_counter()
+            request = self.parser.next_request()
+            phases["parse"] += time.perf_counter() - started
+            if request is not None:
+                return request
+            if self.request_started is None:
+                timeout = self.keep_alive_timeout
+            else:
+                timeout = self.request_started + self.header_timeout - started
+                if timeout <= 0:
+                    self.connection_guard.record("header_timeout")
+                    raise RequestParseError(408, "Request head not received in time")
+            self.client_conn.settimeout(timeout)
+            try:
+                received = self.client_conn.recv_into(self.receive_buffer)
+            except socket.timeout:
+                if self.request_started is None:
+                    self.connection_guard.record("idle_timeout")
+                    return None
+                self.connection_guard.record("header_timeout")
+                raise RequestParseError(408, "Request head not received in time")
+            if self.request_started is None:
+                self.request_started = time.perf_counter()
+            else:
+                phases["recv"] += time.perf_counter() - started
+            if not received:
+                return None
+            self.parser.feed(memoryview(self.receive_buffer)[:received])
 
-            # Expecting the request line to be in the form "METHOD path HTTP/1.1"
-            parts = request_line.split()
-            if len(parts) != 3:
-                raise ValueError("Invalid HTTP request line")
-            method, path, version = parts
+    def reject_request(self, error):
+        """Answer a request whose head could not be parsed, then close the connection.
+
+        Args:
+            error (RequestParseError): The parse failure.
+        """
+        self.keep_alive = False
+        self.bytes_sent = 0
+        self.logger.log_error(
+            f"Bad request from {self.client_addr[0]}: {error} ({error.status_code})"
+        )
+        self.send_canned(error.status_code)
+        self.logger.metrics.observe_request(
+            "OTHER", error.status_code, 0.0, self.bytes_sent
+        )
+
+    def process_request(self, request):
+        """Send the response for a parsed request over the client connection.
+
+        This is the engine-independent part of request handling: both the
+        threaded and the asyncio engine parse request heads with a
+        RequestParser and hand the result to this method.
+
+        While the profiler has a cProfile window open, the request is
+        handled under the calling thread's profile.
+
+        Args:
+            request (HTTPRequest): The parsed request head.
+
+        Returns:
+            bool: True if the connection may be kept open for another request.
+        """
+        if self.profiler.tracing:
+            return self.profiler.call(self.serve_request, request)
+        return self.serve_request(request)
+
+    def serve_request(self, request):
+        """Handle one request and record its latency, phase timings and metrics.
+
+        Args:
+            request (HTTPRequest): The parsed request head.
+
+        Returns:
+            bool: True if the connection may be kept open for another request.
+        """
+        request_line = request.request_line
+        started = time.perf_counter()
+        if self.phases is None:
+            self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        phases = self.phases
+        self.status_code = None
+        self.bytes_sent = 0
+        self.body_incomplete = False
+        if self.connection_info is not None:
+            self.connection_info.requests += 1
+            self.connection_info.last_request = request_line
+        try:
+            method, path, version = request.method, request.path, request.version
+            headers = request.headers
+            raw_path, _, self.query = path.partition("?")
+            try:
+                path = decode_path(raw_path)
+            except ValueError as e:
+                raise RequestParseError(400, str(e))
+            self.request_version = version
+            self.keep_alive = self.keep_alive and self.wants_keep_alive(
+                version, headers
+            )
+
+            # Rate limits are checked before any path resolution or file I/O.
+            wait = 0.0
+            if self.rate_limiter is not None:
+                wait = self.rate_limiter.check(self.client_addr[0])
 
             # Sanitize and resolve t he requested path (prevent diretory traversal)
 
-            full_path = safe_path(self.document_root, path)
+            resolve_started = time.perf_counter()
+            route = entry = resolution = None
+            if not wait:
+                if self.proxy is not None:
+                    route = self.proxy.match(path)
+                if route is None and self.bundle is not None and method in ("GET", "HEAD"):
+                    entry = self.bundle.lookup(path)
+                if route is None and entry is None:
+                    try:
+                        resolution = self.path_index.resolve(path)
+                    except ValueError as e:
+                        raise RequestParseError(403, str(e))  # Outside the document root
+            phases["resolve"] += time.perf_counter() - resolve_started
 
-            if method == "GET":
-                self.handle_get(full_path, version, headers, request_line)
+            if wait:
+                self.send_rate_limited(wait, method, headers, request_line)
+            elif (
+                self.load_shedder is not None
+                and resolution is not None
+                and self.load_shedder.is_overloaded()
+                and self.is_expensive(method, resolution)
+            ):
+                self.load_shedder.shed_request()
+                self.send_overloaded(request_line)
+            elif route is not None:
+                self.handle_proxy(
+                    route, method, path, raw_path, version, headers, request_line
+                )
+            elif entry is not None:
+                # Packed in the asset bundle: served from memory, nothing is opened.
+                self.serve_file(
+                    path,
+                    version,
+                    request_line,
+                    headers,
+                    head_only=method == "HEAD",
+                    entry=entry,
+                )
+            elif method == "GET":
+                self.handle_get(resolution, version, headers, request_line)
             elif method == "HEAD":
-                self.handle_head(full_path, version, headers, request_line)
+                self.handle_head(resolution, version, headers, request_line)
+            elif method in UPLOAD_METHODS and self.upload_stats is not None:
+                self.handle_upload(resolution, path, version, headers, request_line)
             else:
-                # Method Not Allowed
-                self.send_response(
-                    405,
-                    {"Content-Type": "text/html"},
-                    "<html><body><h1>405 Method Not Allowed</h1></body></html>",
-                )
-                self.logger.log_request(self.client_addr[0], request_line, 405)
+                # Method Not Allowed. Any request body is left unread, so close.
+                self.keep_alive = False
+                self.send_canned(405)
+                self.log_request(request_line, 405)
+        except RequestParseError as e:
+            # A request target that cannot be decoded (400) or resolves
+            # outside the document root (403); nothing was sent yet.
+            self.logger.log_error(
+                f"Bad request from {self.client_addr[0]}: {e} ({e.status_code})"
+            )
+            self.keep_alive = False
+            self.send_canned(e.status_code)
+            self.log_request(request_line, e.status_code)
         except Exception as e:
             self.logger.log_error(
                 f"Error handling request from {self.client_addr[0]}: {e}"
             )
+            self.keep_alive = False
             try:
-                self.send_response(
-                    500,
-                    {"Content-Type": "text/html"},
-                    "<html><body><h1>500 Internal Server Error</h1></body></html>",
-                )
+                self.send_canned(500)
             except Exception:
                 pass
-        finally:
-            self.client_conn.close()
+        if self.rate_limiter is not None:
+            self.rate_limiter.charge(self.client_addr[0], self.bytes_sent)
+        finished = time.perf_counter()
+        duration = finished - started
+        phases["handle"] = max(
+            0.0, duration - phases["resolve"] - phases["disk"] - phases["send"]
+        )
+        self.logger.metrics.observe_request(
+            request.method, self.status_code or 500, duration, self.bytes_sent
+        )
+        self.logger.metrics.observe_phases(phases)
+        if self.slow_request_threshold:
+            total = finished - (self.request_started or started)
+            if total >= self.slow_request_threshold:
+                self.log_slow_request(request_line, total)
+        self.phases = None
+        self.request_started = None
+        return self.keep_alive
 
-    def parse_request(self, request_data):
-        """Parse the raw HTTP request.
+    def log_slow_request(self, request_line, total):
+        """Log a request that took longer than slow_request_threshold, with its phase breakdown.
 
         Args:
-            request_data (str): The raw HTTP request string.
+            request_line (str): The original request line.
+            total (float): Seconds from its first bytes arriving to the response being sent.
+        """
+        breakdown = ", ".join(
+            f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in self.phases.items()
+        )
+        self.logger.log(
+            f"REQUEST from {self.client_addr[0]}: '{request_line}' was slow: "
+            f"{total * 1000:.1f} ms ({breakdown})",
+            "REQUEST",
+        )
+
+    def add_phase_time(self, phase, started):
+        """Add the time since a perf_counter() reading to a phase of the current request."""
+        if self.phases is not None:
+            self.phases[phase] += time.perf_counter() - started
+
+    def send_rate_limited(self, wait, method, headers, request_line):
+        """Answer a request over its client's rate or bandwidth limit with 429.
+
+        Args:
+            wait (float): Seconds until the client's next request would be allowed.
+            method (str): The request method.
+            headers (dict): HTTP headers.
+            request_line (str): The original request line.
+        """
+        if "Transfer-Encoding" in headers or headers.get("Content-Length", "0") != "0":
+            self.keep_alive = False  # The request body is left unread
+        self.send_response(
+            429,
+            {"Content-Type": "text/html", "Retry-After": str(retry_after(wait))},
+            error_body(429),
+            head_only=method == "HEAD",
+        )
+        self.log_request(request_line, 429)
+
+    def is_expensive(self, method, resolution):
+        """Tell whether a request is of a kind refused first when the server is overloaded.
+
+        Directory listings, files too large for the file cache (streamed from
+        disk) and uploads are expensive; HEAD requests, small and cached
+        files, bundle hits and 404s are cheap.
+
+        Args:
+            method (str): The request method.
+            resolution (Resolution): What the request path maps to.
 
         Returns:
-            tuple: (request_line, headers_dict)
-        """
-        lines = request_data.split("\r\n")
-        request_line = lines[0]
-        headers = {}
-        for line in lines[1:]:
-            if line == "":
-                break  # End of headers
-            parts = line.split(":", 1)
-            if len(parts) == 2:
-                headers[parts[0].strip()] = parts[1].strip()
-        return request_line, headers
-
-    def handle_get(self, full_path, version, headers, request_line):
+            bool: True if the request is expensive.
+        """
+        if method in UPLOAD_METHODS:
+            return True
+        if method != "GET":
+            return False
+        if resolution.kind == DIRECTORY:
+            return resolution.index_path is None
+        if resolution.kind != FILE:
+            return False
+        if self.file_cache is not None:
+            return resolution.stat.st_size > self.file_cache.max_file_size
+        return resolution.stat.st_size >= self.sendfile_threshold
+
+    def send_overloaded(self, request_line):
+        """Answer a request shed because the server is overloaded with 503, and close.
+
+        Args:
+            request_line (str): The original request line.
+        """
+        self.keep_alive = False
+        self.send_response(
+            503,
+            {
+                "Content-Type": "text/html",
+                "Retry-After": str(self.config.get("retry_after", 1)),
+            },
+            error_body(503),
+        )
+        self.log_request(request_line, 503)
+
+    def wants_keep_alive(self, version, headers):
+        """Decide whether the client asked for a persistent connection.
+
+        HTTP/1.1 connections are persistent unless the client sends
+        "Connection: close"; HTTP/1.0 connections only when it sends
+        "Connection: keep-alive".
+
+        Args:
+            version (str): HTTP version.
+            headers (dict): HTTP headers.
+
+        Returns:
+            bool: True if the connection should stay open.
+        """
+        tokens = [
+            token.strip().lower() for token in headers.get("Connection", "").split(",")
+        ]
+        if "close" in tokens:
+            return False
+        if version == "HTTP/1.1":
+            return True
+        return version == "HTTP/1.0" and "keep-alive" in tokens
+
+    def handle_get(self, resolution, version, headers, request_line):
         """Process a GET request.
 
         Args:
-            full_path (str): The resolved file system path.
+            resolution (Resolution): What the request path maps to.
             version (str): HTTP version.
             headers (dict): HTTP headers.
             request_line (str): The originial request line.
         """
-        if os.path.isdir(full_path):
-            # Check for index.html inside the directory
-            index_path = os.path.join(full_path, "index.html")
-            if os.path.exists(index_path):
-                self.serve_file(index_path, version, request_line)
+        if resolution.kind == DIRECTORY:
+            # Serve the directory's index.html if it has one
+            if resolution.index_path is not None:
+                self.serve_file(resolution.index_path, version, request_line, headers)
             else:
                 # Generate directory listing if no index.html exists
-                content = self.generate_directory_listing(full_path)
-                self.send_response(
-                    200,
-                    {
-                        "Content-Type": "text/html",
-                        "Content-Length": str(len(content)),
-                        "Date": http_date_format(datetime.now()),
-                        "Server": "NoohHTTP/1.0",
-                        "Connection": "close",
-                    },
-                    content,
-                )
-                self.logger.log_request(self.client_addr[0], request_line, 200)
-        elif os.path.isfile(full_path):
-            self.serve_file(full_path, version, request_line)
+                self.send_directory_listing(resolution, request_line)
+        elif resolution.kind == FILE:
+            self.serve_file(resolution.path, version, request_line, headers)
         else:
             # File or directory not found
-            self.send_response(
-                404,
-                {
-                    "Content-Type": "text/html",
-                    "Date": http_date_format(datetime.now()),
-                    "Server": "NoobHTTP/1.0",
-                    "Connection": "close",
-                },
-                "<html><body><h1>404 Not Found</h1></body></html>",
-            )
-            self.logger.log_request(self.client_addr[0], request_line, 404)
+            self.send_canned(404)
+            self.log_request(request_line, 404)
 
-    def handle_head(self, full_path, version, headers, request_line):
+    def handle_head(self, resolution, version, headers, request_line):
         """Process a HEAD request (same as GET but only headers are sent)
 
         Args:
-            full_path (str): The resolved file system path.
+            resolution (Resolution): What the request path maps to.
             version (str): HTTP version.
             headers (dict): HTTP headers.
             request_line (str): The original request line.
         """
-        if os.path.isdir(full_path):
-            index_path = os.path.join(full_path, "index.html")
-            if os.path.exists(index_path):
-                self.serve_file(index_path, version, request_line, head_only=True)
-            else:
-                content = self.generate_directory_listing(full_path)
-                self.send_response(
-                    200,
-                    {
-                        "Content-Type": "text/html",
-                        "Content-Length": str(len(content)),
-                        "Date": http_date_format(datetime.now()),
-                        "Server": "NoobHTTP/1.0",
-                        "Connection": "close",
-                    },
+        if resolution.kind == DIRECTORY:
+            if resolution.index_path is not None:
+                self.serve_file(
+                    resolution.index_path,
+                    version,
+                    request_line,
+                    headers,
                     head_only=True,
                 )
-                self.logger.log_request(self.client_addr[0], request_line, 200)
-        elif os.path.isfile(full_path):
-            self.serve_file(full_path, version, request_line, head_only=True)
+            else:
+                self.send_directory_listing(resolution, request_line, head_only=True)
+        elif resolution.kind == FILE:
+            self.serve_file(
+                resolution.path, version, request_line, headers, head_only=True
+            )
         else:
+            self.send_canned(404, head_only=True)
+            self.log_request(request_line, 404)
+
+    def handle_upload(self, resolution, path, version, headers, request_line):
+        """Store a PUT or POST body as the file at its URL path.
+
+        The body is streamed to a temporary file beside the target in
+        fixed-size pieces and renamed over it once complete, so readers see
+        the old version or the new one, never a partial file. Missing parent
+        directories are created.
+
+        The upload is refused before its body is read if the credentials,
+        framing, declared size or path are wrong; a client that sent
+        "Expect: 100-continue" is only told to go ahead after these checks.
+        A refused or failed upload closes the connection, since its body
+        was not read to the end.
+
+        Args:
+            resolution (Resolution): What the request path maps to now.
+            path (str): The request path, without the query string.
+            version (str): HTTP version.
+            headers (dict): HTTP headers.
+            request_line (str): The original request line.
+        """
+        self.upload_stats.started()
+        status_code, size = 500, 0
+        try:
+            status_code, size = self.store_upload(resolution, path, version, headers)
+        except RequestParseError as e:
+            status_code = e.status_code
+            self.logger.log_error(
+                f"Upload from {self.client_addr[0]} to '{path}' refused: {e} ({status_code})"
+            )
+        except Exception as e:
+            self.logger.log_error(f"Error storing upload to '{path}': {e}")
+        finally:
+            self.upload_stats.finished(status_code, size)
+
+        if status_code == 201:
+            self.send_response(201, {"Location": encode_path(path)}, b"")
+        elif status_code == 204:
+            self.send_response(204, {})
+        elif status_code == 401:
+            self.keep_alive = False
             self.send_response(
-                404,
+                401,
                 {
+                    "WWW-Authenticate": 'Basic realm="uploads"',
                     "Content-Type": "text/html",
-                    "Date": http_date_format(datetime.now()),
-                    "Server": "NoobHTTP/1.0",
-                    "Connection": "close",
                 },
-                head_only=True,
+                error_body(401),
             )
-            self.logger.log_request(self.client_addr[0], request_line, 404)
+        else:
+            self.keep_alive = False
+            self.send_canned(status_code)
+        self.log_request(request_line, status_code)
+
+    def store_upload(self, resolution, path, version, headers):
+        """Check an upload, then stream its body into place.
+
+        Returns:
+            tuple: (201 if the file was created or 204 if it was replaced, bytes stored).
+
+        Raises:
+            RequestParseError: If the upload is refused (401, 409, 411, 413,
+                501) or its body is malformed (400) or stalls (408).
+            OSError: If the file cannot be written.
+        """
+        if self.upload_credentials and not self.upload_authorized(headers):
+            raise RequestParseError(401, "Missing or wrong upload credentials")
+        body = RequestBody(self.parser, self.receive_body, headers, self.max_upload_size)
+        if path.endswith("/") or resolution.kind == DIRECTORY:
+            raise RequestParseError(409, "Cannot upload over a directory")
+        if version == "HTTP/1.1" and "100-continue" in headers.get("Expect", "").lower():
+            self.client_conn.sendall(CONTINUE_RESPONSE)
+        try:
+            upload = AtomicUpload(resolution.path)
+        except (FileExistsError, NotADirectoryError):
+            raise RequestParseError(409, "A parent of the upload path is a file")
+        with upload:
+            for piece in body:
+                disk_started = time.perf_counter()
+                upload.write(piece)
+                self.add_phase_time("disk", disk_started)
+            created = upload.commit()
+        self.path_index.invalidate(path)
+        return (201 if created else 204), upload.size
+
+    def handle_proxy(self, route, method, path, raw_path, version, headers, request_line):
+        """Forward a request to one of a proxy route's upstreams and relay the response.
+
+        The request body is streamed upstream and the response body back to
+        the client as each piece arrives; neither is held in memory whole. A
+        response with a Content-Length is relayed as is, any other is
+        re-chunked (or close-delimited for HTTP/1.0 clients).
+
+        Args:
+            route (ProxyRoute): The route matching the request path.
+            method (str): The request method.
+            path (str): The decoded request path, without the query string.
+            raw_path (str): The request path as the client encoded it.
+            version (str): HTTP version.
+            headers (dict): HTTP headers.
+            request_line (str): The original request line.
+        """
+        body = None
+        try:
+            if "Transfer-Encoding" in headers or headers.get("Content-Length", "0") != "0":
+                body = RequestBody(
+                    self.parser, self.receive_body, headers, self.proxy.max_body_size
+                )
+                if version == "HTTP/1.1" and "100-continue" in headers.get("Expect", "").lower():
+                    self.client_conn.sendall(CONTINUE_RESPONSE)
+            response = self.proxy.forward(
+                route,
+                method,
+                route.target(path, self.query, raw_path),
+                headers,
+                body,
+                self.client_addr[0],
+            )
+        except (RequestParseError, UpstreamError) as e:
+            self.logger.log_error(f"Proxying '{request_line}' failed: {e} ({e.status_code})")
+            if body is not None:
+                self.keep_alive = False  # The request body may be partly unread
+            self.send_canned(e.status_code, head_only=method == "HEAD")
+            self.log_request(request_line, e.status_code)
+            return
+
+        response_headers = {}
+        if response.content_length is not None:
+            response_headers["Content-Length"] = response.content_length
+        if response.chunks is None:
+            self.send_response(
+                response.status_code, response_headers, header_block=response.header_block
+            )
+        else:
+            self.send_stream(
+                response.status_code,
+                response_headers,
+                response.chunks,
+                header_block=response.header_block,
+            )
+        self.log_request(request_line, response.status_code)
+
+    def upload_authorized(self, headers):
+        """Check the request's Basic credentials against upload_credentials.
 
-    def serve_file(self, file_path, version, request_line, head_only=False):
+        Args:
+            headers (dict): HTTP headers.
+
+        Returns:
+            bool: True if they match.
+        """
+        scheme, _, credentials = headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "basic":
+            return False
+        try:
+            decoded = base64.b64decode(credentials.strip(), validate=True)
+        except ValueError:
+            return False
+        return secrets.compare_digest(decoded, self.upload_credentials.encode("utf-8"))
+
+    def receive_body(self):
+        """Receive the next bytes of a request body, waiting at most body_timeout seconds.
+
+        Returns:
+            memoryview: The bytes received; empty if the client closed the connection.
+
+        Raises:
+            RequestParseError: If no bytes arrive in time (408).
+        """
+        if self.body_buffer is None:
+            self.body_buffer = bytearray(self.file_chunk_size)
+        started = time.perf_counter()
+        self.client_conn.settimeout(self.body_timeout)
+        try:
+            received = self.client_conn.recv_into(self.body_buffer)
+        except socket.timeout:
+            raise RequestParseError(408, "Request body not received in time")
+        finally:
+            self.client_conn.settimeout(self.write_timeout)
+            self.add_phase_time("recv", started)
+        return memoryview(self.body_buffer)[:received]
+
+    def serve_file(
+        self,
+        file_path,
+        version,
+        request_line,
+        request_headers=None,
+        head_only=False,
+        entry=None,
+    ):
         """Serve a static file with appropriate headers.
 
+        Responses carry ETag and Last-Modified validators, and conditional
+        requests whose validators still match are answered with a 304.
+
         Args:
             file_path (str): The file path to serve.
             version (str): HTTP version.
             request_line (str): The original request line.
+            request_headers (dict, optional): The request headers. Defaults to None.
             head_only (bool, optional): If True, send only headers without body. Defaults to False.
+            entry (BundleEntry, optional): The file's asset bundle entry; file_path
+                is then its URL path and nothing is read from disk. Defaults to None.
         """
+        request_headers = request_headers or {}
+        f = None
         try:
-            with open(file_path, "rb") as f:
-                content = f.read()
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if not mime_type:
-                mime_type = "application/octet-stream"
-            headers = {
-                "Content-Type": mime_type,
-                "Content-Length": str(len(content)),
-                "Date": http_date_format(datetime.now()),
-                "Server": "NoobHTTP/1.0",
-                "Connection": "close",
-            }
+            headers = {}
+            cache_control = self.cache_control_for(file_path)
+            if cache_control:
+                headers["Cache-Control"] = cache_control
 
-            if head_only:
-                self.send_response(200, headers, head_only=True)
+            disk_started = time.perf_counter()
+            if entry is None and self.file_cache is not None:
+                entry = self.file_cache.get(file_path)
+            if entry is not None:
+                body, size, mtime_ns = entry.body, entry.size, entry.mtime
+                etag, last_modified = entry.etag, entry.last_modified
+                mime_type = entry.mime_type
+            else:
+                body = None
+                # HEAD only needs metadata, so it never opens or reads the file.
+                f = None if head_only else open(file_path, "rb")
+                st = os.stat(file_path) if f is None else os.fstat(f.fileno())
+                size, mtime_ns = st.st_size, st.st_mtime_ns
+                etag, last_modified = file_validators(size, mtime_ns, self.weak_etags)
+                mime_type = guess_mime_type(file_path)
+            self.add_phase_time("disk", disk_started)
+
+            encoding = None
+            encoded = None
+            variants = getattr(entry, "variants", None)
+            if variants is not None:
+                # Bundled files are only sent in the codings packed with them.
+                if variants:
+                    headers["Vary"] = "Accept-Encoding"
+                    encoding = self.choose_encoding(request_headers, size)
+                    encoded = variants.get(encoding)
+                    if encoded is None:
+                        encoding = None
+            elif self.compression_cache is not None and is_compressible(
+                mime_type, self.compress_mime_types
+            ):
+                headers["Vary"] = "Accept-Encoding"
+                encoding = self.choose_encoding(request_headers, size)
+            if encoding is not None:
+                self.serve_encoded(
+                    file_path,
+                    headers,
+                    request_headers,
+                    encoding,
+                    mime_type,
+                    size,
+                    mtime_ns,
+                    etag,
+                    last_modified,
+                    request_line,
+                    head_only,
+                    body,
+                    encoded,
+                )
+                return
+
+            if self.is_not_modified(request_headers, etag, mtime_ns):
+                self.send_not_modified(headers, etag, last_modified, request_line)
+                return
+            ranges = self.requested_ranges(request_headers, size, etag, last_modified)
+            if ranges is not None:
+                headers["ETag"] = etag
+                headers["Last-Modified"] = last_modified
+                self.send_partial(
+                    headers,
+                    ranges,
+                    size,
+                    mime_type,
+                    request_line,
+                    head_only,
+                    body=body,
+                    f=f,
+                )
+                return
+
+            if entry is not None:
+                self.send_response(
+                    200,
+                    headers,
+                    body,
+                    head_only=head_only,
+                    header_block=entry.header_block,
+                )
             else:
-                self.send_response(200, headers, content)
-            self.logger.log_request(self.client_addr[0], request_line, 200)
+                headers["Content-Type"] = mime_type
+                headers["Content-Length"] = str(size)
+                headers["ETag"] = etag
+                headers["Last-Modified"] = last_modified
+                headers["Accept-Ranges"] = "bytes"
+                if head_only:
+                    self.send_response(200, headers, head_only=True)
+                elif size < self.sendfile_threshold:
+                    disk_started = time.perf_counter()
+                    data = f.read(size)
+                    self.add_phase_time("disk", disk_started)
+                    self.send_response(200, headers, data)
+                else:
+                    # Corked, so the headers share a segment with the first file bytes.
+                    self.set_cork(True)
+                    try:
+                        if self.send_response(200, headers):
+                            self.send_file_contents(f, size)
+                    finally:
+                        self.set_cork(False)
+            self.log_request(request_line, 200)
         except Exception as e:
             self.logger.log_error(f"Error serving file '{file_path}': {e}")
+            self.send_canned(500)
+            self.log_request(request_line, 500)
+        finally:
+            if f is not None:
+                f.close()
+
+    def choose_encoding(self, request_headers, size):
+        """Pick the content coding for a compressible file, if any.
+
+        Range requests and files outside the size limits are sent as identity.
+
+        Args:
+            request_headers (dict): The request headers.
+            size (int): The file size.
+
+        Returns:
+            str: "gzip" or "deflate", or None for identity.
+        """
+        accept_encoding = request_headers.get("Accept-Encoding")
+        if not accept_encoding or "Range" in request_headers:
+            return None
+        if size < self.compress_min_size or size > self.compress_max_size:
+            return None
+        return negotiate_encoding(accept_encoding)
+
+    def serve_encoded(
+        self,
+        file_path,
+        headers,
+        request_headers,
+        encoding,
+        mime_type,
+        size,
+        mtime_ns,
+        etag,
+        last_modified,
+        request_line,
+        head_only,
+        body,
+        encoded=None,
+    ):
+        """Send a compressed variant of a file, or a 304 if the client has it.
+
+        Unless it is given, the variant comes from the shared compression
+        cache, so each file version is compressed (or its .gz sibling read)
+        only once. A HEAD request never compresses: if the variant is not
+        cached, its headers are sent without a Content-Length.
+
+        Args:
+            file_path (str): The file path to serve.
+            headers (dict): Common response headers.
+            request_headers (dict): The request headers.
+            encoding (str): The negotiated content coding.
+            mime_type (str): The file's MIME type.
+            size (int): The file size.
+            mtime_ns (int): The file's modification time in nanoseconds.
+            etag (str): The ETag of the identity representation.
+            last_modified (str): The file's Last-Modified value.
+            request_line (str): The original request line.
+            head_only (bool): If True, send only headers without body.
+            body (bytes): The cached file body, or None to read it from disk.
+            encoded (bytes, optional): The encoded body, e.g. packed in the asset
+                bundle. Defaults to None.
+        """
+        etag = variant_etag(etag, encoding)
+        if self.is_not_modified(request_headers, etag, mtime_ns):
+            self.send_not_modified(headers, etag, last_modified, request_line)
+            return
+        if encoded is None:
+            if head_only:
+                encoded = self.compression_cache.peek(file_path, encoding, size, mtime_ns)
+            else:
+                encoded = self.compression_cache.get(
+                    file_path, encoding, size, mtime_ns, body
+                )
+        headers["Content-Type"] = mime_type
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = etag
+        headers["Last-Modified"] = last_modified
+        self.send_response(200, headers, encoded, head_only=head_only)
+        self.log_request(request_line, 200)
+
+    def cache_control_for(self, file_path):
+        """Return the Cache-Control value configured for a file's extension.
+
+        Args:
+            file_path (str): The file path.
+
+        Returns:
+            str: e.g. "max-age=3600", or None if no max-age is configured.
+        """
+        if not self.cache_max_age:
+            return None
+        extension = os.path.splitext(file_path)[1].lower()
+        max_age = self.cache_max_age.get(extension, self.cache_max_age.get("default"))
+        if max_age is None:
+            return None
+        return f"max-age={max_age}"
+
+    def is_not_modified(self, request_headers, etag, mtime_ns):
+        """Evaluate If-None-Match / If-Modified-Since against a file's validators.
+
+        If-None-Match takes precedence and uses weak comparison, as GET and
+        HEAD allow; If-Modified-Since is only consulted without it.
+
+        Args:
+            request_headers (dict): The request headers.
+            etag (str): The file's current ETag.
+            mtime_ns (int): The file's modification time in nanoseconds.
+
+        Returns:
+            bool: True if a 304 Not Modified should be sent.
+        """
+        if_none_match = request_headers.get("If-None-Match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            opaque = etag[2:] if etag.startswith("W/") else etag
+            for candidate in if_none_match.split(","):
+                candidate = candidate.strip()
+                if candidate.startswith("W/"):
+                    candidate = candidate[2:]
+                if candidate == opaque:
+                    return True
+            return False
+
+        if_modified_since = request_headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return mtime_ns // 1_000_000_000 <= since
+        return False
+
+    def send_not_modified(self, headers, etag, last_modified, request_line):
+        """Send a body-less 304 Not Modified response.
+
+        Args:
+            headers (dict): Common response headers (Cache-Control, Vary).
+            etag (str): The file's ETag.
+            last_modified (str): The file's Last-Modified value.
+            request_line (str): The original request line.
+        """
+        headers["ETag"] = etag
+        headers["Last-Modified"] = last_modified
+        self.send_response(304, headers)
+        self.log_request(request_line, 304)
+
+    def requested_ranges(self, request_headers, size, etag, last_modified):
+        """Work out which byte ranges of a file the request asks for.
+
+        Args:
+            request_headers (dict): The request headers.
+            size (int): The file size.
+            etag (str): The file's current ETag.
+            last_modified (str): The file's Last-Modified value.
+
+        Returns:
+            list: (start, end) pairs to send as a 206, an empty list for a 416,
+            or None to send the whole file.
+        """
+        range_header = request_headers.get("Range")
+        if range_header is None:
+            return None
+        if_range = request_headers.get("If-Range")
+        if if_range is not None:
+            # Ranges only apply to the version the client already has; If-Range
+            # needs a strong match, so weak ETags never match.
+            if if_range.startswith(("W/", '"')):
+                if etag.startswith("W/") or if_range != etag:
+                    return None
+            elif if_range != last_modified:
+                return None
+        return parse_range_header(range_header, size, self.max_ranges)
+
+    def send_partial(
+        self,
+        headers,
+        ranges,
+        size,
+        mime_type,
+        request_line,
+        head_only,
+        body=None,
+        f=None,
+    ):
+        """Send a 206 Partial Content (or 416) response for byte ranges.
+
+        One range is sent as-is; several as multipart/byteranges. Slices come
+        from a memoryview of a cached body or from offset sendfile() on the
+        open file, so only the requested bytes are read.
+
+        Args:
+            headers (dict): Common response headers.
+            ranges (list): (start, end) pairs from requested_ranges().
+            size (int): The file size.
+            mime_type (str): The file's MIME type.
+            request_line (str): The original request line.
+            head_only (bool): If True, send only headers without body.
+            body (bytes, optional): The cached file body. Defaults to None.
+            f (file, optional): The open file when there is no cached body. Defaults to None.
+        """
+        if not ranges:
+            headers["Content-Type"] = "text/html"
+            headers["Content-Range"] = f"bytes */{size}"
             self.send_response(
-                500,
-                {
-                    "Content-Type": "text/html",
-                    "Date": http_date_format(datetime.now()),
-                    "Server": "NoobHTTP/1.0",
-                    "Connection": "close",
-                },
-                "<html><body><h1>500 Internal Server Error</h1></body></html>",
+                416,
+                headers,
+                "<html><body><h1>416 Range Not Satisfiable</h1></body></html>",
+                head_only=head_only,
             )
-            self.logger.log_request(self.client_addr[0], request_line, 500)
+            self.log_request(request_line, 416)
+            return
 
-    def send_response(self, status_code, headers, body=None, head_only=False):
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            parts = [(b"", start, end)]
+            headers["Content-Type"] = mime_type
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            closing = b""
+        else:
+            boundary = secrets.token_hex(16)
+            parts = [
+                (
+                    (
+                        f"--{boundary}\r\n"
+                        f"Content-Type: {mime_type}\r\n"
+                        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                    ).encode("latin-1"),
+                    start,
+                    end,
+                )
+                for start, end in ranges
+            ]
+            headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+            closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        # Every multipart part after the first is preceded by a CRLF.
+        separator = b"\r\n" if len(parts) > 1 else b""
+        length = sum(len(part) + end - start + 1 for part, start, end in parts)
+        length += len(separator) * (len(parts) - 1) + len(closing)
+        headers["Content-Length"] = str(length)
+        headers["Accept-Ranges"] = "bytes"
+
+        if body is not None:
+            # Cached body: headers and every part go out in one sendmsg().
+            buffers = []
+            for index, (part, start, end) in enumerate(parts):
+                if index:
+                    buffers.append(separator)
+                if part:
+                    buffers.append(part)
+                buffers.append(memoryview(body)[start : end + 1])
+            if closing:
+                buffers.append(closing)
+            self.send_response(206, headers, buffers, head_only=head_only)
+        elif head_only:
+            self.send_response(206, headers, head_only=True)
+        else:
+            self.set_cork(True)
+            try:
+                if self.send_response(206, headers):
+                    for index, (part, start, end) in enumerate(parts):
+                        if index:
+                            part = separator + part
+                        if part:
+                            self.send_buffers([part])
+                        self.send_file_contents(f, end - start + 1, start)
+                    if closing:
+                        self.send_buffers([closing])
+            except Exception as e:
+                self.keep_alive = False
+                self.logger.log_error(f"Error sending partial content: {e}")
+            finally:
+                self.set_cork(False)
+        self.log_request(request_line, 206)
+
+    def log_request(self, request_line, status_code):
+        """Write a request's access log line.
+
+        A response whose file body was cut short is logged as aborted. An
+        engine that sends file bodies after the handler returns provides
+        log_request() on its connection and logs the line once it knows.
+
+        Args:
+            request_line (str): The original request line.
+            status_code (int): The status sent in the response head.
+        """
+        log_request = getattr(self.client_conn, "log_request", None)
+        if log_request is not None:
+            log_request(self.client_addr[0], request_line, status_code)
+        else:
+            self.logger.log_request(
+                self.client_addr[0], request_line, status_code, aborted=self.body_incomplete
+            )
+
+    def send_file_contents(self, f, count, offset=0):
+        """Send a file body without loading it into memory.
+
+        Uses the kernel's sendfile() through socket.sendfile() when available,
+        otherwise a read loop over a single fixed-size buffer. Peak memory is
+        bounded by file_chunk_size whatever the file size.
+
+        Each write may stall for at most write_timeout seconds. With a
+        minimum transfer rate configured, the body is sent in pieces of about
+        one second's worth at that rate, and abandoned once the client falls
+        below it. A connection that sends file bodies itself (the asyncio
+        engine's ResponseBuffer, which has enforces_transfer_rate) is handed
+        the whole range in one call and applies the rate floor as it sends.
+
+        Args:
+            f (file): The file, opened in binary mode.
+            count (int): Number of bytes to send.
+            offset (int, optional): Position in the file to start from. Defaults to 0.
+        """
+        sent = 0
+        started = time.perf_counter()
+        guard = self.connection_guard
+        send_started = time.monotonic()
+        try:
+            sendfile = getattr(self.client_conn, "sendfile", None)
+            if sendfile is not None:
+                piece = count
+                if guard.min_transfer_rate and not getattr(
+                    self.client_conn, "enforces_transfer_rate", False
+                ):
+                    piece = max(self.file_chunk_size, guard.min_transfer_rate)
+                while sent < count:
+                    written = sendfile(f, offset + sent, min(piece, count - sent))
+                    if not written:
+                        break
+                    sent += written
+                    if sent < count and guard.too_slow(sent, send_started):
+                        guard.record("slow_transfer")
+                        break
+            else:
+                f.seek(offset)
+                chunk = bytearray(self.file_chunk_size)
+                view = memoryview(chunk)
+                while sent < count:
+                    read = f.readinto(view[: min(self.file_chunk_size, count - sent)])
+                    if not read:
+                        break
+                    self.client_conn.sendall(view[:read])
+                    sent += read
+                    if sent < count and guard.too_slow(sent, send_started):
+                        guard.record("slow_transfer")
+                        break
+        except socket.timeout:
+            guard.record("write_timeout")
+        except Exception as e:
+            self.logger.log_error(f"Error sending file body: {e}")
+        self.add_phase_time("send", started)
+        self.bytes_sent += sent
+        if sent != count:
+            # The body is short of its Content-Length; the connection can't be reused.
+            self.keep_alive = False
+            self.body_incomplete = True
+
+    def send_response(
+        self,
+        status_code,
+        headers,
+        body=None,
+        head_only=False,
+        header_block=b"",
+        trailers=None,
+    ):
         """Format and send an HTTP response.
 
+        The status line, Date, Server and Connection headers come pre-encoded
+        from the response module; headers and body are written together with
+        a single sendmsg() call. A body of unknown length, given as an
+        iterable of chunks (e.g. a generator), is streamed with send_stream().
+
         Args:
             status_code (int): The HTTP status code.
             headers (dict): Response headers.
-            body (str or bytes, optional): The response body. Defaults to None.
+            body (str, bytes, list or iterable, optional): The response body, a
+                list of buffers sent back to back, or any other iterable of
+                byte chunks to stream. Defaults to None.
             head_only (bool, optional): If True, do not send the body. Defaults to False.
+            header_block (bytes, optional): Pre-encoded header lines sent after headers.
+                Must include Content-Length if a body is given. Defaults to b"".
+            trailers (callable, optional): For a streamed body, returns the
+                trailer fields to send after it. Defaults to None.
+
+        Returns:
+            bool: True if the response was sent; False if the connection failed.
         """
-        reason_phrases = {
-            200: "OK",
-            404: "Not Found",
-            405: "Method Not Allowed",
-            500: "Internal Server Error",
-        }
-        reason = reason_phrases.get(status_code, "")
-        response_line = f"HTTP/1.1 {status_code} {reason}\r\n"
+        if body is not None and not isinstance(
+            body, (bytes, bytearray, memoryview, str, list)
+        ):
+            return self.send_stream(
+                status_code, headers, body, head_only, trailers, header_block
+            )
+        self.status_code = status_code
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        buffers = body if isinstance(body, list) else [body] if body is not None else []
+        if body is not None and not header_block and "Content-Length" not in headers:
+            headers["Content-Length"] = str(sum(len(buffer) for buffer in buffers))
+
+        head = self.encode_head(status_code, headers, header_block)
+        try:
+            self.send_buffers([head] if head_only else [head] + buffers)
+            return True
+        except socket.timeout:
+            self.keep_alive = False  # Counted by send_buffers()
+            return False
+        except Exception as e:
+            self.keep_alive = False
+            self.logger.log_error(f"Error sending response: {e}")
+            return False
 
-        header_lines = ""
-        for header, value in headers.items():
-            header_lines += f"{header}: {value}\r\n"
+    def send_stream(
+        self,
+        status_code,
+        headers,
+        chunks,
+        head_only=False,
+        trailers=None,
+        header_block=b"",
+    ):
+        """Send a response whose body is produced chunk by chunk.
 
-        # End of headers
-        full_response = response_line + header_lines + "\r\n"
+        Unless headers give its Content-Length, HTTP/1.1 clients get the body
+        with chunked transfer encoding: the headers go out with the first
+        chunk and every chunk is sent as soon as it is produced, so only one
+        chunk is held in memory at a time. HTTP/1.0 clients get the chunks
+        as they are, ended by closing the connection.
+        If producing a chunk fails part way, the connection is closed without
+        the terminating chunk, so the client sees the response was cut short.
 
+        Args:
+            status_code (int): The HTTP status code.
+            headers (dict): Response headers.
+            chunks (iterable): The body, as bytes or str chunks. Closed when done, if it has close().
+            head_only (bool, optional): If True, send only the headers. Defaults to False.
+            trailers (callable, optional): Called once the body is complete; returns
+                a dict of trailer fields sent after the last chunk (chunked only).
+                Defaults to None.
+            header_block (bytes, optional): Pre-encoded header lines sent after headers.
+                Defaults to b"".
+
+        Returns:
+            bool: True if the response was sent; False if the connection failed.
+        """
+        self.status_code = status_code
+        chunked = "Content-Length" not in headers and self.request_version == "HTTP/1.1"
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        elif "Content-Length" not in headers:
+            self.keep_alive = False
+        flush = getattr(self.client_conn, "flush", None)
         try:
-            self.client_conn.sendall(full_response.encode("utf-8"))
-            if not head_only and body is not None:
-                if isinstance(body, str):
-                    self.client_conn.sendall(body.encode("utf-8"))
-                else:
-                    self.client_conn.sendall(body)
+            pending = [self.encode_head(status_code, headers, header_block)]
+            if not head_only:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    if not chunk:
+                        continue  # An empty chunk would end the body
+                    if chunked:
+                        pending += (b"%x\r\n" % len(chunk), chunk, b"\r\n")
+                    else:
+                        pending.append(chunk)
+                    self.send_buffers(pending)
+                    pending = []
+                    if flush is not None:
+                        # Engines that buffer responses pass each chunk on now.
+                        flush()
+                if chunked:
+                    pending.append(b"0\r\n")
+                    if trailers is not None:
+                        pending.append(
+                            "".join(
+                                f"{name}: {value}\r\n" for name, value in trailers().items()
+                            ).encode("utf-8")
+                        )
+                    pending.append(b"\r\n")
+            self.send_buffers(pending)
+            return True
+        except socket.timeout:
+            self.keep_alive = False  # Counted by send_buffers() or flush()
+            return False
         except Exception as e:
-            self.logger.log_error(f"Error sending response: {e}")
+            self.keep_alive = False
+            self.logger.log_error(f"Error sending streamed response: {e}")
+            return False
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def encode_head(self, status_code, headers, header_block=b""):
+        """Encode the status line and headers of a response, ending with the blank line.
 
-    def generate_directory_listing(self, directory_path):
-        """Generate an HTML page listing files and directories.
+        Args:
+            status_code (int): The HTTP status code.
+            headers (dict): Response headers.
+            header_block (bytes, optional): Pre-encoded header lines sent after headers.
+                Defaults to b"".
+
+        Returns:
+            bytes: The response head.
+        """
+        header_lines = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        return b"".join(
+            (
+                status_line(status_code),
+                date_header(),
+                SERVER_HEADER,
+                header_lines.encode("utf-8"),
+                header_block,
+                self.connection_header(),
+                b"\r\n",
+            )
+        )
+
+    def send_canned(self, status_code, head_only=False):
+        """Send a prebuilt HTML error response (e.g. 404, 405 or 500).
 
         Args:
-            directory_path (str): The direcotry to list
+            status_code (int): The HTTP status code.
+            head_only (bool, optional): If True, do not send the body. Defaults to False.
 
         Returns:
-            str: The HTML content of the directory listing.
+            bool: True if the response was sent; False if the connection failed.
         """
+        self.status_code = status_code
         try:
-            entries = os.listdir(directory_path)
-            listing = "<html><head><title>Directory Listing</title></head><body>"
-            listing += f"<h1>Directory listing for {directory_path}</h1><ul>"
-            for entry in entries:
-                full_entry_path = os.path.join(directory_path, entry)
-                display_name = f"{entry}/" if os.path.isdir(full_entry_path) else entry
-                modified_item = datetime.fromtimestamp(
-                    os.path.getmtime(full_entry_path)
-                ).strftime("%d-%m-%Y %H:%M:%S")
-                listing += f"<li>{display_name} - Last Modified: {modified_item}</li>"
-            listing += "</ul></body></html>"
-            return listing
+            self.send_buffers(
+                [
+                    status_line(status_code),
+                    date_header(),
+                    canned_response(status_code, self.connection_header(), head_only),
+                ]
+            )
+            return True
+        except socket.timeout:
+            self.keep_alive = False  # Counted by send_buffers()
+            return False
+        except Exception as e:
+            self.keep_alive = False
+            self.logger.log_error(f"Error sending response: {e}")
+            return False
+
+    def connection_header(self):
+        """Return the encoded Connection header(s) for the current response.
+
+        Returns:
+            bytes: "Connection: close" or "keep-alive" (plus Keep-Alive for HTTP/1.0).
+        """
+        if not self.keep_alive:
+            return CONNECTION_CLOSE
+        if self.request_version == "HTTP/1.0":
+            return keep_alive_header(self.keep_alive_timeout)
+        return CONNECTION_KEEP_ALIVE
+
+    def send_buffers(self, buffers):
+        """Write buffers to the client with scatter/gather sendmsg(), resuming partial writes.
+
+        Args:
+            buffers (list): bytes-like objects to send in order.
+
+        Raises:
+            OSError: If the connection fails; socket.timeout if a write stalls
+                for longer than the socket timeout.
+        """
+        started = time.perf_counter()
+        try:
+            sendmsg = getattr(self.client_conn, "sendmsg", None)
+            if sendmsg is None:
+                data = b"".join(buffers)
+                self.client_conn.sendall(data)
+                self.bytes_sent += len(data)
+                return
+            pending = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+            while pending:
+                sent = sendmsg(pending)
+                self.bytes_sent += sent
+                while pending and sent >= len(pending[0]):
+                    sent -= len(pending.pop(0))
+                if sent:
+                    pending[0] = pending[0][sent:]
+        except socket.timeout:
+            self.connection_guard.record("write_timeout")
+            raise
+        finally:
+            self.add_phase_time("send", started)
+
+    def set_cork(self, enabled):
+        """Hold back (or flush) partial TCP segments while a response is written in several calls.
+
+        A no-op where TCP_CORK is unavailable or the connection is not a real socket.
+
+        Args:
+            enabled (bool): True to cork, False to uncork and flush.
+        """
+        cork = getattr(socket, "TCP_CORK", None)
+        setsockopt = getattr(self.client_conn, "setsockopt", None)
+        if cork is None or setsockopt is None:
+            return
+        try:
+            setsockopt(socket.IPPROTO_TCP, cork, 1 if enabled else 0)
+        except OSError:
+            pass
+
+    def send_directory_listing(self, resolution, request_line, head_only=False):
+        """Send a page of a directory listing.
+
+        Listings come from the shared listing cache, so a directory is only
+        rescanned after its mtime changes. The query string selects the page
+        ("?page=2"), the order ("?sort=size", "?sort=-mtime") and the output
+        format ("?format=json").
+
+        Args:
+            resolution (Resolution): The resolved directory.
+            request_line (str): The original request line.
+            head_only (bool, optional): If True, send only headers without body. Defaults to False.
+        """
+        query = parse_qs(self.query)
+        try:
+            page = int(query.get("page", ["1"])[0])
+        except ValueError:
+            page = 1
+        try:
+            disk_started = time.perf_counter()
+            url_path = self.path_index.url_path_for(resolution.path)
+            content_type, body = self.listing_cache.render(
+                resolution.path,
+                url_path,
+                query.get("sort", ["name"])[0],
+                page,
+                query.get("format", ["html"])[0],
+            )
+            self.add_phase_time("disk", disk_started)
         except Exception as e:
             self.logger.log_error(
-                f"Error generating directory listing for '{directory_path}': {e}"
+                f"Error generating directory listing for '{resolution.path}': {e}"
             )
-            return "<html><body><h1>500 Internal Server Error</h1></body></html>"
+            self.send_canned(500, head_only=head_only)
+            self.log_request(request_line, 500)
+            return
+        self.send_response(
+            200, {"Content-Type": content_type}, body, head_only=head_only
+        )
+        self.log_request(request_line, 200)
 
     @staticmethod
     def handle_client(client_conn, client_addr, config, logger):
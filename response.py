@@ -0,0 +1,131 @@
+import functools
+import time
+from email.utils import formatdate
+
+REASON_PHRASES = {
+    100: "Continue",
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    409: "Conflict",
+    411: "Length Required",
+    413: "Content Too Large",
+    416: "Range Not Satisfiable",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+SERVER_NAME = "NoobHTTP/1.0"
+
+# Header bytes that never change, encoded once at import.
+STATUS_LINES = {
+    status_code: f"HTTP/1.1 {status_code} {reason}\r\n".encode("latin-1")
+    for status_code, reason in REASON_PHRASES.items()
+}
+SERVER_HEADER = f"Server: {SERVER_NAME}\r\n".encode("latin-1")
+CONNECTION_CLOSE = b"Connection: close\r\n"
+CONNECTION_KEEP_ALIVE = b"Connection: keep-alive\r\n"
+# Interim response telling a client that sent "Expect: 100-continue" to send its body.
+CONTINUE_RESPONSE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+# (second, encoded Date header line) of the last call to date_header().
+date_cache = (None, b"")
+
+
+def status_line(status_code):
+    """Return the encoded status line for a status code.
+
+    Args:
+        status_code (int): The HTTP status code.
+
+    Returns:
+        bytes: e.g. b"HTTP/1.1 200 OK\\r\\n".
+    """
+    line = STATUS_LINES.get(status_code)
+    if line is None:
+        reason = REASON_PHRASES.get(status_code, "")
+        line = f"HTTP/1.1 {status_code} {reason}\r\n".encode("latin-1")
+    return line
+
+
+def date_header():
+    """Return the encoded Date header line for the current second, in UTC.
+
+    The line is formatted at most once per second and shared by every
+    response sent within that second.
+
+    Returns:
+        bytes: e.g. b"Date: Mon, 25 Feb 2025 14:30:00 GMT\\r\\n".
+    """
+    global date_cache
+    second = int(time.time())
+    cached_second, header = date_cache
+    if cached_second != second:
+        header = f"Date: {formatdate(second, usegmt=True)}\r\n".encode("latin-1")
+        # A single tuple assignment, so other threads never see a torn pair.
+        date_cache = (second, header)
+    return header
+
+
+@functools.lru_cache(maxsize=16)
+def keep_alive_header(timeout):
+    """Return the encoded headers keeping an HTTP/1.0 connection open.
+
+    Args:
+        timeout (int): The keep-alive timeout announced to the client.
+
+    Returns:
+        bytes: The Connection and Keep-Alive header lines.
+    """
+    return CONNECTION_KEEP_ALIVE + f"Keep-Alive: timeout={timeout}\r\n".encode(
+        "latin-1"
+    )
+
+
+def error_body(status_code):
+    """Return the HTML body of an error response.
+
+    Args:
+        status_code (int): The HTTP status code.
+
+    Returns:
+        bytes: The body.
+    """
+    reason = REASON_PHRASES.get(status_code, "")
+    return f"<html><body><h1>{status_code} {reason}</h1></body></html>".encode("utf-8")
+
+
+@functools.lru_cache(maxsize=64)
+def canned_response(status_code, connection_header, head_only=False):
+    """Prebuild an error response, apart from its status line and Date header.
+
+    Args:
+        status_code (int): The HTTP status code, e.g. 404.
+        connection_header (bytes): The Connection header line(s) to send.
+        head_only (bool, optional): If True, leave out the body. Defaults to False.
+
+    Returns:
+        bytes: Every header after Date, the blank line and the body.
+    """
+    body = error_body(status_code)
+    head = (
+        SERVER_HEADER
+        + b"Content-Type: text/html\r\n"
+        + f"Content-Length: {len(body)}\r\n".encode("latin-1")
+        + connection_header
+        + b"\r\n"
+    )
+    return head if head_only else head + body
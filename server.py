@@ -1,11 +1,19 @@
 import json
 import os
+import signal
 import sys
 import socket
-import threading
 from admin_interface import AdminInterface
+from async_server import start_async_server
 from request_handler import HTTPRequestHandler
-from logger import Logger
+from logger import OVERFLOW_POLICIES, Logger
+from prefork import Supervisor, start_stats_reporter
+from profiler import Profiler
+from proxy import validate_proxy_routes
+from rate_limit import validate_rate_limit_rules
+from worker_pool import WorkerPool
+
+ENGINES = ("threaded", "asyncio")
 
 
 def load_config(config_file="config.json"):
@@ -53,6 +61,131 @@ def load_config(config_file="config.json"):
     if not isinstance(config["max_threads"], int):
         raise ValueError("The 'max_threads' field must be an integer.")
 
+    # Optional fields
+    for field in (
+        "workers",
+        "queue_size",
+        "listen_backlog",
+        "retry_after",
+        "max_header_size",
+        "max_header_count",
+        "max_keep_alive_requests",
+        "sendfile_threshold",
+        "file_chunk_size",
+        "file_cache_size",
+        "file_cache_max_file_size",
+        "max_ranges",
+        "compression_cache_size",
+        "compress_min_size",
+        "compress_max_size",
+        "compress_level",
+        "log_queue_size",
+        "log_flush_bytes",
+        "log_sample_rate",
+        "log_recent_entries",
+        "admin_max_log_lines",
+        "path_cache_size",
+        "listing_cache_size",
+        "listing_page_size",
+        "max_connections_per_ip",
+        "min_transfer_rate",
+        "max_upload_size",
+        "proxy_pool_size",
+        "proxy_max_body_size",
+        "rate_limit_table_size",
+    ):
+        if field in config and not isinstance(config[field], int):
+            raise ValueError(f"The '{field}' field must be an integer.")
+    for field in (
+        "keep_alive_timeout",
+        "header_timeout",
+        "write_timeout",
+        "body_timeout",
+        "log_flush_interval",
+        "worker_report_interval",
+        "path_cache_negative_ttl",
+        "path_cache_poll_interval",
+        "slow_request_threshold",
+        "profile_sample_interval",
+        "profile_max_seconds",
+        "bundle_poll_interval",
+        "proxy_connect_timeout",
+        "proxy_timeout",
+        "proxy_health_interval",
+        "rate_limit_requests",
+        "rate_limit_burst",
+        "rate_limit_bandwidth",
+        "rate_limit_bandwidth_burst",
+        "shed_target_delay",
+        "shed_interval",
+    ):
+        if field in config and not isinstance(config[field], (int, float)):
+            raise ValueError(f"The '{field}' field must be a number.")
+    if "cache_max_age" in config and not isinstance(config["cache_max_age"], dict):
+        raise ValueError(
+            "The 'cache_max_age' field must map file extensions to seconds."
+        )
+    if "compress_mime_types" in config and not isinstance(
+        config["compress_mime_types"], list
+    ):
+        raise ValueError("The 'compress_mime_types' field must be a list.")
+    if config.get("log_overflow_policy", "drop") not in OVERFLOW_POLICIES:
+        raise ValueError(
+            "The 'log_overflow_policy' field must be one of: "
+            f"{', '.join(OVERFLOW_POLICIES)}."
+        )
+    if config.get("engine", "threaded") not in ENGINES:
+        raise ValueError(f"The 'engine' field must be one of: {', '.join(ENGINES)}.")
+    if config.get("listing_page_size", 1000) < 1:
+        raise ValueError("The 'listing_page_size' field must be at least 1.")
+    for field in ("keep_alive_timeout", "header_timeout", "write_timeout", "body_timeout"):
+        if config.get(field, 1) <= 0:
+            raise ValueError(f"The '{field}' field must be positive.")
+    if config.get("profile_sample_interval", 0.005) <= 0:
+        raise ValueError("The 'profile_sample_interval' field must be positive.")
+    if config.get("bundle_poll_interval", 1.0) <= 0:
+        raise ValueError("The 'bundle_poll_interval' field must be positive.")
+    if not isinstance(config.get("bundle_path", ""), (str, type(None))):
+        raise ValueError("The 'bundle_path' field must be a file path.")
+    if config.get("workers", 1) < 1:
+        raise ValueError("The 'workers' field must be at least 1.")
+    if not isinstance(config.get("reuse_port", True), bool):
+        raise ValueError("The 'reuse_port' field must be true or false.")
+    if not isinstance(config.get("uploads", False), bool):
+        raise ValueError("The 'uploads' field must be true or false.")
+    credentials = config.get("upload_credentials")
+    if credentials is not None:
+        user, _, password = credentials.partition(":") if isinstance(credentials, str) else ("", "", "")
+        if not user or not password:
+            raise ValueError("The 'upload_credentials' field must be \"user:password\".")
+    if config.get("uploads", False) and credentials is None:
+        # Without credentials any client could write into the document root.
+        raise ValueError("The 'uploads' field requires 'upload_credentials'.")
+    validate_proxy_routes(config.get("proxy_routes", []))
+    for field in ("proxy_connect_timeout", "proxy_timeout"):
+        if config.get(field, 1) <= 0:
+            raise ValueError(f"The '{field}' field must be positive.")
+    if config.get("proxy_health_interval", 5) < 0:
+        raise ValueError("The 'proxy_health_interval' field must not be negative.")
+    if config.get("proxy_pool_size", 8) < 0:
+        raise ValueError("The 'proxy_pool_size' field must not be negative.")
+    validate_rate_limit_rules(config.get("rate_limit_rules", []))
+    for field in (
+        "rate_limit_requests",
+        "rate_limit_burst",
+        "rate_limit_bandwidth",
+        "rate_limit_bandwidth_burst",
+    ):
+        if config.get(field, 0) < 0:
+            raise ValueError(f"The '{field}' field must not be negative.")
+    if not isinstance(config.get("load_shedding", False), bool):
+        raise ValueError("The 'load_shedding' field must be true or false.")
+    for field in ("shed_target_delay", "shed_interval"):
+        if config.get(field, 1) <= 0:
+            raise ValueError(f"The '{field}' field must be positive.")
+    if config.get("rate_limit_table_size", 100000) < 1:
+        raise ValueError("The 'rate_limit_table_size' field must be at least 1.")
+
     if not os.path.isdir(config["document_root"]):
         raise ValueError(
             f"Document root '{config['document_root']}' is not a valid directory."
@@ -61,22 +194,118 @@ def load_config(config_file="config.json"):
     return config
 
 
-def start_server(config, logger):
-    """Set up the TCP socket, listen for incoming connections, and spawn a new thread for each connection.
+def create_logger(config):
+    """Create the logger described by the configuration.
+
+    Args:
+        config (dict): Configuration parameters.
+
+    Returns:
+        Logger: The logger.
+    """
+    return Logger(
+        config["log_file"],
+        queue_size=config.get("log_queue_size", 10000),
+        flush_interval=config.get("log_flush_interval", 1.0),
+        flush_bytes=config.get("log_flush_bytes", 65536),
+        overflow_policy=config.get("log_overflow_policy", "drop"),
+        sample_rate=config.get("log_sample_rate", 10),
+        recent_entries=config.get("log_recent_entries", 1000),
+        profiler=Profiler(
+            config.get("profile_sample_interval", 0.005),
+            config.get("profile_max_seconds", 300),
+        ),
+    )
+
+
+def create_listening_socket(config, reuse_port=False):
+    """Create the server's listening TCP socket.
+
+    Args:
+        config (dict): Configuration parameters.
+        reuse_port (bool, optional): Set SO_REUSEPORT so several worker
+            processes can listen on the same port. Defaults to False.
+
+    Returns:
+        socket.socket: The bound, listening socket.
+    """
+    # Create a TCP socket. (Address Family - Internet) (Socket Type - Stream-based)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((config["host"], config["port"]))
+        server_socket.listen(config.get("listen_backlog", 128))
+    except Exception:
+        server_socket.close()
+        raise
+    return server_socket
+
+
+def run_worker(config, index, server_socket, reports):
+    """Entry point of a prefork worker process.
+
+    Args:
+        config (dict): Configuration parameters.
+        index (int): The worker slot.
+        server_socket (socket.socket): The shared listening socket, or None to
+            bind a SO_REUSEPORT socket of this worker's own.
+        reports (multiprocessing.Queue): Where the worker's stats are sent.
+    """
+    # Exit normally on SIGTERM from the supervisor, so queued log entries are written.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger = create_logger(config)
+    start_stats_reporter(logger, reports, config.get("worker_report_interval", 1.0))
+    if server_socket is None:
+        try:
+            server_socket = create_listening_socket(config, reuse_port=True)
+        except Exception as e:
+            logger.log_error(f"Worker {index} failed to bind: {e}")
+            sys.exit(1)
+    logger.log(f"Worker {index} (pid {os.getpid()}) accepting connections")
+    try:
+        start_server(config, logger, server_socket)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_server(config, logger, server_socket=None):
+    """Set up the TCP socket, listen for incoming connections, and hand them to a fixed pool of worker threads.
 
     Args:
         config (dict): Configuration file loaded when the server start.
         logger (Logger): log instance.
+        server_socket (socket.socket, optional): An already listening socket,
+            e.g. in a prefork worker. Defaults to None, which creates one.
     """
+    HTTPRequestHandler.setup_shared_state(config, logger)
+    if config.get("engine", "threaded") == "asyncio":
+        start_async_server(config, logger, server_socket)
+        return
+
     host = config["host"]
     port = config["port"]
     max_threads = config["max_threads"]
 
-    # Create a TCP socket. (Address Family - Internet) (Socket Type - Stream-based)
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    guard = HTTPRequestHandler.connection_guard
+    pool = WorkerPool(
+        num_workers=max_threads,
+        queue_size=config.get("queue_size", max_threads * 4),
+        handler=lambda conn, addr: HTTPRequestHandler.handle_client(
+            conn, addr, config, logger
+        ),
+        logger=logger,
+        retry_after=config.get("retry_after", 1),
+        shedder=HTTPRequestHandler.load_shedder,
+        on_shed=lambda addr: guard.release(addr[0]),
+    )
+    logger.register_stats_provider("Worker Pool", pool.stats)
+    pool.start()
+
     try:
-        server_socket.bind((host, port))
-        server_socket.listen(max_threads)
+        if server_socket is None:
+            server_socket = create_listening_socket(config)
         print(f"HTTP Server is listening on {host}:{port}")
         logger.log(f"Server started on {host}:{port}")
 
@@ -84,20 +313,20 @@ def start_server(config, logger):
         while True:
             try:
                 client_conn, client_addr = server_socket.accept()
-                print(f"Accepted connection from {client_addr[0]}")
-                # Spawn a new thread to handler the client connection.
-                thread = threading.Thread(
-                    target=HTTPRequestHandler.handle_client,
-                    args=(client_conn, client_addr, config, logger),
-                    daemon=True,
-                )
-                thread.start()
+                # Clients over their connection limit never take a queue slot.
+                if not guard.admit(client_addr[0]):
+                    guard.reject(client_conn)
+                    continue
+                # Queue the connection for a worker; a full queue gets a canned 503.
+                if not pool.submit(client_conn, client_addr):
+                    guard.release(client_addr[0])
             except Exception as e:
                 logger.log_error(f"Error handling connection: {e}")
     except Exception as e:
         logger.log_error(f"Server socket error: {e}")
     finally:
-        server_socket.close()
+        if server_socket is not None:
+            server_socket.close()
 
 
 if __name__ == "__main__":
@@ -107,16 +336,24 @@ if __name__ == "__main__":
         print("Configuration loaded successfully:")
         for key, value in config.items():
             print(f"    {key}: {value}")
+        if config.get("uploads") and config.get("bundle_path"):
+            print(
+                "Warning: files packed in the asset bundle are served from it even "
+                "after an upload replaces them, until the bundle is rebuilt."
+            )
     except Exception as e:
         print(f"Error loading configuration: {e}")
         sys.exit(1)
 
-    logger = Logger(config["log_file"])
+    logger = create_logger(config)
     logger.start_periodic_stats()  # Start stats logging every 60 seconds
 
     # Start the admin server
     admin_interface = AdminInterface(config, logger)
     admin_interface.start()
 
-    # Start the HTTP server
-    start_server(config, logger)
+    # Start the HTTP server, in worker processes if more than one is configured
+    if config.get("workers", 1) > 1:
+        Supervisor(config, logger, run_worker).run()
+    else:
+        start_server(config, logger)
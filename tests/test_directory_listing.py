@@ -0,0 +1,60 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import unittest
+from html import unescape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from directory_listing import DirectoryListingCache
+from utils import decode_path
+
+
+class DirectoryListingLinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tempdir.name, "my dir#1")
+        os.makedirs(os.path.join(self.directory, "sub?dir"))
+        for name in ("a b.txt", "50%.txt", "€.txt"):
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write("x")
+        self.cache = DirectoryListingCache()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def render(self, output_format):
+        _, body = self.cache.render(
+            self.directory, "/my dir#1/", output_format=output_format
+        )
+        if not isinstance(body, bytes):
+            body = b"".join(body)
+        return body.decode("utf-8")
+
+    def expected_paths(self):
+        return {
+            "/my dir#1/a b.txt",
+            "/my dir#1/50%.txt",
+            "/my dir#1/€.txt",
+            "/my dir#1/sub?dir/",
+        }
+
+    def test_html_links_round_trip(self):
+        hrefs = [unescape(href) for href in re.findall(r"<li><a href='([^']*)'", self.render("html"))]
+        self.assertIn("/my%20dir%231/a%20b.txt", hrefs)
+        for href in hrefs:
+            self.assertNotRegex(href, r"[ #?]")
+        self.assertEqual({decode_path(href) for href in hrefs}, self.expected_paths())
+
+    def test_json_urls_round_trip(self):
+        document = json.loads(self.render("json"))
+        urls = [entry["url"] for entry in document["entries"]]
+        self.assertIn("/my%20dir%231/sub%3Fdir/", urls)
+        self.assertEqual({decode_path(url) for url in urls}, self.expected_paths())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_parser import RequestParseError, RequestParser
+
+
+class RequestParserTest(unittest.TestCase):
+
+    def parse_all(self, parser):
+        requests = []
+        while True:
+            request = parser.next_request()
+            if request is None:
+                return requests
+            requests.append(request)
+
+    def test_single_request(self):
+        parser = RequestParser()
+        parser.feed(b"GET /index.html HTTP/1.1\r\nHost: example.com\r\naccept-encoding: gzip\r\n\r\n")
+        request = parser.next_request()
+        self.assertEqual(
+            (request.method, request.path, request.version),
+            ("GET", "/index.html", "HTTP/1.1"),
+        )
+        self.assertEqual(request.headers, {"Host": "example.com", "Accept-Encoding": "gzip"})
+        self.assertEqual(request.request_line, "GET /index.html HTTP/1.1")
+        self.assertIsNone(parser.next_request())
+
+    def test_pipelined_requests(self):
+        parser = RequestParser()
+        parser.feed(
+            b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+            b"HEAD /b HTTP/1.1\r\nHost: x\r\n\r\n"
+            b"GET /c HTTP/1.1\r\nHo"
+        )
+        self.assertEqual([request.path for request in self.parse_all(parser)], ["/a", "/b"])
+        parser.feed(b"st: x\r\n\r\n")
+        self.assertEqual(parser.next_request().path, "/c")
+
+    def test_partial_reads(self):
+        data = b"GET /split HTTP/1.1\r\nHost: x\r\nX-Long: " + b"v" * 100 + b"\r\n\r\nGET /next"
+        parser = RequestParser()
+        requests = []
+        for i in range(len(data)):
+            parser.feed(data[i : i + 1])
+            requests += self.parse_all(parser)
+        self.assertEqual([request.path for request in requests], ["/split"])
+        self.assertEqual(requests[0].headers["X-Long"], "v" * 100)
+        self.assertEqual(bytes(parser.buffer), b"GET /next")
+
+    def test_repeated_headers_are_joined(self):
+        parser = RequestParser()
+        parser.feed(b"GET / HTTP/1.1\r\nAccept: a\r\nACCEPT: b\r\n\r\n")
+        self.assertEqual(parser.next_request().headers["Accept"], "a, b")
+
+    def test_leading_empty_lines_are_ignored(self):
+        parser = RequestParser()
+        parser.feed(b"\r\n\r\nGET /a HTTP/1.1\r\n\r\n\nGET /b HTTP/1.1\r\n\r\n\r")
+        self.assertEqual([request.path for request in self.parse_all(parser)], ["/a", "/b"])
+        parser.feed(b"\nGET /c HTTP/1.1\r\n\r\n")
+        self.assertEqual(parser.next_request().path, "/c")
+
+    def test_oversize_head_gets_431(self):
+        parser = RequestParser(max_header_size=256)
+        parser.feed(b"GET / HTTP/1.1\r\nX-Big: " + b"x" * 300)
+        with self.assertRaises(RequestParseError) as raised:
+            parser.next_request()
+        self.assertEqual(raised.exception.status_code, 431)
+
+    def test_complete_oversize_head_gets_431(self):
+        parser = RequestParser(max_header_size=256)
+        parser.feed(b"GET / HTTP/1.1\r\nX-Big: " + b"x" * 300 + b"\r\n\r\n")
+        with self.assertRaises(RequestParseError) as raised:
+            parser.next_request()
+        self.assertEqual(raised.exception.status_code, 431)
+
+    def test_too_many_headers_get_431(self):
+        parser = RequestParser(max_header_count=5)
+        parser.feed(
+            b"GET / HTTP/1.1\r\n" + b"".join(b"X-%d: v\r\n" % i for i in range(6)) + b"\r\n"
+        )
+        with self.assertRaises(RequestParseError) as raised:
+            parser.next_request()
+        self.assertEqual(raised.exception.status_code, 431)
+
+    def test_obsolete_line_folding_gets_400(self):
+        for folded in (b"X-Folded: a\r\n  b\r\n", b"X-Folded: a\r\n\tb: c\r\n"):
+            parser = RequestParser()
+            parser.feed(b"GET / HTTP/1.1\r\n" + folded + b"\r\n")
+            with self.assertRaises(RequestParseError) as raised:
+                parser.next_request()
+            self.assertEqual(raised.exception.status_code, 400)
+
+    def test_malformed_heads_get_400(self):
+        for head in (b"GET /\r\n\r\n", b"GET / FTP/1.0\r\n\r\n", b"GET / HTTP/1.1\r\nNoColon\r\n\r\n"):
+            parser = RequestParser()
+            parser.feed(head)
+            with self.assertRaises(RequestParseError) as raised:
+                parser.next_request()
+            self.assertEqual(raised.exception.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
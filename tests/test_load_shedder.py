@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load_shedder import LoadShedder
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LoadShedderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.shedder = LoadShedder(target_delay=0.1, interval=1.0, clock=self.clock)
+
+    def observe(self, at, delay):
+        """Queue work and report its delay when picked up at the given time."""
+        self.shedder.queued()
+        self.clock.now = at
+        return self.shedder.observe(delay)
+
+    def overload(self):
+        """Drive the shedder into overload at t=1 with a standing queue."""
+        self.assertFalse(self.observe(0.5, 0.2))
+        self.assertTrue(self.observe(1.0, 0.3))
+        self.assertTrue(self.shedder.is_overloaded())
+
+    def test_standing_queue_enters_overload(self):
+        self.overload()
+        stats = self.shedder.stats()
+        self.assertEqual(stats["State"], "overloaded")
+        self.assertEqual(stats["Overload Episodes"], 1)
+        self.assertEqual(stats["Shed After Queueing (503)"], 1)
+        # Work that waited less than the target is still served.
+        self.assertFalse(self.observe(1.2, 0.05))
+
+    def test_one_short_wait_keeps_the_server_normal(self):
+        self.assertFalse(self.observe(0.2, 0.5))
+        self.assertFalse(self.observe(0.4, 0.05))
+        self.assertFalse(self.observe(1.0, 0.5))
+        self.assertFalse(self.shedder.is_overloaded())
+        self.assertEqual(self.shedder.stats()["Overload Episodes"], 0)
+
+    def test_recovers_after_an_interval_with_a_short_wait(self):
+        self.overload()
+        self.assertFalse(self.observe(1.5, 0.01))
+        self.assertFalse(self.observe(2.0, 0.3))
+        self.assertFalse(self.shedder.is_overloaded())
+        stats = self.shedder.stats()
+        self.assertEqual(stats["State"], "normal")
+        self.assertEqual(stats["Time Overloaded (s)"], 1.0)
+
+    def test_idle_timeout_leaves_overload(self):
+        self.overload()
+        self.clock.now = 2.5
+        self.assertTrue(self.shedder.is_overloaded())
+        self.clock.now = 3.0
+        self.assertFalse(self.shedder.is_overloaded())
+        self.assertEqual(self.shedder.stats()["State"], "normal")
+
+    def test_idle_timeout_waits_for_queued_work(self):
+        self.overload()
+        self.shedder.queued()
+        self.clock.now = 10.0
+        self.assertTrue(self.shedder.is_overloaded())
+        self.shedder.unqueued()
+        self.assertFalse(self.shedder.is_overloaded())
+
+    def test_waiting_accounting(self):
+        for _ in range(3):
+            self.shedder.queued()
+        self.shedder.unqueued()
+        self.shedder.observe(0.0)
+        self.assertEqual(self.shedder.stats()["Waiting for a Handler"], 1)
+        self.shedder.observe(0.0)
+        self.assertEqual(self.shedder.stats()["Waiting for a Handler"], 0)
+
+    def test_shed_request_is_counted(self):
+        self.shedder.shed_request()
+        self.assertEqual(self.shedder.stats()["Expensive Requests Shed (503)"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logger import Logger
+from path_index import DIRECTORY, FILE, PathIndex
+from request_handler import HTTPRequestHandler
+from utils import decode_path
+
+
+def make_tree(base):
+    """Create a document root with neighbours to escape to; returns its path.
+
+    base/secret.txt         outside the root
+    base/www2/secret.txt    a sibling sharing the root's name as a prefix
+    base/www/sub/page.txt   inside the root
+    base/www/inside  ->     base/www/sub
+    base/www/escape  ->     base
+    """
+    document_root = os.path.join(base, "www")
+    os.makedirs(os.path.join(document_root, "sub"))
+    os.makedirs(os.path.join(base, "www2"))
+    for path in ("secret.txt", "www2/secret.txt", "www/sub/page.txt"):
+        with open(os.path.join(base, path), "w") as f:
+            f.write(path)
+    os.symlink(os.path.join(document_root, "sub"), os.path.join(document_root, "inside"))
+    os.symlink(base, os.path.join(document_root, "escape"))
+    return document_root
+
+
+TRAVERSALS = [
+    "/../secret.txt",
+    "/sub/../../secret.txt",
+    "/%2e%2e/secret.txt",
+    "/%2E%2E%2Fsecret.txt",
+    "/../www2/secret.txt",
+    "/escape/secret.txt",
+    "/escape",
+    "/escape/www2/",
+]
+
+
+class PathIndexTraversalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.document_root = make_tree(self.tempdir.name)
+        self.index = PathIndex(self.document_root, max_entries=0)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_paths_outside_the_root_are_refused(self):
+        for raw_path in TRAVERSALS:
+            with self.subTest(raw_path=raw_path):
+                with self.assertRaises(ValueError):
+                    self.index.resolve(decode_path(raw_path))
+
+    def test_paths_inside_the_root_resolve(self):
+        resolution = self.index.resolve("/sub/page.txt")
+        self.assertEqual(resolution.kind, FILE)
+        self.assertEqual(self.index.resolve("/").kind, DIRECTORY)
+        self.assertEqual(self.index.resolve("/sub/./../sub/page.txt").kind, FILE)
+
+    def test_symlink_inside_the_root_keeps_its_path(self):
+        resolution = self.index.resolve("/inside/page.txt")
+        self.assertEqual(resolution.kind, FILE)
+        self.assertEqual(
+            resolution.path, os.path.join(self.document_root, "inside", "page.txt")
+        )
+        self.assertEqual(self.index.url_path_for(os.path.dirname(resolution.path)), "/inside/")
+
+
+class TraversalResponseTest(unittest.TestCase):
+    """Traversal attempts sent over real connections get a 403."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.document_root = make_tree(cls.tempdir.name)
+        cls.config = {
+            "host": "127.0.0.1",
+            "port": 0,
+            "document_root": cls.document_root,
+            "max_threads": 4,
+            "log_file": os.path.join(cls.tempdir.name, "server.log"),
+        }
+        cls.logger = Logger(cls.config["log_file"])
+        HTTPRequestHandler.setup_shared_state(cls.config, cls.logger)
+        cls.server = socket.create_server(("127.0.0.1", 0))
+        cls.port = cls.server.getsockname()[1]
+        threading.Thread(target=cls.accept_loop, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.logger.close()
+        cls.tempdir.cleanup()
+
+    @classmethod
+    def accept_loop(cls):
+        while True:
+            try:
+                conn, addr = cls.server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=HTTPRequestHandler.handle_client,
+                args=(conn, addr, cls.config, cls.logger),
+                daemon=True,
+            ).start()
+
+    def status_of(self, raw_path):
+        """Send a GET for a raw request target and return the response's status code."""
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(f"GET {raw_path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode())
+            response = b""
+            while b"\r\n" not in response:
+                received = sock.recv(4096)
+                if not received:
+                    break
+                response += received
+        return int(response.split(b" ", 2)[1])
+
+    def test_traversal_is_forbidden(self):
+        for raw_path in TRAVERSALS:
+            with self.subTest(raw_path=raw_path):
+                self.assertEqual(self.status_of(raw_path), 403)
+
+    def test_files_inside_the_root_are_served(self):
+        self.assertEqual(self.status_of("/sub/page.txt"), 200)
+        self.assertEqual(self.status_of("/inside/page.txt"), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
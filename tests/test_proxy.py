@@ -0,0 +1,159 @@
+import os
+import socket
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxy import ReverseProxy, UpstreamError
+
+
+class BackendHandler(BaseHTTPRequestHandler):
+    """Answers every GET with the backend's name, on keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        body = self.server.name.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Backend:
+    """A local stand-in upstream that can be stopped and restarted on its port."""
+
+    def __init__(self, name, port=0):
+        self.name = name
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), BackendHandler)
+        self.server.daemon_threads = True
+        self.server.name = name
+        self.server.lock = threading.Lock()
+        self.server.connections = []
+        self.port = self.server.server_address[1]
+        self.address = f"127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def connections(self):
+        return len(self.server.connections)
+
+    def stop(self):
+        """Stop listening and close every open connection, as a crashed backend would."""
+        self.server.shutdown()
+        self.server.server_close()
+        with self.server.lock:
+            for conn in self.server.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class ReverseProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.stop()
+
+    def start_backend(self, name, port=0):
+        backend = Backend(name, port)
+        self.backends.append(backend)
+        return backend
+
+    def make_proxy(self, *backends, balance="round_robin"):
+        route = {
+            "prefix": "/api/",
+            "upstreams": [backend.address for backend in backends],
+            "balance": balance,
+        }
+        return ReverseProxy([route], connect_timeout=1.0, timeout=5.0, health_interval=0)
+
+    def fetch(self, proxy, path="/api/"):
+        """Forward a GET through the proxy and read its whole body."""
+        route = proxy.match(path)
+        response = proxy.forward(route, "GET", path, {"Host": "test"}, None, "127.0.0.1")
+        return response.status_code, b"".join(response.chunks).decode("utf-8")
+
+    def test_keep_alive_connection_is_reused(self):
+        backend = self.start_backend("a")
+        proxy = self.make_proxy(backend)
+        for _ in range(3):
+            self.assertEqual(self.fetch(proxy), (200, "a"))
+        upstream = proxy.upstreams[backend.address]
+        self.assertEqual(upstream.opened, 1)
+        self.assertEqual(upstream.reused, 2)
+        self.assertEqual(backend.connections, 1)
+
+    def test_stale_pooled_connection_is_retried(self):
+        backend = self.start_backend("a")
+        proxy = self.make_proxy(backend)
+        self.fetch(proxy)
+        backend.stop()
+        self.backends.remove(backend)
+        self.start_backend("a2", backend.port)
+        self.assertEqual(self.fetch(proxy), (200, "a2"))
+
+    def test_failover_to_next_upstream(self):
+        first = self.start_backend("a")
+        second = self.start_backend("b")
+        proxy = self.make_proxy(first, second)
+        first.stop()
+        self.backends.remove(first)
+        for _ in range(4):
+            self.assertEqual(self.fetch(proxy), (200, "b"))
+        self.assertFalse(proxy.upstreams[first.address].healthy)
+        self.assertTrue(proxy.upstreams[second.address].healthy)
+
+    def test_down_upstream_recovers_without_health_checks(self):
+        backend = self.start_backend("a")
+        proxy = self.make_proxy(backend)
+        upstream = proxy.upstreams[backend.address]
+        backend.stop()
+        self.backends.remove(backend)
+        with self.assertRaises(UpstreamError) as raised:
+            self.fetch(proxy)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertFalse(upstream.healthy)
+
+        self.start_backend("a", backend.port)
+        # Until the backoff has passed, the down upstream is not tried.
+        with self.assertRaises(UpstreamError):
+            self.fetch(proxy)
+        upstream.retry_at = 0.0
+        self.assertEqual(self.fetch(proxy), (200, "a"))
+        self.assertTrue(upstream.healthy)
+        self.assertEqual(self.fetch(proxy), (200, "a"))
+
+    def test_down_upstream_gets_one_trial_request_per_backoff(self):
+        first = self.start_backend("a")
+        second = self.start_backend("b")
+        proxy = self.make_proxy(first, second)
+        upstream = proxy.upstreams[first.address]
+        upstream.set_healthy(False)
+        for _ in range(3):
+            self.assertEqual(self.fetch(proxy), (200, "b"))
+        upstream.retry_at = 0.0
+        self.assertTrue(upstream.claim_retry())
+        self.assertFalse(upstream.claim_retry())
+        upstream.retry_at = 0.0
+        self.assertEqual(self.fetch(proxy), (200, "a"))
+        self.assertTrue(upstream.healthy)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import ipaddress
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import TABLE_SHARDS, RateLimiter
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def same_shard_addresses(count):
+    """Return client IPs whose table entries all land in the same shard."""
+    addresses = []
+    for n in range(1, 65536):
+        ip = f"10.0.{n // 256}.{n % 256}"
+        if hash(ipaddress.ip_address(ip).packed) % TABLE_SHARDS == 0:
+            addresses.append(ip)
+            if len(addresses) == count:
+                return addresses
+    raise AssertionError("Not enough addresses in one shard.")
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_throttled(self):
+        limiter = RateLimiter(requests=2, burst=3, clock=self.clock)
+        for _ in range(3):
+            self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+        self.assertAlmostEqual(limiter.check("192.0.2.1"), 0.5)
+        self.assertEqual(limiter.check("192.0.2.2"), 0.0)
+        self.assertEqual(limiter.stats()["Throttled (Request Rate)"], 1)
+
+    def test_steady_rate(self):
+        limiter = RateLimiter(requests=2, burst=1, clock=self.clock)
+        for _ in range(20):
+            self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+            self.clock.now += 0.5
+        # Idle time beyond a full bucket is not banked as extra burst.
+        self.clock.now += 0.25
+        self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+        self.assertAlmostEqual(limiter.check("192.0.2.1"), 0.5)
+
+    def test_bandwidth_bucket(self):
+        limiter = RateLimiter(bandwidth=1000, bandwidth_burst=2000, clock=self.clock)
+        self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+        limiter.charge("192.0.2.1", 5000)
+        self.assertAlmostEqual(limiter.check("192.0.2.1"), 3.0)
+        self.assertEqual(limiter.check("192.0.2.2"), 0.0)
+        self.clock.now = 3.0
+        self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+        self.assertEqual(limiter.stats()["Throttled (Bandwidth)"], 1)
+
+    def test_charge_for_untracked_client_is_ignored(self):
+        limiter = RateLimiter(bandwidth=1000, clock=self.clock)
+        limiter.charge("192.0.2.1", 5000)
+        self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+
+    def test_unlimited_clients_are_not_tracked(self):
+        limiter = RateLimiter(clock=self.clock)
+        for _ in range(10):
+            self.assertEqual(limiter.check("192.0.2.1"), 0.0)
+        self.assertEqual(limiter.stats()["Tracked Clients"], 0)
+
+    def test_full_table_evicts_least_recently_seen(self):
+        limiter = RateLimiter(requests=1, burst=1, table_size=2 * TABLE_SHARDS, clock=self.clock)
+        first, second, third = same_shard_addresses(3)
+        self.assertEqual(limiter.check(first), 0.0)
+        self.assertEqual(limiter.check(second), 0.0)
+        self.assertGreater(limiter.check(first), 0.0)
+        self.assertEqual(limiter.check(third), 0.0)
+        # The second client was seen least recently, so it was dropped and starts afresh.
+        self.assertGreater(limiter.check(first), 0.0)
+        self.assertEqual(limiter.check(second), 0.0)
+        stats = limiter.stats()
+        self.assertEqual(stats["Entries Evicted (Table Full)"], 2)
+        self.assertEqual(stats["Idle Entries Evicted"], 0)
+        self.assertEqual(stats["Tracked Clients"], 2)
+
+    def test_table_stays_bounded(self):
+        limiter = RateLimiter(requests=1, burst=1, table_size=2 * TABLE_SHARDS, clock=self.clock)
+        for n in range(1000):
+            limiter.check(f"10.1.{n // 256}.{n % 256}")
+        stats = limiter.stats()
+        self.assertLessEqual(stats["Tracked Clients"], stats["Table Capacity"])
+        self.assertEqual(stats["Entries Evicted (Table Full)"], 1000 - stats["Tracked Clients"])
+
+    def test_idle_entries_evicted(self):
+        limiter = RateLimiter(requests=1, burst=1, clock=self.clock)
+        first, second = same_shard_addresses(2)
+        limiter.check(first)
+        self.clock.now = 5.0
+        limiter.check(second)
+        stats = limiter.stats()
+        self.assertEqual(stats["Idle Entries Evicted"], 1)
+        self.assertEqual(stats["Entries Evicted (Table Full)"], 0)
+        self.assertEqual(stats["Tracked Clients"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
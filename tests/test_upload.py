@@ -0,0 +1,165 @@
+import base64
+import http.client
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logger import Logger
+from request_handler import HTTPRequestHandler
+
+CREDENTIALS = "ci:secret"
+MAX_UPLOAD_SIZE = 1024
+
+
+class UploadTest(unittest.TestCase):
+    """Uploads sent over real connections to the shared request handler."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.document_root = os.path.join(cls.tempdir.name, "www")
+        os.makedirs(cls.document_root)
+        cls.config = {
+            "host": "127.0.0.1",
+            "port": 0,
+            "document_root": cls.document_root,
+            "max_threads": 4,
+            "log_file": os.path.join(cls.tempdir.name, "server.log"),
+            "uploads": True,
+            "upload_credentials": CREDENTIALS,
+            "max_upload_size": MAX_UPLOAD_SIZE,
+            "body_timeout": 5,
+        }
+        cls.logger = Logger(cls.config["log_file"])
+        HTTPRequestHandler.setup_shared_state(cls.config, cls.logger)
+        cls.server = socket.create_server(("127.0.0.1", 0))
+        cls.port = cls.server.getsockname()[1]
+        threading.Thread(target=cls.accept_loop, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.logger.close()
+        cls.tempdir.cleanup()
+
+    @classmethod
+    def accept_loop(cls):
+        while True:
+            try:
+                conn, addr = cls.server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=HTTPRequestHandler.handle_client,
+                args=(conn, addr, cls.config, cls.logger),
+                daemon=True,
+            ).start()
+
+    def request(self, method, path, body=None, headers=None, credentials=CREDENTIALS, chunked=False):
+        headers = dict(headers or {})
+        if credentials is not None:
+            token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+            headers["Authorization"] = f"Basic {token}"
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request(method, path, body=body, headers=headers, encode_chunked=chunked)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def raw_request(self, data):
+        """Send raw request bytes and return the response's status code."""
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(data)
+            response = b""
+            while b"\r\n" not in response:
+                received = sock.recv(4096)
+                if not received:
+                    break
+                response += received
+        return int(response.split(b" ", 2)[1])
+
+    def read_file(self, name):
+        with open(os.path.join(self.document_root, name), "rb") as f:
+            return f.read()
+
+    def leftover_files(self, directory=""):
+        return [
+            name
+            for name in os.listdir(os.path.join(self.document_root, directory))
+            if name.startswith(".")
+        ]
+
+    def test_content_length_upload_is_created_then_replaced(self):
+        status, _ = self.request("PUT", "/new/dir/a.txt", b"first")
+        self.assertEqual(status, 201)
+        self.assertEqual(self.read_file("new/dir/a.txt"), b"first")
+        status, _ = self.request("PUT", "/new/dir/a.txt", b"second version")
+        self.assertEqual(status, 204)
+        self.assertEqual(self.read_file("new/dir/a.txt"), b"second version")
+        status, body = self.request("GET", "/new/dir/a.txt", credentials=None)
+        self.assertEqual((status, body), (200, b"second version"))
+
+    def test_chunked_upload_is_decoded(self):
+        pieces = [b"alpha ", b"beta ", b"", b"gamma"]
+        status, _ = self.request("POST", "/chunked.txt", iter(pieces), chunked=True)
+        self.assertEqual(status, 201)
+        self.assertEqual(self.read_file("chunked.txt"), b"alpha beta gamma")
+
+    def test_chunk_extensions_and_trailers_are_skipped(self):
+        status = self.raw_request(
+            b"PUT /trailer.txt HTTP/1.1\r\nHost: x\r\nAuthorization: Basic "
+            + base64.b64encode(CREDENTIALS.encode("utf-8"))
+            + b"\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+            b"3;name=value\r\nabc\r\n2\r\nde\r\n0\r\nX-Checksum: 1\r\n\r\n"
+        )
+        self.assertEqual(status, 201)
+        self.assertEqual(self.read_file("trailer.txt"), b"abcde")
+
+    def test_declared_length_over_limit_gets_413(self):
+        status, _ = self.request("PUT", "/too-big.bin", b"x" * (MAX_UPLOAD_SIZE + 1))
+        self.assertEqual(status, 413)
+        self.assertFalse(os.path.exists(os.path.join(self.document_root, "too-big.bin")))
+
+    def test_chunked_body_over_limit_gets_413(self):
+        pieces = [b"x" * 512] * 3
+        status, _ = self.request("PUT", "/too-big-chunked.bin", iter(pieces), chunked=True)
+        self.assertEqual(status, 413)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.document_root, "too-big-chunked.bin"))
+        )
+        self.assertEqual(self.leftover_files(), [])
+
+    def test_missing_or_wrong_credentials_get_401(self):
+        for credentials in (None, "ci:wrong", "other:secret"):
+            status, _ = self.request("PUT", "/denied.txt", b"data", credentials=credentials)
+            self.assertEqual(status, 401)
+        self.assertFalse(os.path.exists(os.path.join(self.document_root, "denied.txt")))
+
+    def test_failed_upload_leaves_the_old_file_in_place(self):
+        self.request("PUT", "/atomic/keep.txt", b"old contents")
+        status = self.raw_request(
+            b"PUT /atomic/keep.txt HTTP/1.1\r\nHost: x\r\nAuthorization: Basic "
+            + base64.b64encode(CREDENTIALS.encode("utf-8"))
+            + b"\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"4\r\nnew \r\nzz\r\n"
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(self.read_file("atomic/keep.txt"), b"old contents")
+        self.assertEqual(self.leftover_files("atomic"), [])
+
+    def test_upload_over_a_directory_gets_409(self):
+        os.makedirs(os.path.join(self.document_root, "adir"), exist_ok=True)
+        status, _ = self.request("PUT", "/adir", b"data")
+        self.assertEqual(status, 409)
+        self.assertTrue(os.path.isdir(os.path.join(self.document_root, "adir")))
+
+
+if __name__ == "__main__":
+    unittest.main()
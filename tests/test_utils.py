@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import parse_range_header
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+
+    def test_single_and_suffix_ranges(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(parse_range_header("bytes=900-", 1000), [(900, 999)])
+        self.assertEqual(parse_range_header("bytes=-100", 1000), [(900, 999)])
+        self.assertEqual(parse_range_header("bytes=990-2000", 1000), [(990, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header("bytes=0-9,5-19,20-29", 1000), [(0, 29)])
+        self.assertEqual(parse_range_header("bytes=500-599,0-9,0-0", 1000), [(0, 9), (500, 599)])
+        self.assertEqual(parse_range_header("bytes=0-0,0-0,0-0", 1000), [(0, 0)])
+
+    def test_ranges_covering_the_whole_resource_are_ignored(self):
+        self.assertIsNone(parse_range_header("bytes=0-0,0-0,0-", 300000))
+        self.assertIsNone(parse_range_header("bytes=0-", 1000))
+        self.assertIsNone(parse_range_header("bytes=0-499,-500", 1000))
+
+    def test_too_many_or_malformed_ranges_are_ignored(self):
+        self.assertIsNone(parse_range_header("bytes=" + ",".join(["0-0"] * 17), 1000))
+        self.assertIsNone(parse_range_header("bytes=5-1", 1000))
+        self.assertIsNone(parse_range_header("items=0-1", 1000))
+        self.assertIsNone(parse_range_header("bytes=a-b", 1000))
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header("bytes=1000-", 1000), [])
+        self.assertEqual(parse_range_header("bytes=-0", 1000), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
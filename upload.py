@@ -0,0 +1,238 @@
+import os
+import tempfile
+import threading
+from collections import Counter
+from http_parser import RequestParseError
+
+# Methods whose body is stored as the file at the request path.
+UPLOAD_METHODS = ("PUT", "POST")
+
+# Longest chunk-size line, and most trailer bytes, accepted in a chunked body.
+MAX_CHUNK_LINE = 1024
+MAX_TRAILER_SIZE = 8192
+
+
+class RequestBody:
+    """Streams one request body off the connection in bounded pieces.
+
+    The body is read through the connection's RequestParser buffer, which
+    may already hold its first bytes; bytes past its end stay there for the
+    next (pipelined) request. Memory use is bounded by the receive buffer,
+    whatever the body size.
+    """
+
+    def __init__(self, parser, receive, headers, max_size):
+        """Work out how the body is framed and check it against the size cap.
+
+        Args:
+            parser (RequestParser): The connection's parser, past the request head.
+            receive (callable): Returns the next bytes from the connection,
+                empty when it is closed. May raise RequestParseError.
+            headers (dict): The request headers.
+            max_size (int): Largest body accepted, in bytes.
+
+        Raises:
+            RequestParseError: If the framing is missing (411), invalid (400)
+                or unsupported (501), or the declared length is too large (413).
+        """
+        self.parser = parser
+        self.receive = receive
+        self.max_size = max_size
+        self.received = 0
+        transfer_encoding = headers.get("Transfer-Encoding")
+        content_length = headers.get("Content-Length")
+        if transfer_encoding is not None:
+            # Both headers at once is how requests are smuggled past proxies.
+            if content_length is not None:
+                raise RequestParseError(400, "Both Content-Length and Transfer-Encoding sent")
+            if transfer_encoding.strip().lower() != "chunked":
+                raise RequestParseError(501, f"Unsupported transfer coding '{transfer_encoding}'")
+            self.length = None
+        elif content_length is not None:
+            if not (content_length.isascii() and content_length.isdigit()):
+                raise RequestParseError(400, "Invalid Content-Length")
+            self.length = int(content_length)
+            if self.length > max_size:
+                raise RequestParseError(413, "Request body too large")
+        else:
+            raise RequestParseError(411, "Content-Length or chunked encoding required")
+
+    def __iter__(self):
+        """Yield the decoded body in pieces of at most one receive buffer.
+
+        Raises:
+            RequestParseError: If the body is malformed (400), grows past the
+                size cap (413), stalls (408) or the connection closes early (400).
+        """
+        if self.length is None:
+            return self.read_chunked()
+        return self.read_exact(self.length)
+
+    def fill(self):
+        """Receive more bytes into the parser buffer."""
+        data = self.receive()
+        if not data:
+            raise RequestParseError(400, "Connection closed before the request body was complete")
+        self.parser.feed(data)
+
+    def read_exact(self, count):
+        buffer = self.parser.buffer
+        while count:
+            if not buffer:
+                self.fill()
+            size = min(count, len(buffer))
+            piece = buffer[:size]
+            del buffer[:size]
+            count -= size
+            yield piece
+
+    def read_line(self):
+        buffer = self.parser.buffer
+        while True:
+            end = buffer.find(b"\r\n")
+            if end != -1:
+                line = bytes(buffer[:end])
+                del buffer[: end + 2]
+                return line
+            if len(buffer) > MAX_CHUNK_LINE:
+                raise RequestParseError(400, "Chunk size line too long")
+            self.fill()
+
+    def read_chunked(self):
+        while True:
+            line = self.read_line()
+            if len(line) > MAX_CHUNK_LINE:
+                raise RequestParseError(400, "Chunk size line too long")
+            size_text = line.split(b";", 1)[0].strip()
+            # int(..., 16) would also take "0x", "+" and "_"; the grammar is HEXDIG only.
+            if not size_text or size_text.strip(b"0123456789abcdefABCDEF"):
+                raise RequestParseError(400, "Invalid chunk size")
+            size = int(size_text, 16)
+            if not size:
+                break
+            self.received += size
+            if self.received > self.max_size:
+                raise RequestParseError(413, "Request body too large")
+            yield from self.read_exact(size)
+            if self.read_line():
+                raise RequestParseError(400, "Chunk data not followed by CRLF")
+        # Trailer fields are read and ignored.
+        trailer_size = 0
+        while True:
+            line = self.read_line()
+            if not line:
+                return
+            trailer_size += len(line) + 2
+            if trailer_size > MAX_TRAILER_SIZE:
+                raise RequestParseError(400, "Trailer section too large")
+
+
+class AtomicUpload:
+    """Writes an upload to a temporary file beside its target, then renames it into place.
+
+    Readers never see a partly written file: until commit() they get the old
+    version, and responses already sending the old version keep its open
+    file. A failed or abandoned upload leaves only its target untouched.
+    """
+
+    def __init__(self, target_path):
+        """Create the temporary file, and the target's missing parent directories.
+
+        Args:
+            target_path (str): Resolved path the upload replaces or creates.
+
+        Raises:
+            OSError: If the directory or temporary file cannot be created.
+        """
+        self.target_path = target_path
+        directory = os.path.dirname(target_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        """Move the complete upload over its target.
+
+        Returns:
+            bool: True if the target did not exist before.
+        """
+        self.file.close()
+        # mkstemp() creates the file readable by its owner only.
+        os.chmod(self.temp_path, 0o644)
+        created = not os.path.exists(self.target_path)
+        os.replace(self.temp_path, self.target_path)
+        self.temp_path = None
+        return created
+
+    def close(self):
+        """Discard the temporary file unless the upload was committed."""
+        self.file.close()
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+
+class UploadStats:
+
+    def __init__(self, max_size):
+        """Initialize the upload counters.
+
+        Args:
+            max_size (int): The configured upload size cap, for display.
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.stored = 0
+        self.bytes_stored = 0
+        self.rejected = Counter()  # status code -> uploads refused or abandoned
+
+    def started(self):
+        with self.lock:
+            self.in_progress += 1
+
+    def finished(self, status_code, size=0):
+        """Count an upload that was stored (2xx) or failed with an error status.
+
+        Args:
+            status_code (int): The status the upload was answered with.
+            size (int, optional): Bytes stored. Defaults to 0.
+        """
+        with self.lock:
+            self.in_progress -= 1
+            if status_code < 300:
+                self.stored += 1
+                self.bytes_stored += size
+            else:
+                self.rejected[status_code] += 1
+
+    def stats(self):
+        """Return a snapshot of the upload statistics.
+
+        Returns:
+            dict: Uploads in progress, stored and rejected by status.
+        """
+        with self.lock:
+            stats = {
+                "Max Upload Size (bytes)": self.max_size,
+                "Uploads in Progress": self.in_progress,
+                "Uploads Stored": self.stored,
+                "Bytes Stored": self.bytes_stored,
+            }
+            for status_code, count in sorted(self.rejected.items()):
+                stats[f"Uploads Rejected ({status_code})"] = count
+            return stats
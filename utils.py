@@ -1,13 +1,24 @@
 from pathlib import Path
+from urllib.parse import quote, unquote
 
 
 import os
+import re
+
+# A "%" not followed by two hex digits.
+MALFORMED_ESCAPE = re.compile(r"%(?![0-9A-Fa-f]{2})")
+
+# Characters left unescaped when a decoded path is put back into a URL.
+PATH_SAFE = "/:@!$&'()*+,;="
 
 
 def safe_path(document_root, request_path):
     """
     Resolve a safe file system path within the document root to prevent directory traversal attacks.
 
+    Symlinks are followed for the check, so a link under the document root
+    that points outside it is refused too.
+
     Parameters:
         document_root (str): The base directory where static files are served from.
         request_path (str): The requested URL path (e.g., "/index.html" or "/subdir/file.txt").
@@ -28,13 +39,56 @@ def safe_path(document_root, request_path):
     requested_full_path = os.path.abspath(os.path.normpath(requested_full_path))
     document_root_abs = os.path.abspath(document_root)
 
-    # Ensure that the requested path is within the document root
-    if not requested_full_path.startswith(document_root_abs):
+    # Ensure that the requested path is within the document root. The prefix
+    # ends with a separator, so a sibling such as "/www2" is not inside "/www".
+    if requested_full_path != document_root_abs and not requested_full_path.startswith(
+        os.path.join(document_root_abs, "")
+    ):
         raise ValueError("Invalid request path: directory traversal attempt detected.")
 
+    # A symlink along the way may still lead out, so compare the real paths
+    # too. The lexical path is returned, so links inside the root keep their URLs.
+    real_root = os.path.realpath(document_root_abs)
+    real_path = os.path.realpath(requested_full_path)
+    if real_path != real_root and not real_path.startswith(os.path.join(real_root, "")):
+        raise ValueError("Invalid request path: symlink leads outside the document root.")
+
     return requested_full_path
 
 
+def decode_path(request_path):
+    """Percent-decode a URL path, once.
+
+    Escapes that are not valid UTF-8 become surrogate escapes, as
+    os.fsdecode() does for such file names, so links to those files
+    round-trip.
+
+    Args:
+        request_path (str): The path as sent by the client, without the query string.
+
+    Returns:
+        str: The decoded path.
+
+    Raises:
+        ValueError: If the path has a malformed escape or decodes to a NUL character.
+    """
+    if "%" not in request_path:
+        if "\x00" in request_path:
+            raise ValueError("NUL character in request path")
+        return request_path
+    if MALFORMED_ESCAPE.search(request_path):
+        raise ValueError("Malformed percent-escape in request path")
+    path = unquote(request_path, errors="surrogateescape")
+    if "\x00" in path:
+        raise ValueError("NUL character in request path")
+    return path
+
+
+def encode_path(path):
+    """Percent-encode a decoded URL path for use in a request target or Location header."""
+    return quote(path, safe=PATH_SAFE, errors="surrogateescape")
+
+
 def http_date_format(dt):
     """Format a datetime object int o an HTTP-date string as per RFC 7231
 
@@ -45,3 +99,63 @@ def http_date_format(dt):
         str: The formatted HTTP date string (e.g., "Mon, 25 Feb 2025 14:30:00 GMT").
     """
     return dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+def parse_range_header(range_header, size, max_ranges=16):
+    """Parse a "Range: bytes=..." header against a resource size.
+
+    Args:
+        range_header (str): The Range header value, e.g. "bytes=0-99,-500".
+        size (int): The size of the resource in bytes.
+        max_ranges (int, optional): Most ranges accepted in one request. Defaults to 16.
+
+    Overlapping and adjacent ranges are merged, so a request can never
+    make the server send a byte more than once (RFC 9110 section 14.2).
+
+    Returns:
+        list: Satisfiable (start, end) pairs with inclusive ends, in ascending
+        order; empty if no range is satisfiable. None if the header is
+        malformed, uses another unit, asks for too many ranges, or its
+        ranges cover the whole resource, in which case it should be ignored
+        and the full resource sent.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    specs = [part.strip() for part in spec.split(",") if part.strip()]
+    if not specs or len(specs) > max_ranges:
+        return None
+    for part in specs:
+        first, dash, last = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes.
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix == 0 or size == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if start < 0 or (last and end < start):
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    if merged and sum(end - start + 1 for start, end in merged) >= size:
+        return None
+    return merged
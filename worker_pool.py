@@ -0,0 +1,174 @@
+import queue
+import threading
+import time
+
+
+SERVICE_UNAVAILABLE_BODY = b"<html><body><h1>503 Service Unavailable</h1></body></html>"
+
+
+def build_unavailable_response(retry_after):
+    """Build the canned 503 response sent when the connection queue is full.
+
+    Args:
+        retry_after (int): Value of the Retry-After header in seconds.
+
+    Returns:
+        bytes: The complete HTTP response.
+    """
+    return (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Content-Type: text/html\r\n"
+        + f"Content-Length: {len(SERVICE_UNAVAILABLE_BODY)}\r\n".encode("ascii")
+        + f"Retry-After: {retry_after}\r\n".encode("ascii")
+        + b"Connection: close\r\n\r\n"
+        + SERVICE_UNAVAILABLE_BODY
+    )
+
+
+def send_and_close(client_conn, response):
+    """Send a canned response on a connection without blocking, then close it.
+
+    Closing with the request unread would reset the connection before the
+    client reads the response, so what already arrived is read first.
+
+    Args:
+        client_conn (socket.socket): The connection, not yet read from.
+        response (bytes): The complete HTTP response.
+    """
+    try:
+        client_conn.setblocking(False)
+        try:
+            client_conn.recv(65536)
+        except BlockingIOError:
+            pass
+        client_conn.send(response)
+    except OSError:
+        pass
+    finally:
+        client_conn.close()
+
+
+class WorkerPool:
+
+    def __init__(
+        self,
+        num_workers,
+        queue_size,
+        handler,
+        logger,
+        retry_after=1,
+        shedder=None,
+        on_shed=None,
+    ):
+        """Initialize a fixed-size pool of worker threads fed by a bounded queue.
+
+        Args:
+            num_workers (int): Number of worker threads.
+            queue_size (int): Maximum number of accepted connections waiting for a worker.
+            handler (callable): Called as handler(client_conn, client_addr) by a worker.
+            logger (Logger): The logger instance.
+            retry_after (int, optional): Retry-After value for rejected connections. Defaults to 1.
+            shedder (LoadShedder, optional): Told each connection's queueing delay; connections
+                it sheds get the canned 503 instead of a handler. Defaults to None.
+            on_shed (callable, optional): Called as on_shed(client_addr) for each shed
+                connection. Defaults to None.
+        """
+        self.num_workers = max(1, num_workers)
+        self.queue_size = max(1, queue_size)
+        self.handler = handler
+        self.logger = logger
+        self.unavailable_response = build_unavailable_response(retry_after)
+        self.shedder = shedder
+        self.on_shed = on_shed
+        self.connections = queue.Queue(maxsize=self.queue_size)
+        self.workers = []
+
+        self.lock = threading.Lock()
+        self.busy_workers = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def start(self):
+        """Start the worker threads."""
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self.worker_loop, name=f"worker-{i}", daemon=True
+            )
+            thread.start()
+            self.workers.append(thread)
+
+    def submit(self, client_conn, client_addr):
+        """Queue an accepted connection, or reject it with a 503 if the queue is full.
+
+        Args:
+            client_conn (socket.socket): The client socket connection.
+            client_addr (tuple): The client's address.
+
+        Returns:
+            bool: True if the connection was queued; False if it was rejected.
+        """
+        if self.shedder is not None:
+            self.shedder.queued()
+        try:
+            self.connections.put_nowait((client_conn, client_addr, time.monotonic()))
+            return True
+        except queue.Full:
+            if self.shedder is not None:
+                self.shedder.unqueued()
+            with self.lock:
+                self.rejected += 1
+            self.reject(client_conn)
+            return False
+
+    def reject(self, client_conn):
+        """Send the canned 503 response without blocking the accept loop, then close."""
+        send_and_close(client_conn, self.unavailable_response)
+
+    def worker_loop(self):
+        """Take connections from the queue and hand them to the handler."""
+        while True:
+            client_conn, client_addr, queued_at = self.connections.get()
+            wait = time.monotonic() - queued_at
+            if self.shedder is not None and self.shedder.observe(wait):
+                # Overloaded: the oldest connections are answered cheaply, not served late.
+                self.reject(client_conn)
+                if self.on_shed is not None:
+                    self.on_shed(client_addr)
+                continue
+            with self.lock:
+                self.busy_workers += 1
+                self.accepted += 1
+                self.total_wait += wait
+                self.last_wait = wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+            try:
+                self.handler(client_conn, client_addr)
+            except Exception as e:
+                self.logger.log_error(f"Worker error for {client_addr[0]}: {e}")
+            finally:
+                with self.lock:
+                    self.busy_workers -= 1
+
+    def stats(self):
+        """Return a snapshot of the pool statistics.
+
+        Returns:
+            dict: Worker, queue and wait-time figures.
+        """
+        with self.lock:
+            average_wait = self.total_wait / self.accepted if self.accepted else 0.0
+            return {
+                "Workers": self.num_workers,
+                "Busy Workers": self.busy_workers,
+                "Queue Depth": self.connections.qsize(),
+                "Queue Capacity": self.queue_size,
+                "Connections Handled": self.accepted,
+                "Connections Rejected (503)": self.rejected,
+                "Average Queue Wait (ms)": round(average_wait * 1000, 3),
+                "Last Queue Wait (ms)": round(self.last_wait * 1000, 3),
+                "Max Queue Wait (ms)": round(self.max_wait * 1000, 3),
+            }